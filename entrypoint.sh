@@ -5,4 +5,7 @@ python3.6 manage.py migrate
 python3.6 manage.py collectstatic --noinput
 python3.6 manage.py compress
 
-gunicorn hamlet.wsgi -b 0.0.0.0:8000 -w 2
+# Processes uploaded documents; see hamlet/theses/jobs.py.
+python3.6 manage.py run_upload_jobs &
+
+gunicorn hamlet.wsgi -b 0.0.0.0:8000 -w 2 --preload
@@ -0,0 +1,28 @@
+"""gunicorn settings for the web process in the Procfile (`gunicorn -c
+gunicorn.conf.py`). Everything else is set on the command line."""
+import os
+
+from gevent import monkey
+
+worker_class = 'gevent'
+
+# gevent workers monkeypatch themselves after they fork, but with --preload
+# the master imports the app (and with it Django) before then. Anything
+# created at import time with the unpatched threading module - Django's
+# per-thread database connections and caches, its active translation, raven's
+# context, hamlet.common.timing's current request - would then be shared by
+# every greenlet in a worker, and Django refuses to use a database connection
+# from a greenlet other than the one which opened it. So patch here, before
+# the app is loaded.
+monkey.patch_all()
+
+
+def post_fork(server, worker):
+    # Start the model executor's pool as soon as the worker exists, rather
+    # than in the middle of its first request (see
+    # hamlet.common.executor.start_pool).
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'hamlet.settings.base')
+    import django
+    django.setup()
+    from hamlet.common import executor
+    executor.start_pool()
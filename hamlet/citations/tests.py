@@ -1,13 +1,15 @@
 import os
-from unittest import skip
 
 from django.conf import settings
 from django.urls import reverse
 from django.test import Client, TestCase, override_settings
+from django.utils.html import escape
 
 
 @override_settings(COMPRESS_ENABLED=False)
 class ViewTests(TestCase):
+    fixtures = ['theses.json', 'departments.json', 'authors.json',
+                'contributions.json', 'citations.json']
 
     def setUp(self):
         self.client = Client()
@@ -32,7 +34,8 @@ class ViewTests(TestCase):
         url = reverse('citations:lit_review_buddy')
         with open(os.path.join(self.fix_path, '1721.1-33360.txt'), 'rb') as fp:
             response = self.client.post(url,
-                {"file": fp, "captcha_0": "sometext", "captcha_1": "PASSED"})
+                {"file": fp, "captcha_0": "sometext", "captcha_1": "PASSED"},
+                follow=True)
 
         assert response.status_code == 200
         assert 'suggestions' in response.context
@@ -40,12 +43,9 @@ class ViewTests(TestCase):
         template_names = [t.name for t in response.templates]
         assert 'citations/lit_review_outcomes.html' in template_names
 
-    # This is failing, even though performing the same behavior in the
-    # browser, with the test settings file, works. It looks like infer_vector
-    # maybe doesn't return the same thing each time (!) and so this test can
-    # fail even when a very similar one in hamlet/theses/tests/test_views.py
-    # succeeds.
-    @skip
+    # infer_vector used to return a slightly different vector each time,
+    # which made this flaky; hamlet.common.inferred_vectors now seeds it per
+    # document. The citation belongs to the thesis the upload was taken from.
     def test_citations_found(self):
         '''
         Check that we get the expected suggestions on a successful post.
@@ -54,6 +54,7 @@ class ViewTests(TestCase):
         url = reverse('citations:lit_review_buddy')
         with open(os.path.join(self.fix_path, '1721.1-33360.txt'), 'rb') as fp:
             response = self.client.post(url,
-                {"file": fp, "captcha_0": "sometext", "captcha_1": "PASSED"})
+                {"file": fp, "captcha_0": "sometext", "captcha_1": "PASSED"},
+                follow=True)
 
-        assert citation in response.content.decode('utf-8')
+        assert escape(citation) in response.content.decode('utf-8')
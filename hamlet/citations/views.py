@@ -1,9 +1,9 @@
-from django.shortcuts import render
+from django.http import HttpResponseRedirect
 from django.views.generic.edit import FormView
 
-from hamlet.common.document import factory
 from hamlet.common.forms import UploadFileForm
-from hamlet.common.inferred_vectors import get_similar_documents
+from hamlet.theses import jobs
+from hamlet.theses.models import UploadJob
 
 
 class LitReviewBuddyView(FormView):
@@ -11,12 +11,6 @@ class LitReviewBuddyView(FormView):
     form_class = UploadFileForm
 
     def form_valid(self, form):
-        context = {}
-        doc = factory(self.request.FILES['file'])
-        simdocs = get_similar_documents(doc)
-        context['suggestions'] = simdocs
-        context['total_suggestions'] = sum([
-            doc.citation_set.count() for doc in simdocs
-        ])
-        return render(self.request, 'citations/lit_review_outcomes.html',
-            context)
+        # The results are shown by hamlet.theses.views.UploadJobView.
+        job = jobs.submit(UploadJob.LIT_REVIEW, self.request.FILES['file'])
+        return HttpResponseRedirect(job.get_absolute_url())
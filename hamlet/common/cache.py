@@ -0,0 +1,46 @@
+import hashlib
+import uuid
+
+from django.core.cache import caches
+
+from hamlet.common.neural_net import fingerprint
+
+# Where the similarity cache keeps its version; see cache_version().
+VERSION_KEY = 'hamlet:version'
+
+
+def similarity_cache():
+    """The cache for anything derived from the neural net (see
+    settings.CACHES)."""
+    return caches['similarity']
+
+
+def cache_version():
+    """A token which is part of every cache key, so that changing it (see
+    bump_version) invalidates everything cached. If the cache has lost it,
+    a new one is made, which likewise just invalidates everything."""
+    cache = similarity_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, uuid.uuid4().hex[:12], None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_version():
+    """Invalidate everything in the similarity cache. Call this after
+    changing data which cached pages show without it being part of their
+    keys, like the ThesisNeighbor table."""
+    similarity_cache().set(VERSION_KEY, uuid.uuid4().hex[:12], None)
+
+
+def cache_key(*parts):
+    """Build a cache key from parts which identify the cached thing (e.g. a
+    view name and a thesis identifier) plus the model fingerprint, so that
+    deploying a new model automatically invalidates everything cached under
+    the old one, and the cache version."""
+    raw = ':'.join(str(part) for part in parts)
+    # Hash so that arbitrary parts (e.g. query strings) make safe keys.
+    digest = hashlib.md5(raw.encode('utf-8')).hexdigest()
+    return 'hamlet:{}:{}:{}'.format(fingerprint()[:12], cache_version(),
+                                    digest)
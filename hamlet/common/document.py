@@ -1,68 +1,147 @@
+import codecs
+
 from chardet.universaldetector import UniversalDetector
+from django.conf import settings
 from django.core.exceptions import ValidationError
 import docx
 import magic
 
+from hamlet.common.timing import timed
+from hamlet.common.tokens import tokenize
+
+# How much of an upload to look at when working out its type and encoding.
+SNIFF_BYTES = 64 * 1024
+CHUNK_BYTES = 64 * 1024
+
+_WHITESPACE = ' \t\n\r\f\v'
 
-def factory(fp):
+
+@timed('open')
+def factory(fp, vocab):
     """Factory for creating a document object.
 
     A Document must implement a `words` property that consists of a list
     of words in that document.
 
     :param fp: `django.core.files.uploadedfile.UploadedFile`
+    :param vocab: the model's vocabulary (see BaseDocument)
     :return: document object
     """
-    mimetype = magic.from_buffer(fp.read(8192), mime=True)
+    fp.seek(0)
+    prefix = fp.read(SNIFF_BYTES)
+    fp.seek(0)
+    mimetype = magic.from_buffer(prefix[:8192], mime=True)
     if mimetype == "text/plain":
-        return TextDocument(fp)
+        return TextDocument(fp, vocab, prefix=prefix)
     elif mimetype in ("application/vnd.openxmlformats-officedocument.wordprocessingml.document",
                       "application/zip"):
         # magic has been observed identifying docx as both mimetypes
         try:
-            return DocxDocument(fp)
+            return DocxDocument(fp, vocab)
         except:
             raise ValidationError("Invalid document type")
     else:
         raise ValidationError("Invalid document type")
 
 
-class TextDocument:
-    """Document object for representing a text document."""
-    def __init__(self, doc):
-        self.doc = doc
-        self._words = []
-        self._encoding = ""
+class BaseDocument:
+    """Tokenizes a document the same way the training corpus was (see
+    hamlet.common.tokens), stopping after max_tokens words that are in the
+    model's vocabulary.
+
+    When inferring a vector, gensim skips words that aren't in the
+    vocabulary and stops after the first 10,000 that are, so by default
+    (settings.DOCUMENT_MAX_TOKENS) there's no point reading further. Out of
+    vocabulary tokens (numbers, punctuation, rare names) are kept in `words`
+    but don't count towards the limit. So that a document with hardly any
+    vocabulary words can't make us read without end, reading also stops
+    after READ_LIMIT_FACTOR * max_tokens tokens in all.
+
+    `vocab` can be anything supporting `in`; callers pass the model's
+    (`model.wv.vocab`), so that documents don't load the model themselves."""
+    READ_LIMIT_FACTOR = 10
+
+    def __init__(self, vocab, max_tokens=None):
+        self.vocab = vocab
+        self.max_tokens = max_tokens or settings.DOCUMENT_MAX_TOKENS
+        self._words = None
+
+    def texts(self):
+        """Yields the document's text in pieces which break at whitespace."""
+        raise NotImplementedError
+
+    def tokens(self):
+        vocab = self.vocab
+        count = 0
+        read_limit = self.READ_LIMIT_FACTOR * self.max_tokens
+        read = 0
+        for text in self.texts():
+            for token in tokenize(text):
+                yield token
+                read += 1
+                if token in vocab:
+                    count += 1
+                if count >= self.max_tokens or read >= read_limit:
+                    return
 
     @property
     def words(self):
-        if not self._words:
-            for line in self.doc:
-                self._words.extend(line.decode(self.encoding).strip().split())
+        if self._words is None:
+            self._words = self._read_words()
         return self._words
 
+    @timed('parse')
+    def _read_words(self):
+        return list(self.tokens())
+
+
+class TextDocument(BaseDocument):
+    """Document object for representing a text document.
+
+    The file is read once, in chunks, and decoded incrementally, so memory
+    use doesn't depend on the size of the upload."""
+    def __init__(self, doc, vocab, prefix=None, max_tokens=None):
+        super(TextDocument, self).__init__(vocab, max_tokens)
+        self.doc = doc
+        self._prefix = prefix
+        self._encoding = ""
+
     @property
     def encoding(self):
         if not self._encoding:
+            if self._prefix is None:
+                self.doc.seek(0)
+                self._prefix = self.doc.read(SNIFF_BYTES)
+                self.doc.seek(0)
             detector = UniversalDetector()
-            for line in self.doc:
-                detector.feed(line)
-                if detector.done:
-                    break
+            detector.feed(self._prefix)
             detector.close()
-            self._encoding = detector.result['encoding']
+            self._encoding = detector.result['encoding'] or 'utf-8'
         return self._encoding
 
+    def texts(self):
+        decoder = codecs.getincrementaldecoder(self.encoding)(errors='replace')
+        self.doc.seek(0)
+        pending = ''
+        for chunk in iter(lambda: self.doc.read(CHUNK_BYTES), b''):
+            pending += decoder.decode(chunk)
+            # Hold back anything after the last whitespace, which might be
+            # the start of a word that continues in the next chunk.
+            cut = max(pending.rfind(space) for space in _WHITESPACE) + 1
+            if cut:
+                yield pending[:cut]
+                pending = pending[cut:]
+        pending += decoder.decode(b'', final=True)
+        if pending:
+            yield pending
+
 
-class DocxDocument:
+class DocxDocument(BaseDocument):
     """Document object for representing a DOCX document."""
-    def __init__(self, doc):
-        self._words = []
+    def __init__(self, doc, vocab, max_tokens=None):
+        super(DocxDocument, self).__init__(vocab, max_tokens)
         self.doc = docx.Document(doc)
 
-    @property
-    def words(self):
-        if not self._words:
-            for p in self.doc.paragraphs:
-                self._words.extend(p.text.strip().split())
-        return self._words
+    def texts(self):
+        for p in self.doc.paragraphs:
+            yield p.text
@@ -0,0 +1,232 @@
+"""Runs CPU-bound neural net calls, optionally in a pool of processes.
+
+gunicorn runs the web app with gevent workers, where one worker serves many
+requests concurrently by switching between greenlets whenever a request waits
+on I/O. Neural net math (inference, similarity searches) never waits on I/O,
+so while one request is doing it, every other request on that worker is
+stuck - including cheap ones that don't touch the model at all.
+
+With settings.MODEL_EXECUTOR_PROCESSES > 0, the functions in this module
+send the work to a pool of that many processes and wait for the result
+cooperatively, so the worker keeps serving other requests in the meantime.
+The pool processes are forked from the web worker, so they share its
+(memory-mapped, see hamlet.common.neural_net) copy of the model rather than
+loading their own. With MODEL_EXECUTOR_PROCESSES = 0 (the default) the work
+is done in the calling process, as before.
+
+Callers should use the public functions below rather than calling the model
+or index directly from request code."""
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import hashlib
+import logging
+import os
+import sys
+import threading
+
+import numpy as np
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from hamlet.common.neural_net import get_index, get_model
+from hamlet.common.timing import timed
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_pid = None
+_lock = threading.Lock()
+# Guards the model's random state during inference; see _infer_vector.
+_infer_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool, _pool_pid
+    # A pool belongs to the process that created it. Check the pid so that a
+    # gunicorn worker forked from a master which had a pool makes its own.
+    if _pool is None or _pool_pid != os.getpid():
+        with _lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ProcessPoolExecutor(
+                    max_workers=settings.MODEL_EXECUTOR_PROCESSES)
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def _reset_pool(terminate=False):
+    """Drop this process's pool, so the next call starts a new one. With
+    terminate, also kill its processes, which shutdown() alone leaves to
+    finish whatever they're running.
+
+    This waits for the old pool's management thread to finish. Under gevent
+    that thread is a greenlet, and one still running when the new pool forks
+    its processes would be copied into them, and run there."""
+    global _pool
+    with _lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            if terminate:
+                # ProcessPoolExecutor has no public way to kill its processes,
+                # so this uses its private _processes, a {pid: Process} dict
+                # in every CPython from 3.6 (which we deploy) to 3.13. On
+                # those versions, other calls in flight in the pool then fail
+                # with BrokenProcessPool, except on 3.7 and 3.8, where they
+                # wait out their own timeouts instead. Recheck this when
+                # upgrading Python.
+                for process in list((_pool._processes or {}).values()):
+                    process.terminate()
+            _pool.shutdown(wait=True)
+        _pool = None
+
+
+def _noop():
+    pass
+
+
+def start_pool():
+    """Start this process's pool, with its processes and its queue
+    management thread, if settings.MODEL_EXECUTOR_PROCESSES says to have one.
+
+    gunicorn.conf.py calls this in post_fork, so that each web worker forks
+    its pool processes at startup rather than during its first request.
+    Otherwise the pool is started by the first model call, which is also how
+    a pool replaced after a timeout or a crash gets started. In a gevent
+    worker the management thread is a greenlet either way; that works, since
+    it blocks only on (patched) pipe reads."""
+    if settings.MODEL_EXECUTOR_PROCESSES:
+        _get_pool().submit(_noop).result()
+
+
+def _gevent_patched():
+    if 'gevent' not in sys.modules:
+        return False
+    from gevent import monkey
+    return monkey.is_module_patched('threading')
+
+
+def _wait(future, timeout):
+    if not _gevent_patched():
+        return future.result(timeout)
+
+    # future.result() would block the whole gevent worker, so wait on a
+    # gevent Event, which lets other greenlets run meanwhile, and have the
+    # future set it when it's done. (That happens in the pool's management
+    # thread; gevent's Event can be set from any thread since gevent 20.12.)
+    from gevent.event import Event
+    done = Event()
+    future.add_done_callback(lambda future: done.set())
+    if not done.wait(timeout):
+        future.cancel()
+        raise TimeoutError()
+    return future.result()
+
+
+def run(func, *args):
+    """Call func(*args) in the pool if there is one, or here if not. func
+    must be a module-level function (so the pool can pickle it)."""
+    if not settings.MODEL_EXECUTOR_PROCESSES:
+        return func(*args)
+
+    try:
+        future = _get_pool().submit(func, *args)
+        return _wait(future, settings.MODEL_EXECUTOR_TIMEOUT)
+    except TimeoutError:
+        # Cancelling can't stop a call that's already running, so a stuck
+        # call would hold its pool process forever. Kill the pool instead;
+        # calls still in flight in it fail with BrokenProcessPool.
+        logger.error('Model executor call timed out; restarting the pool')
+        _reset_pool(terminate=True)
+        raise
+    except BrokenProcessPool:
+        # A pool process died (e.g. killed by the OOM killer); start a fresh
+        # pool for the next call.
+        logger.exception('Model executor pool broke; restarting it')
+        _reset_pool()
+        raise
+
+
+# Functions run in the pool. They return plain Python or numpy values, since
+# everything returned has to be pickled back to the caller.
+
+def _search_label(label, topn):
+    return get_index().search_label(label, topn=topn)
+
+
+def _search_labels(labels, topn):
+    index = get_index()
+    present = [label for label in labels if label in index]
+    if not present:
+        return [None] * len(labels)
+    results = index.search_many([index.vector(label) for label in present],
+                                topn=topn, exclude=present)
+    found = dict(zip(present, results))
+    return [found.get(label) for label in labels]
+
+
+def _search_vector(vector, topn):
+    return get_index().search(vector, topn=topn)
+
+
+def _similarity(label_a, label_b):
+    return float(get_model().docvecs.similarity(label_a, label_b))
+
+
+def _stable_hash(seed_string):
+    # gensim seeds the starting vector for inference with model.hashfxn,
+    # which defaults to the builtin hash(); that's randomized per process
+    # for strings, so use something that isn't.
+    return int(hashlib.md5(seed_string.encode('utf-8')).hexdigest()[:8], 16)
+
+
+def _infer_vector(words, seed):
+    model = get_model()
+    with _infer_lock:
+        saved = model.random, model.hashfxn
+        try:
+            model.random = np.random.RandomState(seed)
+            model.hashfxn = _stable_hash
+            return model.infer_vector(words)
+        finally:
+            model.random, model.hashfxn = saved
+
+
+@timed('search')
+def search_label(label, topn=10):
+    """The topn most similar documents to the one with this label, as
+    (label, similarity) pairs. Raises KeyError if the label isn't in the
+    net."""
+    return run(_search_label, label, topn)
+
+
+@timed('search')
+def search_labels(labels, topn=10):
+    """search_label() for several labels at once; returns a list with one
+    result per label, or None for labels that aren't in the net."""
+    return run(_search_labels, labels, topn)
+
+
+@timed('search')
+def search_vector(vector, topn=10):
+    """The topn most similar documents to a vector."""
+    return run(_search_vector, vector, topn)
+
+
+@timed('search')
+def similarity(label_a, label_b):
+    """The cosine similarity between two documents in the net."""
+    return run(_similarity, label_a, label_b)
+
+
+@timed('infer')
+def infer_vector(words, seed):
+    """model.infer_vector(words), with the model's random state seeded so
+    that the result depends only on the words and the seed."""
+    return run(_infer_vector, words, seed)
+
+
+@receiver(setting_changed)
+def _setting_changed(setting, **kwargs):
+    # Pool processes copy the settings (and model) they were forked with.
+    if setting in ('MODEL_EXECUTOR_PROCESSES', 'MODEL_FILE'):
+        _reset_pool()
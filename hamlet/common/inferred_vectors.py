@@ -1,24 +1,67 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
 from django.conf import settings
 
-from hamlet.theses.models import Thesis
+from hamlet.common import executor
+from hamlet.common.neural_net import fingerprint
+from hamlet.common.timing import timed
+from hamlet.theses.models import SimilarTheses
+
+# Inferred vectors of recently uploaded documents, most recently used last.
+# People tend to upload the same syllabus or draft more than once, and
+# inference is by far the most expensive part of handling an upload.
+_vectors = OrderedDict()
+_lock = threading.Lock()
+
+
+def _digest(words):
+    return hashlib.sha1('\0'.join(words).encode('utf-8')).hexdigest()
+
+
+def infer_vector(words):
+    """Infer a vector for a list of words, as model.infer_vector() does, but
+    deterministically and with caching.
 
+    infer_vector() trains a new docvec with random initialization and
+    negative sampling, so by default the same document gets a (slightly)
+    different vector every time. Here the model's random state is seeded from
+    the words themselves, so a document always gets the same vector, and
+    recent results are kept in an LRU cache of
+    settings.INFERRED_VECTOR_CACHE_SIZE entries so that repeat uploads skip
+    inference entirely."""
+    digest = _digest(words)
+    key = (fingerprint(), digest)
 
+    with _lock:
+        if key in _vectors:
+            _vectors.move_to_end(key)
+            return _vectors[key]
+
+    vector = executor.infer_vector(words, int(digest[:8], 16))
+    # Callers shouldn't be able to modify the cached copy.
+    vector.setflags(write=False)
+    with _lock:
+        _vectors[key] = vector
+        while len(_vectors) > settings.INFERRED_VECTOR_CACHE_SIZE:
+            _vectors.popitem(last=False)
+    return vector
+
+
+@timed('similar_documents')
 def get_similar_documents(doc):
+    """Find the theses most similar to a document. Returns SimilarTheses."""
     # Only return documents above this similarity threshold. (When similarity
     # gets too low, it becomes meaningless. "Too low" is an art, not a
     # science.)
     threshold = 0.65
 
-    vector = settings.NEURAL_NET.infer_vector(doc.words)
-
-    # Find the most similar docvecs to this inferred vector.
-    doclist = settings.NEURAL_NET.docvecs.most_similar([vector])
-
-    # Limit to the documents above our similarity threshold. This gives a
-    # list of document filenames.
-    simdocs = [doc[0] for doc in doclist if doc[1] >= threshold]
+    vector = infer_vector(doc.words)
 
-    # Turn filenames into document identifiers so we can feed them to SQL.
-    ids = [s.replace('1721.1-', '').replace('.txt', '') for s in simdocs]
+    # Find the most similar docvecs to this inferred vector. This gives a
+    # list of (document filename, similarity) pairs.
+    doclist = executor.search_vector(vector)
 
-    return Thesis.objects.filter(identifier__in=ids)
+    return SimilarTheses.from_labels(doclist).cutoff(threshold,
+                                                     inclusive=True)
@@ -0,0 +1,143 @@
+import glob
+import hashlib
+import logging
+import os
+import threading
+
+from gensim.models.doc2vec import Doc2Vec
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from hamlet.common import vector_index
+
+logger = logging.getLogger(__name__)
+
+_model = None
+_index = None
+_fingerprint = None
+# Under gunicorn's gevent worker, threading is monkeypatched, so this lock
+# makes concurrent greenlets wait for the first load rather than all loading
+# the model at once.
+_lock = threading.Lock()
+
+
+def load_model(model_file):
+    """Load a neural net so that its large arrays can be shared between
+    processes.
+
+    Models saved by gensim store their large arrays (docvecs, word vectors,
+    hidden weights) in separate .npy files next to the .model file. Loading
+    with mmap='r' maps those files read-only instead of copying them onto the
+    heap, so every process which loads the same model shares one set of
+    physical pages via the OS page cache.
+
+    We don't compute the normalized docvecs that gensim's most_similar() uses:
+    that would be a second copy of the docvecs on the heap, and serving
+    searches the vector index (see get_index) instead. Code which still calls
+    most_similar(), or reads doctag_syn0norm, should call
+    model.docvecs.init_sims() itself.
+
+    Small models (like the test model) are pickled in a single file and
+    silently ignore mmap; that's fine.
+    """
+    logger.info('Loading neural net from {}'.format(model_file))
+    return Doc2Vec.load(model_file, mmap='r')
+
+
+def get_model():
+    """Return the neural net at settings.MODEL_FILE, loading it on first use.
+
+    Use this instead of loading the model at import time: most processes that
+    import Django settings (migrate, collectstatic, compress, other management
+    commands) never touch the model and shouldn't wait on a multi-GB load."""
+    global _model
+    if _model is None:
+        with _lock:
+            if _model is None:
+                if not settings.MODEL_FILE:
+                    raise RuntimeError('settings.MODEL_FILE is not set; '
+                                       'there is no neural net to load.')
+                _model = load_model(settings.MODEL_FILE)
+    return _model
+
+
+def get_index():
+    """Return the nearest-neighbor index for the model at settings.MODEL_FILE.
+
+    This is the index saved next to the model file by `manage.py
+    build_vector_index` (or by ModelTrainer) if there is one, memory-mapped
+    like the model, so that processes share it. Otherwise it is an exact
+    index over the model's docvecs, normalized on the heap; under gunicorn
+    --preload that happens once, in the master, and workers inherit it
+    copy-on-write. settings.VECTOR_INDEX_NPROBE, if set, overrides the number
+    of clusters an IVF index searches."""
+    global _index
+    if _index is None:
+        model = get_model()
+        with _lock:
+            if _index is None:
+                path = vector_index.index_path(settings.MODEL_FILE)
+                if os.path.isdir(path):
+                    logger.info('Loading vector index from {}'.format(path))
+                    index = vector_index.load(path)
+                else:
+                    index = vector_index.from_model(model, kind='exact')
+                nprobe = getattr(settings, 'VECTOR_INDEX_NPROBE', None)
+                if nprobe and hasattr(index, 'nprobe'):
+                    index.nprobe = nprobe
+                _index = index
+    return _index
+
+
+def fingerprint():
+    """Return a hash identifying the model at settings.MODEL_FILE (and its
+    vector index, if any), without loading the model.
+
+    Include this in cache keys for anything derived from the model, so that
+    deploying a new model invalidates them. It's a hash of the names, sizes
+    and modification times of the model's files rather than their contents,
+    which would mean reading gigabytes. warm_up() computes it at boot, so
+    requests don't wait on it even so."""
+    global _fingerprint
+    if _fingerprint is None:
+        sha = hashlib.sha1()
+        paths = []
+        if settings.MODEL_FILE:
+            paths = [settings.MODEL_FILE]
+            paths.extend(sorted(glob.glob(settings.MODEL_FILE + '.*.npy')))
+            index_dir = vector_index.index_path(settings.MODEL_FILE)
+            if os.path.isdir(index_dir):
+                paths.extend(os.path.join(index_dir, filename)
+                             for filename in sorted(os.listdir(index_dir)))
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            stat = os.stat(path)
+            sha.update('{}:{}:{}\n'.format(
+                path, stat.st_size, stat.st_mtime_ns).encode('utf-8'))
+        _fingerprint = sha.hexdigest()
+    return _fingerprint
+
+
+def warm_up():
+    """Load the model now rather than on the first request.
+
+    Called from hamlet.wsgi, so web processes pay the load cost at boot. With
+    gunicorn --preload this runs once, in the master, before workers fork."""
+    if settings.MODEL_FILE:
+        get_model()
+        get_index()
+        fingerprint()
+
+
+@receiver(setting_changed)
+def _reset_model(setting, **kwargs):
+    # Lets tests point MODEL_FILE at a different model with override_settings.
+    global _model, _index, _fingerprint
+    if setting in ('MODEL_FILE', 'VECTOR_INDEX_NPROBE'):
+        with _lock:
+            _model = None
+            _index = None
+            _fingerprint = None
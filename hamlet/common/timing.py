@@ -0,0 +1,239 @@
+"""Per-request timing of the expensive parts of serving a page.
+
+With settings.REQUEST_TIMING on, TimingMiddleware records, for every request:
+how long it spent in each phase (document parsing, vector inference,
+similarity searches, and the Thesis methods built on them), and how many
+database queries it made and how long they took. Each request's figures are
+logged as a line of JSON to the hamlet.timing logger and sent back in a
+Server-Timing header, which browsers show in their developer tools. They are
+also added to in-memory histograms, per view, which staff can see at
+/admin/timing/ (see hamlet.common.views). The histograms belong to the
+process that served the request, so each web worker has its own, and they
+start over when it restarts.
+
+Phases can nest: Thesis.get_most_similar() does a search, for instance. A
+phase entered inside another is named after both (`most_similar.search`),
+and each phase is charged only its self time, leaving out its nested phases
+and database queries, so that the phases and `db` add up to no more than
+the request's total. A phase entered again inside itself (say, a timed
+function calling another timed with the same phase) is only timed once.
+
+With REQUEST_TIMING off, the middleware removes itself at startup and the
+functions decorated with timed() only check a thread-local before calling
+straight through.
+"""
+from bisect import bisect_left
+import functools
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+logger = logging.getLogger('hamlet.timing')
+
+# Upper bounds, in milliseconds, of the histogram buckets; the last bucket
+# holds everything slower.
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+BUCKET_LABELS = ['<={}'.format(bound) for bound in BUCKETS] + \
+    ['>{}'.format(BUCKETS[-1])]
+
+# The timings of the request being handled by this thread (or greenlet, under
+# gevent), if any.
+_current = threading.local()
+
+_histograms = {}
+_lock = threading.Lock()
+
+
+def timed(phase):
+    """Decorator which adds the time spent in the decorated function to
+    `phase` in the current request's timings."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            timings = getattr(_current, 'timings', None)
+            frame = timings.enter(phase) if timings is not None else None
+            if frame is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timings.exit(frame, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+class _Frame(object):
+    # A phase in progress, and the time spent so far in what it contains.
+    def __init__(self, phase, name):
+        self.phase = phase
+        self.name = name
+        self.nested_seconds = 0.0
+
+
+class RequestTimings(object):
+    """Self time of each phase of one request, in seconds, plus its database
+    queries."""
+    def __init__(self):
+        self.phases = {}
+        self.calls = {}
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.total_seconds = 0.0
+        self._stack = []
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+
+    def enter(self, phase):
+        """Start timing a phase. Returns the frame to pass to exit(), or None
+        if we're already in that phase, in which case it isn't timed again."""
+        parent = self._stack[-1] if self._stack else None
+        if parent is not None and parent.phase == phase:
+            return None
+        name = phase if parent is None else '{}.{}'.format(parent.name, phase)
+        frame = _Frame(phase, name)
+        self._stack.append(frame)
+        return frame
+
+    def exit(self, frame, seconds):
+        self._stack.pop()
+        self.add(frame.name, seconds - frame.nested_seconds)
+        self._charge_parent(seconds)
+
+    def _charge_parent(self, seconds):
+        # Time spent inside the current phase which belongs to something else.
+        if self._stack:
+            self._stack[-1].nested_seconds += seconds
+
+    def count_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            seconds = time.perf_counter() - start
+            self.queries += 1
+            self.db_seconds += seconds
+            self._charge_parent(seconds)
+
+    def durations(self):
+        """{phase: milliseconds}, including the database and the total."""
+        durations = {phase: seconds * 1000
+                     for phase, seconds in self.phases.items()}
+        durations['db'] = self.db_seconds * 1000
+        durations['total'] = self.total_seconds * 1000
+        return durations
+
+    def header(self):
+        """The value of a Server-Timing header."""
+        metrics = ['{};dur={:.1f}'.format(phase, ms)
+                   for phase, ms in sorted(self.durations().items())
+                   if phase not in ('db', 'total')]
+        metrics.append('db;dur={:.1f};desc="{} queries"'.format(
+            self.db_seconds * 1000, self.queries))
+        metrics.append('total;dur={:.1f}'.format(self.total_seconds * 1000))
+        return ', '.join(metrics)
+
+
+class Histogram(object):
+    """Counts of values (in milliseconds, or queries) in BUCKETS."""
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, q):
+        """The upper bound of the bucket holding the q-th percentile (or the
+        largest value seen, if that's in the last bucket)."""
+        rank = q / 100 * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return round(self.max, 1)
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'mean': round(self.sum / self.count, 1) if self.count else None,
+            'max': round(self.max, 1),
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'buckets': {label: count
+                        for label, count in zip(BUCKET_LABELS, self.counts)
+                        if count},
+        }
+
+
+def record(view, timings):
+    """Add a request's timings to its view's histograms."""
+    with _lock:
+        histograms = _histograms.setdefault(view, {})
+        for phase, ms in timings.durations().items():
+            histograms.setdefault(phase, Histogram()).add(ms)
+        histograms.setdefault('queries', Histogram()).add(timings.queries)
+
+
+def histograms():
+    """{view: {phase: histogram as a dict}} for this process."""
+    with _lock:
+        return {view: {phase: histogram.as_dict()
+                       for phase, histogram in phases.items()}
+                for view, phases in _histograms.items()}
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+
+
+class TimingMiddleware(object):
+    """Times each request and its phases; see the module docstring. Goes
+    near the top of settings.MIDDLEWARE, so that the total covers the
+    middleware below it."""
+    def __init__(self, get_response):
+        if not settings.REQUEST_TIMING:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        _current.timings = timings
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(timings.count_query):
+                response = self.get_response(request)
+        finally:
+            timings.total_seconds = time.perf_counter() - start
+            _current.timings = None
+
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        response['Server-Timing'] = timings.header()
+        logger.info(json.dumps({
+            'path': request.path,
+            'method': request.method,
+            'view': view,
+            'status': response.status_code,
+            'queries': timings.queries,
+            'ms': {phase: round(ms, 1)
+                   for phase, ms in timings.durations().items()},
+            'calls': timings.calls,
+        }, sort_keys=True))
+        record(view, timings)
+        return response
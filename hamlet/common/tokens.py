@@ -0,0 +1,28 @@
+"""Tokenization shared by training and inference.
+
+Inferred vectors are only comparable to trained ones if uploaded documents
+are tokenized exactly the way the training corpus was, so everything that
+turns text into words for the neural net should go through here. Changing
+what tokenize() returns changes the words the model is trained on, so the
+model has to be retrained to match."""
+from string import punctuation
+
+from nltk import sent_tokenize, WordPunctTokenizer
+
+_tokenizer = WordPunctTokenizer()
+
+
+def tokenize(text):
+    """Split text into sentences, then lowercase them and split them into
+    words, dropping punctuation.
+
+    Uploaded documents are tokenized a piece at a time, with pieces that
+    break at whitespace (see hamlet.common.document). WordPunctTokenizer
+    gives the same words either way; the sentence splitter can only differ
+    at the breaks between pieces, which are tens of thousands of characters
+    apart."""
+    all_tokens = []
+    for sentence in sent_tokenize(text):
+        words = _tokenizer.tokenize(sentence.lower())
+        all_tokens.extend(word for word in words if word not in punctuation)
+    return all_tokens
@@ -0,0 +1,226 @@
+"""Nearest-neighbor search over document vectors.
+
+gensim's docvecs.most_similar() scores a query against every vector in the
+net. That's fine for one query but adds up on the request path, so searches
+go through an index instead. Two kinds are available, with the same
+interface:
+
+* ExactIndex gives the same results as most_similar();
+* IVFIndex (an "inverted file" index) clusters the vectors with k-means and
+  only scores the vectors in the `nprobe` clusters closest to the query. This
+  is approximate - a true neighbor in an unprobed cluster will be missed - but
+  much faster; `manage.py benchmark_vector_index` measures the tradeoff.
+
+Indexes are built from a trained model by `from_model` and saved next to the
+model file, as a directory of .npy files named <model file>.index; see
+hamlet.common.neural_net.get_index. Separate .npy files (unlike a .npz
+archive) can be memory-mapped, so processes which load the same index share
+one copy of it through the page cache, as they do the model's arrays.
+"""
+import os
+
+import numpy as np
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def _top(rows, sims, topn):
+    # Indices into rows of the topn highest sims, best first.
+    if len(sims) > topn:
+        best = np.argpartition(-sims, topn - 1)[:topn]
+    else:
+        best = np.arange(len(sims))
+    best = best[np.argsort(-sims[best])]
+    return rows[best], sims[best]
+
+
+class ExactIndex(object):
+    kind = 'exact'
+
+    def __init__(self, vectors, labels, normalized=False):
+        # Pass normalized=True for vectors which already have unit length
+        # (such as a saved index's), so that they're used as they are: not
+        # copied, and not rounded differently by normalizing them again.
+        self.vectors = vectors if normalized else _normalize(vectors)
+        self.labels = np.asarray(labels)
+        self._positions = {label: i for i, label in enumerate(self.labels)}
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __contains__(self, label):
+        return label in self._positions
+
+    def vector(self, label):
+        """The (normalized) vector for a label; raises KeyError if the label
+        isn't in the index."""
+        return self.vectors[self._positions[label]]
+
+    def _candidates(self, query):
+        # Rows of self.vectors that might be neighbors of query.
+        return np.arange(len(self.vectors))
+
+    def search(self, vector, topn=10, exclude=None):
+        """Find the topn most similar vectors to the given vector. Returns a
+        list of (label, cosine similarity) tuples, best first, like gensim's
+        most_similar(). If `exclude` is given, that label won't be returned
+        (use this to avoid finding a document as its own neighbor)."""
+        query = _normalize(vector)
+        rows = self._candidates(query)
+        sims = np.dot(self.vectors[rows], query)
+        return self._results(rows, sims, topn, exclude)
+
+    def _results(self, rows, sims, topn, exclude):
+        extra = 1 if exclude is not None else 0
+        rows, sims = _top(rows, sims, topn + extra)
+        results = [(str(self.labels[row]), float(sim))
+                   for row, sim in zip(rows, sims)
+                   if self.labels[row] != exclude]
+        return results[:topn]
+
+    def search_label(self, label, topn=10):
+        """Find the topn most similar vectors to the one with this label."""
+        return self.search(self.vector(label), topn=topn, exclude=label)
+
+    def search_many(self, vectors, topn=10, exclude=None):
+        """search() for each row of a matrix, with a single matrix-matrix
+        product. `exclude`, if given, is a list of labels to exclude, one per
+        row."""
+        queries = _normalize(vectors)
+        exclude = exclude or [None] * len(queries)
+        rows = np.arange(len(self.vectors))
+        sims = np.dot(queries, self.vectors.T)
+        return [self._results(rows, row_sims, topn, excluded)
+                for row_sims, excluded in zip(sims, exclude)]
+
+    def _arrays(self):
+        return {'vectors': self.vectors, 'labels': self.labels}
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        arrays = dict(self._arrays(), kind=np.array(self.kind))
+        for name, array in arrays.items():
+            np.save(os.path.join(path, '{}.npy'.format(name)), array)
+
+    @classmethod
+    def _from_arrays(cls, arrays):
+        # save() wrote normalized vectors.
+        return cls(arrays['vectors'], arrays['labels'], normalized=True)
+
+
+class IVFIndex(ExactIndex):
+    kind = 'ivf'
+
+    def __init__(self, vectors, labels, centroids, offsets, nprobe=8,
+                 normalized=False):
+        # vectors and labels must be sorted by cluster, such that cluster i
+        # is rows offsets[i]:offsets[i + 1].
+        super(IVFIndex, self).__init__(vectors, labels, normalized)
+        self.centroids = centroids if normalized else _normalize(centroids)
+        self.offsets = np.asarray(offsets)
+        self.nprobe = nprobe
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, vectors, labels, nlist=None, nprobe=8, iterations=10,
+              seed=0):
+        """Cluster the vectors with spherical k-means and build an index.
+
+        nlist (the number of clusters) defaults to the square root of the
+        number of vectors, which keeps cluster sizes and the number of
+        clusters balanced."""
+        vectors = _normalize(vectors)
+        labels = np.asarray(labels)
+        count = len(vectors)
+        nlist = min(nlist or int(np.sqrt(count)) or 1, count)
+
+        random = np.random.RandomState(seed)
+        centroids = vectors[random.choice(count, nlist, replace=False)]
+        for _ in range(iterations):
+            assignments = np.argmax(np.dot(vectors, centroids.T), axis=1)
+            for cluster in range(nlist):
+                members = vectors[assignments == cluster]
+                if len(members):
+                    centroids[cluster] = members.mean(axis=0)
+                else:
+                    # Reseed empty clusters rather than losing them.
+                    centroids[cluster] = vectors[random.randint(count)]
+            centroids = _normalize(centroids)
+        assignments = np.argmax(np.dot(vectors, centroids.T), axis=1)
+
+        order = np.argsort(assignments, kind='stable')
+        sizes = np.bincount(assignments, minlength=nlist)
+        offsets = np.concatenate([[0], np.cumsum(sizes)])
+        return cls(vectors[order], labels[order], centroids, offsets,
+                   nprobe=nprobe, normalized=True)
+
+    def _candidates(self, query):
+        nprobe = min(self.nprobe, self.nlist)
+        scores = np.dot(self.centroids, query)
+        probe = np.argpartition(-scores, nprobe - 1)[:nprobe]
+        return np.concatenate([
+            np.arange(self.offsets[cluster], self.offsets[cluster + 1])
+            for cluster in probe])
+
+    def search_many(self, vectors, topn=10, exclude=None):
+        # Each query probes different clusters, so there's no single matrix
+        # product to do; the per-query searches are cheap anyway.
+        exclude = exclude or [None] * len(vectors)
+        return [self.search(vector, topn=topn, exclude=excluded)
+                for vector, excluded in zip(vectors, exclude)]
+
+    def _arrays(self):
+        arrays = super(IVFIndex, self)._arrays()
+        arrays.update({'centroids': self.centroids,
+                       'offsets': self.offsets,
+                       'nprobe': np.array(self.nprobe)})
+        return arrays
+
+    @classmethod
+    def _from_arrays(cls, arrays):
+        return cls(arrays['vectors'], arrays['labels'], arrays['centroids'],
+                   arrays['offsets'], nprobe=int(arrays['nprobe']),
+                   normalized=True)
+
+
+INDEX_CLASSES = {cls.kind: cls for cls in (ExactIndex, IVFIndex)}
+
+
+def index_path(model_file):
+    return '{}.index'.format(model_file)
+
+
+def load(path, mmap_mode='r'):
+    """Load an index saved by save(). Its arrays are memory-mapped
+    read-only unless mmap_mode is None."""
+    arrays = {}
+    for filename in os.listdir(path):
+        name, extension = os.path.splitext(filename)
+        if extension == '.npy':
+            arrays[name] = np.load(os.path.join(path, filename),
+                                   mmap_mode=mmap_mode)
+    cls = INDEX_CLASSES[str(arrays['kind'])]
+    return cls._from_arrays(arrays)
+
+
+def model_vectors(model):
+    """Returns the docvecs of a trained model and their labels."""
+    docvecs = model.docvecs
+    labels = [docvecs.index_to_doctag(i)
+              for i in range(len(docvecs.doctag_syn0))]
+    return docvecs.doctag_syn0, labels
+
+
+def from_model(model, kind='ivf', **kwargs):
+    vectors, labels = model_vectors(model)
+    if kind == 'ivf':
+        return IVFIndex.build(vectors, labels, **kwargs)
+    return ExactIndex(vectors, labels)
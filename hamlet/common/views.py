@@ -0,0 +1,19 @@
+import os
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
+
+from hamlet.common import timing
+
+
+@staff_member_required
+def timing_stats(request):
+    """This process's request timing histograms (see hamlet.common.timing),
+    as JSON."""
+    return JsonResponse({
+        'enabled': settings.REQUEST_TIMING,
+        'pid': os.getpid(),
+        'buckets_ms': timing.BUCKETS,
+        'views': timing.histograms(),
+    })
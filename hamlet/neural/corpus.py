@@ -0,0 +1,104 @@
+"""Pre-tokenized training corpora.
+
+gensim iterates over a training corpus once to build the vocabulary and then
+once per epoch, and ModelTrainer trains a model for every window/size
+combination it tries, so tokenizing the text files on every pass means
+tokenizing each of them hundreds of times per sweep. Instead, each text file
+is tokenized once - and again only if it changes - into a token cache, and
+the cached tokens for a set of files are concatenated into a corpus file
+with one document per line, which TokenCorpus streams back at disk speed.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import os
+import shutil
+
+from gensim.models.doc2vec import LabeledSentence
+
+from hamlet.common.tokens import tokenize
+
+
+def is_fresh(text_path, tokens_path):
+    """Whether tokens_path was written since text_path last changed."""
+    try:
+        return os.stat(tokens_path).st_mtime_ns >= \
+            os.stat(text_path).st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+
+def tokenize_file(text_path, tokens_path):
+    """Tokenize a text file into tokens_path, as a single line of
+    space-separated tokens. (Tokens never contain whitespace, so this is
+    lossless.) Runs in the tokenizer processes."""
+    with open(text_path, 'r') as f:
+        words = tokenize(f.read())
+
+    # Write then rename, so an interrupted write never leaves a partial token
+    # file that looks fresh.
+    partial = tokens_path + '.part'
+    with open(partial, 'w') as f:
+        f.write(' '.join(words))
+        f.write('\n')
+    os.rename(partial, tokens_path)
+    return len(words)
+
+
+class TokenCorpus(object):
+    """Streams a corpus file written by TokenCache.write_corpus as
+    LabeledSentences - like LabeledLineSentence, but without re-reading and
+    re-tokenizing the text. Can be iterated over any number of times."""
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        with open(self.path, 'r') as f:
+            for line in f:
+                words = line.split()
+                yield LabeledSentence(words=words[1:], tags=[words[0]])
+
+
+class TokenCache(object):
+    """Tokenized copies of text files, kept in `cache_dir` as
+    <filename>.tokens.
+
+    Files are identified by filename, so copies of the same text file (as
+    made by ModelTrainer.split_data, which preserves modification times)
+    share their cached tokens."""
+    def __init__(self, cache_dir, workers=None):
+        self.cache_dir = cache_dir
+        self.workers = workers or os.cpu_count()
+
+    def path(self, text_path):
+        return os.path.join(self.cache_dir,
+                            os.path.basename(text_path) + '.tokens')
+
+    def update(self, text_paths):
+        """Tokenize whichever of text_paths have changed since they were
+        last tokenized (or never have been). Returns how many that was."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        stale = [text_path for text_path in text_paths
+                 if not is_fresh(text_path, self.path(text_path))]
+        if stale:
+            print('Tokenizing {} of {} files'.format(
+                len(stale), len(text_paths)))
+            with ProcessPoolExecutor(self.workers) as pool:
+                list(pool.map(tokenize_file, stale,
+                              [self.path(text_path) for text_path in stale],
+                              chunksize=16))
+        return len(stale)
+
+    def write_corpus(self, text_paths, corpus_path):
+        """Write a corpus file of the given text files, tokenizing any that
+        need it, and return a TokenCorpus to stream it. Each line is the
+        file's name (its doc2vec tag) followed by its tokens."""
+        self.update(text_paths)
+        os.makedirs(os.path.dirname(corpus_path), exist_ok=True)
+
+        partial = corpus_path + '.part'
+        with open(partial, 'w') as out:
+            for text_path in text_paths:
+                out.write(os.path.basename(text_path) + ' ')
+                with open(self.path(text_path), 'r') as f:
+                    shutil.copyfileobj(f, out)
+        os.rename(partial, corpus_path)
+        return TokenCorpus(corpus_path)
@@ -0,0 +1,258 @@
+"""Fetches thesis PDFs and extracts their text for training, concurrently.
+
+Downloading is I/O-bound and parsing is CPU-bound (tika does the work, but
+the client has to serialize the PDF and deserialize the result), so the two
+stages get separate pools: a thread pool downloads PDFs into per-thesis temp
+files, and a process pool parses them. Every outcome is appended to a
+ledger file as soon as it's known, so a run that is interrupted (or that
+crashes two days in) picks up where it stopped.
+"""
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+import json
+import logging
+import os
+import tempfile
+
+from tika import parser as tikaparser
+
+from hamlet.neural.http_client import get_client
+from hamlet.theses.models import Thesis
+
+logger = logging.getLogger(__name__)
+
+EXTRACTED = 'extracted'
+UNEXTRACTABLE = 'unextractable'
+DOWNLOAD_FAILED = 'download_failed'
+PARSE_FAILED = 'parse_failed'
+
+# Outcomes which shouldn't be retried. Failed downloads and parses (where
+# the tika server or a parser process failed, rather than tika finding no
+# text) are usually transient, so they are retried on the next run.
+FINAL = (EXTRACTED, UNEXTRACTABLE)
+
+
+def download(url, pdf_path):
+    """Download url into pdf_path. On failure, raises and removes whatever
+    was written, so an error page or a partial PDF never reaches tika."""
+    try:
+        with get_client().get(url, stream=True) as r, \
+                open(pdf_path, 'wb') as f:
+            r.raise_for_status()
+            for chunk in r.iter_content(64 * 1024):
+                f.write(chunk)
+    except Exception:
+        if os.path.exists(pdf_path):
+            os.remove(pdf_path)
+        raise
+
+
+def parse(pdf_path, text_path):
+    """Extract the text of a PDF into text_path. Returns EXTRACTED,
+    UNEXTRACTABLE if tika found no text in it, or PARSE_FAILED if we couldn't
+    reach tika or tika itself failed. Runs in the parser processes."""
+    try:
+        parsed = tikaparser.from_file(pdf_path)
+    except Exception as e:
+        logger.warning('tika failed on {}: {}'.format(pdf_path, e))
+        return PARSE_FAILED
+    finally:
+        os.remove(pdf_path)
+
+    # 5xx means the tika server failed, rather than the PDF.
+    if parsed.get('status', 200) >= 500:
+        return PARSE_FAILED
+    content = parsed.get('content')
+    if not content:
+        return UNEXTRACTABLE
+
+    # Write then rename, so that an interrupted write never leaves a partial
+    # text file that would be mistaken for a finished one.
+    partial = text_path + '.part'
+    with open(partial, 'w') as f:
+        f.write(content)
+    os.rename(partial, text_path)
+    return EXTRACTED
+
+
+class Ledger(object):
+    """An append-only record of extraction outcomes, one JSON object per
+    line. If an identifier appears more than once, the last line wins."""
+    def __init__(self, path):
+        self.path = path
+        self.outcomes = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line cut short by an interruption.
+                        continue
+                    self.outcomes[entry['identifier']] = entry['status']
+        self._file = open(path, 'a')
+
+    def record(self, identifier, status):
+        self.outcomes[identifier] = status
+        self._file.write(json.dumps(
+            {'identifier': identifier, 'status': status}) + '\n')
+        self._file.flush()
+
+    def with_status(self, status):
+        return [identifier for identifier, outcome in self.outcomes.items()
+                if outcome == status]
+
+    def close(self):
+        self._file.close()
+
+
+class TextExtractor(object):
+    """Extracts text for theses into `text_dir` as 1721.1-<identifier>.txt,
+    skipping any that have already been extracted or found unextractable,
+    and marks the unextractable ones in the database."""
+    # Theses marked unextractable per UPDATE query.
+    UPDATE_BATCH = 500
+
+    def __init__(self, text_dir, ledger_path=None, download_workers=8,
+                 parse_workers=None):
+        self.text_dir = text_dir
+        self.ledger_path = ledger_path or os.path.join(
+            text_dir, os.pardir, 'extraction_ledger.jsonl')
+        self.download_workers = download_workers
+        self.parse_workers = parse_workers or os.cpu_count()
+        self._unextractable = []
+
+    @staticmethod
+    def get_filename(identifier):
+        return '1721.1-{}.txt'.format(identifier)
+
+    def _mark_unextractable(self, identifier=None, flush=False):
+        if identifier is not None:
+            self._unextractable.append(identifier)
+        if self._unextractable and (
+                flush or len(self._unextractable) >= self.UPDATE_BATCH):
+            Thesis.objects.filter(
+                identifier__in=self._unextractable).update(unextractable=True)
+            self._unextractable = []
+
+    def _fetch(self, thesis, tmp_dir):
+        fd, pdf_path = tempfile.mkstemp(suffix='.pdf', dir=tmp_dir)
+        os.close(fd)
+        download(thesis.url, pdf_path)
+        return pdf_path
+
+    @contextmanager
+    def _parser_pool(self):
+        self._parsers = ProcessPoolExecutor(self.parse_workers)
+        try:
+            yield
+        finally:
+            self._parsers.shutdown()
+
+    def _submit_parse(self, pdf_path, text_path):
+        """Queue a PDF for parsing. If a parser process has died (e.g.
+        killed by the OOM killer), which breaks the whole pool, start a fresh
+        pool first."""
+        try:
+            return self._parsers.submit(parse, pdf_path, text_path)
+        except BrokenProcessPool:
+            logger.warning('Parser pool broke; restarting it')
+            self._parsers.shutdown(wait=False)
+            self._parsers = ProcessPoolExecutor(self.parse_workers)
+            return self._parsers.submit(parse, pdf_path, text_path)
+
+    def pending(self, theses):
+        """The theses which still need extracting."""
+        existing = set(os.listdir(self.text_dir))
+        done = set(identifier for identifier, status
+                   in self.ledger.outcomes.items() if status in FINAL)
+        return [thesis for thesis in theses
+                if thesis.identifier not in done and
+                self.get_filename(thesis.identifier) not in existing]
+
+    def run(self, theses):
+        """Extract text for the given theses. Returns a dict counting
+        outcomes."""
+        os.makedirs(self.text_dir, exist_ok=True)
+        self.ledger = Ledger(self.ledger_path)
+        # In case the last run stopped between recording theses as
+        # unextractable and saving that to the database.
+        for identifier in self.ledger.with_status(UNEXTRACTABLE):
+            self._mark_unextractable(identifier)
+        self._mark_unextractable(flush=True)
+
+        todo = self.pending(theses)
+        counts = {EXTRACTED: 0, UNEXTRACTABLE: 0, DOWNLOAD_FAILED: 0,
+                  PARSE_FAILED: 0}
+        logger.info('{} theses to extract'.format(len(todo)))
+
+        # Start the tika server (if it isn't running) here, rather than
+        # letting every parser process race to start one.
+        tikaparser.from_buffer('')
+
+        # Don't download much faster than we can parse, or the temp
+        # directory fills up with PDFs.
+        max_in_flight = self.download_workers + 2 * self.parse_workers
+        remaining = iter(todo)
+
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                ThreadPoolExecutor(self.download_workers) as downloads, \
+                self._parser_pool():
+            in_flight = {}
+
+            def submit_download():
+                thesis = next(remaining, None)
+                if thesis is not None:
+                    future = downloads.submit(self._fetch, thesis, tmp_dir)
+                    in_flight[future] = ('download', thesis)
+
+            for _ in range(max_in_flight):
+                submit_download()
+
+            while in_flight:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage, thesis = in_flight.pop(future)
+                    identifier = thesis.identifier
+
+                    if stage == 'download':
+                        try:
+                            pdf_path = future.result()
+                        except Exception as e:
+                            logger.warning('Download failed for {}: {}'.format(
+                                identifier, e))
+                            self.ledger.record(identifier, DOWNLOAD_FAILED)
+                            counts[DOWNLOAD_FAILED] += 1
+                            submit_download()
+                            continue
+                        text_path = os.path.join(
+                            self.text_dir, self.get_filename(identifier))
+                        parsed = self._submit_parse(pdf_path, text_path)
+                        in_flight[parsed] = ('parse', thesis)
+                        continue
+
+                    try:
+                        status = future.result()
+                    except Exception:
+                        # Including BrokenProcessPool, for every parse in
+                        # flight when a parser process died. The pool is
+                        # replaced by the next _submit_parse.
+                        logger.exception('Parsing failed for {}'.format(
+                            identifier))
+                        status = PARSE_FAILED
+                    self.ledger.record(identifier, status)
+                    counts[status] += 1
+                    if status == UNEXTRACTABLE:
+                        self._mark_unextractable(identifier)
+                    submit_download()
+
+                done = sum(counts.values())
+                if done and done % 100 == 0:
+                    logger.info('{} of {} theses processed'.format(
+                        done, len(todo)))
+
+        self._mark_unextractable(flush=True)
+        self.ledger.close()
+        return counts
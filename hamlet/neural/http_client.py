@@ -0,0 +1,94 @@
+"""A shared HTTP client for talking to DSpace.
+
+Harvesting makes tens of thousands of requests to the same host. Going
+through one client means they reuse pooled keep-alive connections instead of
+setting up a new TCP/TLS connection each time; every request has a timeout;
+transient failures (connection errors, 429s, 5xxs) are retried with
+exponential backoff; and no more than `max_concurrency` requests are in
+flight at once, however many threads are making them, so we stay polite to
+the server.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# (connect, read) timeouts, in seconds.
+DEFAULT_TIMEOUT = (10, 120)
+
+
+class HttpClient(object):
+    def __init__(self, max_concurrency=8, timeout=DEFAULT_TIMEOUT,
+                 retries=5, backoff_factor=0.5):
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+        retry = Retry(total=retries,
+                      backoff_factor=backoff_factor,
+                      status_forcelist=(429, 500, 502, 503, 504),
+                      raise_on_status=False)
+        # The connection pool is thread-safe; size it to match the number of
+        # requests we'll make at once, so connections don't get discarded.
+        adapter = HTTPAdapter(pool_connections=4,
+                              pool_maxsize=max_concurrency,
+                              max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, url, **kwargs):
+        """Like requests.get, but pooled, retried, rate limited and with a
+        default timeout. Raises requests.HTTPError for error responses that
+        persist after retrying.
+
+        With stream=True, the concurrency limit only covers making the
+        request, not reading the body."""
+        kwargs.setdefault('timeout', self.timeout)
+        with self._slots:
+            response = self.session.get(url, **kwargs)
+        try:
+            response.raise_for_status()
+        except requests.HTTPError:
+            # Release the connection, which a streamed response would
+            # otherwise hold until it was garbage collected.
+            response.close()
+            raise
+        return response
+
+    def get_text(self, url, **kwargs):
+        return self.get(url, **kwargs).text
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.max_concurrency)
+        return self._executor
+
+    def get_texts(self, requests_kwargs):
+        """Make several GET requests concurrently. Takes a list of dicts of
+        keyword arguments for get() (each including `url`); returns the
+        response texts in the same order."""
+        executor = self._get_executor()
+        futures = [executor.submit(self.get_text, **kwargs)
+                   for kwargs in requests_kwargs]
+        return [future.result() for future in futures]
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """The HttpClient shared by everything in hamlet.neural."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = HttpClient()
+    return _client
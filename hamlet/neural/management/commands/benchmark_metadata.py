@@ -0,0 +1,45 @@
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from hamlet.neural.train_neural_net import MetadataWriter
+
+CORPUS = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir,
+                      'tests', 'fixtures', 'sample_records.json')
+
+
+class Command(BaseCommand):
+    help = ('Time MetadataWriter.extract_metadata over a corpus of sample '
+            'dc/mets records')
+
+    def add_arguments(self, parser):
+        parser.add_argument('-c', '--corpus', default=CORPUS,
+                            help="JSON list of records, each with dc, mets "
+                                 "and sets (default: the test fixtures)")
+        parser.add_argument('-r', '--repeat', type=int, default=1000,
+                            help="Times to extract each record")
+
+    def handle(self, *args, **options):
+        with open(options['corpus']) as f:
+            corpus = json.load(f)
+        writer = MetadataWriter()
+        repeat = options['repeat']
+
+        # Best of three, to smooth over noise from other processes.
+        timings = []
+        for _ in range(3):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                for record in corpus:
+                    writer.extract_metadata(record['dc'], record['mets'],
+                                            record['sets'])
+            timings.append(time.perf_counter() - start)
+
+        count = repeat * len(corpus)
+        best = min(timings)
+        self.stdout.write(
+            'Extracted {} records in {:.2f}s: {:.0f} records/sec, '
+            '{:.1f} microseconds/record'.format(
+                count, best, count / best, best / count * 1e6))
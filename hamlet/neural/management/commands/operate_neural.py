@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 
 from hamlet.neural.train_neural_net import write_metadata, train_model
+from hamlet.theses.models import Thesis
 
 
 class Command(BaseCommand):
@@ -14,14 +15,40 @@ class Command(BaseCommand):
         parser.add_argument('-w', '--write-metadata',
                             help="Write metadata to db",
                             action='store_true')
+        parser.add_argument('-i', '--incremental',
+                            help="Only harvest records changed since the "
+                                 "last successful harvest",
+                            action='store_true')
+        parser.add_argument('--from', dest='start_date', default=None,
+                            help="Only harvest records changed on or after "
+                                 "this date (YYYY-MM-DD)")
+        parser.add_argument('-b', '--batch-size', type=int, default=500,
+                            help="Number of theses to write to the db at "
+                                 "once")
+        parser.add_argument('--until', dest='end_date', default=None,
+                            help="Only harvest records changed on or before "
+                                 "this date (YYYY-MM-DD)")
 
     def handle(self, *args, **options):
-        if options['write-metadata']:
-            self.stdout.write(self.style.INFO('Writing metadata'))
-            write_metadata()
+        if options['write_metadata']:
+            self.stdout.write(self.style.WARNING('Writing metadata'))
+            harvest, writer = write_metadata({
+                'write_metadata': True,
+                'incremental': options['incremental'],
+                'start_date': options['start_date'],
+                'end_date': options['end_date'],
+                'batch_size': options['batch_size']})
+            elapsed = (harvest.finished - harvest.started).total_seconds()
+            rate = harvest.records_written / elapsed if elapsed else 0
+            self.stdout.write(
+                'Wrote {} records in {:.0f}s ({:.1f} records/sec overall, '
+                '{:.1f} records/sec writing to the db)'.format(
+                    harvest.records_written, elapsed, rate, writer.rate))
 
         if not options['dryrun']:
-            self.stdout.write(self.style.INFO('Training model'))
-            train_model()
+            self.stdout.write(self.style.WARNING('Training model'))
+            train_model({'queryset': Thesis.objects.all(),
+                         'filename': options['filename'],
+                         'subdir_list': ['training', 'test']})
 
         self.stdout.write(self.style.SUCCESS('Done'))
@@ -0,0 +1,37 @@
+# Generated by Django 2.2.19 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Harvest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started', models.DateTimeField(auto_now_add=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('from_date', models.DateField(blank=True, null=True)),
+                ('succeeded', models.BooleanField(default=False)),
+                ('records_written', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-started'],
+            },
+        ),
+        migrations.CreateModel(
+            name='HarvestedRecord',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('identifier', models.IntegerField(unique=True)),
+                ('datestamp', models.DateTimeField()),
+                ('deleted', models.BooleanField(default=False)),
+            ],
+        ),
+    ]
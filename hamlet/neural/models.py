@@ -0,0 +1,41 @@
+from django.db import models
+
+
+class Harvest(models.Model):
+    """One run of the metadata harvester (`operate_neural --write-metadata`).
+
+    The start time of the last successful harvest is the high-water mark for
+    incremental harvests: the next one only asks DSpace for records changed
+    since that day."""
+    started = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    # The OAI-PMH `from` date requested, if any.
+    from_date = models.DateField(null=True, blank=True)
+    succeeded = models.BooleanField(default=False)
+    records_written = models.IntegerField(default=0)
+
+    def __str__(self):
+        return 'Harvest started {}'.format(self.started)
+
+    @classmethod
+    def high_water_mark(cls):
+        """The date of the last successful harvest, or None if there hasn't
+        been one."""
+        last = cls.objects.filter(succeeded=True).order_by('-started').first()
+        return last.started.date() if last else None
+
+    class Meta:
+        ordering = ['-started']
+
+
+class HarvestedRecord(models.Model):
+    """The last version of a thesis's OAI-PMH record that we processed, so
+    harvests can skip records that haven't changed since."""
+    # The handle suffix, as in Thesis.identifier.
+    identifier = models.IntegerField(unique=True)
+    # The OAI-PMH header datestamp: when the record last changed in DSpace.
+    datestamp = models.DateTimeField()
+    deleted = models.BooleanField(default=False)
+
+    def __str__(self):
+        return str(self.identifier)
@@ -0,0 +1,155 @@
+"""Hyperparameter sweeps: training one model per (window, size) combination.
+
+The vocabulary depends only on the corpus and min_count, so it is built once
+per corpus and saved; every configuration then borrows it (with gensim's
+reset_from) instead of rescanning the corpus. Configurations are trained
+concurrently in a process pool, sized so that the models in flight fit in
+both the available cores and the available memory. Each pool process
+trains one model and exits, so its peak RSS is that model's and memory
+doesn't accumulate across runs.
+
+Every run's parameters, wall time, peak RSS and output path are appended to
+a CSV results table as it finishes.
+"""
+import csv
+from glob import glob
+import multiprocessing
+import os
+import resource
+import time
+
+from gensim.models.doc2vec import Doc2Vec
+
+from hamlet.common import vector_index
+from hamlet.neural.corpus import TokenCorpus
+
+# Parameters shared by every model in a sweep.
+MODEL_PARAMS = {
+    # Alpha starts at `alpha` and decreases to `min_alpha`.
+    'alpha': 0.025,
+    'min_alpha': 0.025,
+    # Min word frequency for inclusion (default=5).
+    'min_count': 10,
+}
+
+RESULT_FIELDS = ['window', 'size', 'wall_seconds', 'peak_rss_mb', 'path']
+
+
+def build_vocab(corpus, vocab_path, max_vocab_size=None):
+    """Scan a corpus once and save a model holding just its vocabulary, for
+    train_config to borrow. Returns the model."""
+    model = Doc2Vec(max_vocab_size=max_vocab_size, **MODEL_PARAMS)
+    model.build_vocab(corpus)
+    model.save(vocab_path)
+    return model
+
+
+def estimate_model_bytes(vocab_size, doc_count, size):
+    """Roughly how much memory training a model takes: float32 input and
+    output weights for each word, a vector per document, and half as much
+    again for everything else."""
+    return int((2 * vocab_size + doc_count) * size * 4 * 1.5)
+
+
+def saved_model_bytes(path):
+    """Roughly how much memory loading a saved model takes: the size of
+    the model file plus the .npy files gensim saves its large arrays in
+    (docvecs, word vectors and output weights), and half as much again for
+    everything else."""
+    files = [path] + glob(path + '.*.npy')
+    return int(sum(os.path.getsize(f) for f in files) * 1.5)
+
+
+def available_memory():
+    """Bytes of memory available to new processes, or None if we can't
+    tell. Linux only (it reads /proc)."""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def pool_size(model_bytes, threads_per_model, jobs):
+    """How many models to train at once: as many as there are cores for
+    (given each uses threads_per_model threads) and memory for, but at least
+    one and no more than there are jobs."""
+    by_cpu = (os.cpu_count() or 1) // threads_per_model
+    memory = available_memory()
+    by_memory = memory // model_bytes if memory and model_bytes else by_cpu
+    return max(1, min(by_cpu, by_memory, jobs))
+
+
+def train_config(job):
+    """Train and save one model, borrowing the vocabulary saved at
+    vocab_path. Runs in a pool process. Returns a row for the results
+    table."""
+    window, size, corpus_path, vocab_path, output_path, threads = job
+    start = time.time()
+
+    model = Doc2Vec(window=window, size=size, workers=threads,
+                    **MODEL_PARAMS)
+    model.reset_from(Doc2Vec.load(vocab_path))
+
+    model.train(TokenCorpus(corpus_path),
+                total_examples=model.corpus_count,
+                epochs=model.iter)
+    model.save(output_path)
+
+    # Save a nearest-neighbor index alongside, for fast similarity search
+    # when this model is deployed.
+    vector_index.from_model(model).save(vector_index.index_path(output_path))
+
+    # ru_maxrss is in kB on Linux.
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {'window': window,
+            'size': size,
+            'wall_seconds': round(time.time() - start, 1),
+            'peak_rss_mb': round(peak_rss / 1024, 1),
+            'path': output_path}
+
+
+def run_sweep(corpus, vocab_path, configs, output_path, results_path,
+              threads_per_model=2, max_vocab_size=None):
+    """Train a model for each (window, size) in configs on a TokenCorpus.
+
+    output_path is a format string taking window and size, e.g.
+    'nets/foo_w{window}_s{size}.model'. Results are appended to the CSV at
+    results_path. Returns the results, in the order runs finished."""
+    start = time.time()
+    print('Building vocab from {}...'.format(corpus.path))
+    vocab = build_vocab(corpus, vocab_path, max_vocab_size)
+
+    largest = max(size for _, size in configs)
+    model_bytes = estimate_model_bytes(len(vocab.wv.vocab),
+                                       vocab.corpus_count, largest)
+    del vocab
+    processes = pool_size(model_bytes, threads_per_model, len(configs))
+    print('Training {} models, {} at a time'.format(len(configs), processes))
+
+    jobs = [(window, size, corpus.path, vocab_path,
+             output_path.format(window=window, size=size), threads_per_model)
+            for window, size in configs]
+
+    new_file = not os.path.exists(results_path)
+    results = []
+    with open(results_path, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+        if new_file:
+            writer.writeheader()
+
+        with multiprocessing.Pool(processes, maxtasksperchild=1) as pool:
+            for result in pool.imap_unordered(train_config, jobs):
+                writer.writerow(result)
+                f.flush()
+                results.append(result)
+                print('Trained window={window}, size={size} in '
+                      '{wall_seconds}s, peak RSS {peak_rss_mb} MB: '
+                      '{path}'.format(**result))
+
+    print('Sweep took {:.0f}s; results are in {}'.format(
+        time.time() - start, results_path))
+    return results
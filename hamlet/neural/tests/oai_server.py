@@ -0,0 +1,175 @@
+"""A stand-in OAI-PMH server for tests, so they don't depend on DSpace.
+
+It serves whatever records a test gives it from a thread on localhost,
+records the requests it receives, and can be told to fail, or to be slow,
+so tests can check retries and concurrency."""
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+RECORD = '''<?xml version="1.0" encoding="UTF-8"?>
+<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">
+  <GetRecord>
+    <record>
+      <header>
+        <identifier>{identifier}</identifier>
+      </header>
+      <metadata>{metadata}</metadata>
+    </record>
+  </GetRecord>
+</OAI-PMH>'''
+
+LIST = '''<?xml version="1.0" encoding="UTF-8"?>
+<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">
+  <{verb}>{items}{token}</{verb}>
+</OAI-PMH>'''
+
+HEADER = '''
+    <header>
+      <identifier>{identifier}</identifier>
+      <datestamp>{datestamp}</datestamp>{sets}
+    </header>'''
+
+LIST_RECORD = '''
+    <record>{header}
+      <metadata>{metadata}</metadata>
+    </record>'''
+
+NOT_FOUND = '''<?xml version="1.0" encoding="UTF-8"?>
+<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">
+  <error code="idDoesNotExist">No matching identifier</error>
+</OAI-PMH>'''
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class OAIServer(object):
+    """Use as a context manager:
+
+        with OAIServer(records) as server:
+            requests.get(server.url, params=...)
+
+    `records` maps (identifier, metadataPrefix) to the XML to put inside the
+    record's <metadata> element; `sets` maps identifiers to lists of
+    setSpecs; and `datestamps` maps identifiers to header datestamps (which
+    list requests filter on, given `from`). List responses are split into
+    pages of `page_size` items, linked by resumptionTokens."""
+    def __init__(self, records=None, failures=0, delay=0, sets=None,
+                 datestamps=None, page_size=100):
+        self.records = records or {}
+        self.sets = sets or {}
+        self.datestamps = datestamps or {}
+        self.page_size = page_size
+        # Respond 503 to this many requests before behaving.
+        self.failures = failures
+        # Seconds to wait before each response.
+        self.delay = delay
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._server = _Server(('127.0.0.1', 0), self._handler())
+        self.url = 'http://127.0.0.1:{}/oai/request'.format(
+            self._server.server_address[1])
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _respond(self, params):
+        with self._lock:
+            self.requests.append(params)
+            if self.failures:
+                self.failures -= 1
+                return 503, 'Service unavailable'
+
+        verb = params.get('verb')
+        if verb in ('ListIdentifiers', 'ListRecords'):
+            return 200, self._list(verb, params)
+        if verb != 'GetRecord':
+            return 400, 'Unsupported verb'
+        key = (params.get('identifier'), params.get('metadataPrefix'))
+        if key not in self.records:
+            return 200, NOT_FOUND
+        return 200, RECORD.format(identifier=key[0],
+                                  metadata=self.records[key])
+
+    def _header(self, identifier):
+        sets = ''.join('<setSpec>{}</setSpec>'.format(spec)
+                       for spec in self.sets.get(identifier, []))
+        return HEADER.format(identifier=identifier, sets=sets,
+                             datestamp=self._datestamp(identifier))
+
+    def _datestamp(self, identifier):
+        return self.datestamps.get(identifier, '2018-01-01T00:00:00Z')
+
+    def _list(self, verb, params):
+        # The resumptionToken is "<metadataPrefix> <from> <offset>".
+        if 'resumptionToken' in params:
+            prefix, since, offset = params['resumptionToken'].split(' ')
+            offset = int(offset)
+        else:
+            prefix = params['metadataPrefix']
+            since = params.get('from', '')
+            offset = 0
+
+        identifiers = sorted(
+            identifier for identifier, record_prefix in self.records
+            if record_prefix == prefix and
+            self._datestamp(identifier)[:10] >= since)
+        page = identifiers[offset:offset + self.page_size]
+        if verb == 'ListIdentifiers':
+            items = ''.join(self._header(identifier) for identifier in page)
+        else:
+            items = ''.join(
+                LIST_RECORD.format(header=self._header(identifier),
+                                   metadata=self.records[(identifier,
+                                                          prefix)])
+                for identifier in page)
+
+        token = ''
+        if offset + self.page_size < len(identifiers):
+            token = '<resumptionToken>{} {} {}</resumptionToken>'.format(
+                prefix, since, offset + self.page_size)
+        return LIST.format(verb=verb, items=items, token=token)
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server._lock:
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight,
+                                               server.in_flight)
+                try:
+                    time.sleep(server.delay)
+                    query = parse_qs(urlparse(self.path).query)
+                    params = {key: values[0]
+                              for key, values in query.items()}
+                    status, body = server._respond(params)
+                finally:
+                    with server._lock:
+                        server.in_flight -= 1
+
+                body = body.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/xml; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,49 @@
+import os
+import tempfile
+
+from django.test import SimpleTestCase
+
+from hamlet.common.tokens import tokenize
+from hamlet.neural.corpus import TokenCache
+
+TEXTS = {'1721.1-1.txt': 'Fluid dynamics, since 1900: a history.',
+         '1721.1-2.txt': 'On the Time of Oneself.\n\nChapter 1',
+         '1721.1-3.txt': ''}
+
+
+class TokenCacheTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        self.paths = []
+        for filename, text in sorted(TEXTS.items()):
+            path = os.path.join(self.dir, filename)
+            with open(path, 'w') as f:
+                f.write(text)
+            self.paths.append(path)
+        self.cache = TokenCache(os.path.join(self.dir, 'tokens'), workers=1)
+        self.corpus_path = os.path.join(self.dir, 'corpora', 'main.corpus')
+
+    def test_corpus_matches_tokenizing_the_text(self):
+        corpus = self.cache.write_corpus(self.paths, self.corpus_path)
+        # Read it twice, as training does.
+        for _ in range(2):
+            documents = [(doc.tags, doc.words) for doc in corpus]
+            assert documents == [([filename], tokenize(text)) for
+                                 filename, text in sorted(TEXTS.items())]
+
+    def test_files_are_only_tokenized_when_they_change(self):
+        assert self.cache.update(self.paths) == 3
+        assert self.cache.update(self.paths) == 0
+
+        with open(self.paths[0], 'w') as f:
+            f.write('Revised text')
+        # Make sure it's newer, even on filesystems with coarse mtimes.
+        stat = os.stat(self.cache.path(self.paths[0]))
+        os.utime(self.paths[0], ns=(stat.st_atime_ns,
+                                    stat.st_mtime_ns + 10 ** 9))
+        assert self.cache.update(self.paths) == 1
+
+        corpus = self.cache.write_corpus(self.paths, self.corpus_path)
+        assert next(iter(corpus)).words == ['revised', 'text']
@@ -0,0 +1,88 @@
+from unittest.mock import patch
+
+from django.test import SimpleTestCase, TestCase
+import numpy as np
+
+from hamlet.neural.train_neural_net import (bootstrap_means, Evaluator,
+                                            interval, tuple_scores)
+from hamlet.theses.models import Contribution, Person, Thesis
+
+
+def cosine(u, v):
+    return np.dot(u, v) / (np.linalg.norm(u) * np.linalg.norm(v))
+
+
+class TupleScoresTests(SimpleTestCase):
+    def test_matches_scoring_tuples_one_at_a_time(self):
+        rng = np.random.RandomState(0)
+        vectors = rng.normal(size=(6, 12)).astype(np.float32)
+        tuples = np.array([[0, 1, 2], [3, 4, 5], [1, 0, 5], [2, 3, 0]])
+
+        expected = [2 * cosine(vectors[a], vectors[b]) -
+                    cosine(vectors[a], vectors[c]) -
+                    cosine(vectors[b], vectors[c]) for a, b, c in tuples]
+        np.testing.assert_allclose(tuple_scores(vectors, tuples), expected,
+                                   rtol=1e-5)
+
+    def test_similar_pairs_score_well(self):
+        vectors = np.array([[1, 0], [1, 0.1], [-1, 0]], dtype=np.float32)
+        good, bad = tuple_scores(vectors, np.array([[0, 1, 2], [0, 2, 1]]))
+        assert good > 3.9
+        assert bad < 0
+
+
+class BootstrapTests(SimpleTestCase):
+    def test_differences_are_paired(self):
+        # Two models whose scores vary a lot from tuple to tuple, but one is
+        # always a little better. Their intervals overlap, but the interval
+        # of the difference shows the improvement is real.
+        base = np.random.RandomState(1).normal(size=2000)
+        scores = np.array([base + 0.05, base])
+        resampled = bootstrap_means(scores, 200)
+
+        better, worse = (interval(row, 0.95) for row in resampled)
+        assert better[0] < worse[1]
+        low, high = interval(resampled[0] - resampled[1], 0.95)
+        assert abs(low - 0.05) < 1e-9 and abs(high - 0.05) < 1e-9
+
+
+class ChooseTuplesTests(TestCase):
+    def setUp(self):
+        for identifier in range(1, 9):
+            Thesis.objects.create(title='Thesis', url='http://example.com',
+                                  year=2000, degree='S.B.',
+                                  identifier=identifier)
+        self.advised = {'Advisor 1': {1, 2, 3}, 'Advisor 2': {4, 5},
+                        'Advisor 3': {6}}
+        for name, identifiers in self.advised.items():
+            person = Person.objects.create(name=name)
+            for identifier in identifiers:
+                Contribution.objects.create(
+                    person=person, role=Contribution.ADVISOR,
+                    thesis=Thesis.objects.get(identifier=identifier))
+
+    def evaluator(self, seed=0):
+        def get_queryset(evaluator):
+            evaluator.training_ids = list(range(1, 9))
+            return Thesis.objects.filter(
+                identifier__in=evaluator.training_ids)
+
+        with patch.object(Evaluator, 'get_queryset', get_queryset):
+            return Evaluator([], seed=seed)
+
+    def test_tuples_pair_advisees_with_an_outsider(self):
+        with self.assertNumQueries(1):
+            evaluator = self.evaluator()
+
+        assert len(evaluator.tuples) == Evaluator.TUPLES
+        for labels in evaluator.tuples:
+            a, b, c = (int(label.split('-')[1].split('.')[0])
+                       for label in labels)
+            shared = [advisees for advisees in self.advised.values()
+                      if a in advisees and b in advisees]
+            assert a != b and len(shared) == 1
+            assert c not in shared[0]
+
+    def test_sampling_is_seeded(self):
+        assert self.evaluator(seed=1).tuples == self.evaluator(seed=1).tuples
+        assert self.evaluator(seed=1).tuples != self.evaluator(seed=2).tuples
@@ -0,0 +1,65 @@
+import os
+import tempfile
+from unittest.mock import patch
+
+import requests
+
+from django.test import SimpleTestCase
+
+from hamlet.neural.extraction import (EXTRACTED, FINAL, PARSE_FAILED,
+                                      UNEXTRACTABLE, download, parse)
+from hamlet.neural.http_client import HttpClient
+
+from .oai_server import OAIServer
+
+
+class ParseTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.pdf_path = os.path.join(self.tmp.name, 'thesis.pdf')
+        self.text_path = os.path.join(self.tmp.name, 'thesis.txt')
+        with open(self.pdf_path, 'wb') as f:
+            f.write(b'%PDF-1.4')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def parse(self, **kwargs):
+        with patch('hamlet.neural.extraction.tikaparser.from_file',
+                   **kwargs):
+            status = parse(self.pdf_path, self.text_path)
+        assert not os.path.exists(self.pdf_path)
+        return status
+
+    def test_extracted(self):
+        status = self.parse(return_value={'status': 200,
+                                          'content': 'Some text'})
+        assert status == EXTRACTED
+        with open(self.text_path) as f:
+            assert f.read() == 'Some text'
+
+    def test_no_content_is_unextractable(self):
+        status = self.parse(return_value={'status': 200, 'content': None})
+        assert status == UNEXTRACTABLE
+
+    def test_tika_failures_are_retried(self):
+        assert self.parse(side_effect=ConnectionError()) == PARSE_FAILED
+        with open(self.pdf_path, 'wb') as f:
+            f.write(b'%PDF-1.4')
+        assert self.parse(return_value={'status': 503,
+                                        'content': None}) == PARSE_FAILED
+        assert PARSE_FAILED not in FINAL
+        assert not os.path.exists(self.text_path)
+
+
+class DownloadTests(SimpleTestCase):
+    def test_error_response_is_not_written(self):
+        client = HttpClient(retries=0, backoff_factor=0)
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                OAIServer(failures=1) as server, \
+                patch('hamlet.neural.extraction.get_client',
+                      return_value=client):
+            pdf_path = os.path.join(tmpdir, 'thesis.pdf')
+            with self.assertRaises(requests.HTTPError):
+                download(server.url, pdf_path)
+            assert not os.path.exists(pdf_path)
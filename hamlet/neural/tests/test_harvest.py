@@ -0,0 +1,126 @@
+from unittest.mock import patch
+
+from django.test import TestCase
+from django.utils.dateparse import parse_datetime
+
+from hamlet.neural.models import Harvest, HarvestedRecord
+from hamlet.neural.train_neural_net import DocFetcher, write_metadata
+from hamlet.theses.models import Thesis
+
+from .oai_server import OAIServer
+
+THESIS_SET = 'hdl_1721.1_18195'
+
+
+def identifier(number):
+    return 'oai:dspace.mit.edu:1721.1/{}'.format(number)
+
+
+class HarvestTests(TestCase):
+    def setUp(self):
+        DocFetcher.DOCS_CACHE.clear()
+        numbers = range(1, 6)
+        self.records = {}
+        for number in numbers:
+            self.records[(identifier(number), 'mets')] = \
+                '<mets>{}</mets>'.format(number)
+            self.records[(identifier(number), 'rdf')] = \
+                '<rdf>{}</rdf>'.format(number)
+        # Item 5 isn't a thesis.
+        self.sets = {identifier(number): [THESIS_SET] for number in numbers}
+        self.sets[identifier(5)] = ['hdl_1721.1_1']
+
+    def test_get_record_list_follows_resumption_tokens(self):
+        with OAIServer(self.records, sets=self.sets,
+                       page_size=2) as server:
+            items = list(DocFetcher().get_record_list(server.url))
+
+        assert [item['identifier'] for item in items] == \
+            ['1', '2', '3', '4', '5']
+        assert items[0]['sets'] == [THESIS_SET]
+        assert len(server.requests) == 3
+        assert 'resumptionToken' in server.requests[1]
+        assert 'metadataPrefix' not in server.requests[1]
+
+    def test_harvest_records_pairs_formats(self):
+        with OAIServer(self.records, sets=self.sets, page_size=2) as server, \
+                patch('hamlet.neural.train_neural_net.DSPACE_OAI_URI',
+                      server.url), \
+                patch.object(DocFetcher, 'write_metadata') as write:
+            DocFetcher().get_network_files({'write_metadata': True})
+
+        written = [(dc, mets) for (dc, mets, _), _ in write.call_args_list]
+        assert len(written) == 4
+        for number, (dc, mets) in enumerate(written, 1):
+            assert '>{}</'.format(number) in dc and 'rdf>' in dc
+            assert '>{}</'.format(number) in mets and 'mets>' in mets
+        # Two passes of three pages, rather than a request per item.
+        assert len(server.requests) == 6
+
+
+class IncrementalHarvestTests(TestCase):
+    def setUp(self):
+        DocFetcher.DOCS_CACHE.clear()
+        self.records = {}
+        self.sets = {}
+        for number in range(1, 5):
+            self.records[(identifier(number), 'mets')] = \
+                '<mets>{}</mets>'.format(number)
+            self.records[(identifier(number), 'rdf')] = \
+                '<rdf>{}</rdf>'.format(number)
+            self.sets[identifier(number)] = [THESIS_SET]
+        # Items 1 and 2 are old; 3 and 4 changed recently.
+        self.datestamps = {identifier(number): '2018-07-01T00:00:00Z'
+                           for number in (3, 4)}
+
+    def harvest(self, args):
+        with OAIServer(self.records, sets=self.sets,
+                       datestamps=self.datestamps) as server, \
+                patch('hamlet.neural.train_neural_net.DSPACE_OAI_URI',
+                      server.url), \
+                patch.object(DocFetcher, 'write_metadata',
+                             return_value=True) as write:
+            write_metadata(dict(args, write_metadata=True))
+        return server, write
+
+    def test_incremental_harvest_starts_at_high_water_mark(self):
+        harvest = Harvest.objects.create(succeeded=True)
+        Harvest.objects.filter(pk=harvest.pk).update(
+            started=parse_datetime('2018-06-01T12:00:00Z'))
+
+        server, write = self.harvest({'incremental': True})
+
+        assert server.requests[0]['from'] == '2018-06-01'
+        written = [mets for (_, mets, _), _ in write.call_args_list]
+        assert len(written) == 2
+        for number, mets in zip((3, 4), written):
+            assert '>{}</'.format(number) in mets and 'mets>' in mets
+
+        latest = Harvest.objects.first()
+        assert latest.succeeded
+        assert latest.records_written == 2
+        assert Harvest.high_water_mark().isoformat() > '2018-06-01'
+        assert set(HarvestedRecord.objects.values_list(
+            'identifier', flat=True)) == {3, 4}
+
+    def test_changed_records_update_existing_theses(self):
+        for number in (1, 3):
+            Thesis.objects.create(title='Old title', url='http://example.com',
+                                  year=2000, degree='S.B.', identifier=number)
+            HarvestedRecord.objects.create(
+                identifier=number,
+                datestamp=parse_datetime('2018-01-01T00:00:00Z'))
+
+        _, write = self.harvest({})
+
+        # The records come whole, headers and all; pick out the numbers.
+        calls = {number: kwargs['update']
+                 for (_, mets, _), kwargs in write.call_args_list
+                 for number in range(1, 5)
+                 if '>{}</'.format(number) in mets}
+        # Unchanged thesis 1 is skipped, changed thesis 3 is updated, and
+        # theses 2 and 4 are new.
+        assert len(write.call_args_list) == 3
+        assert calls == {2: False, 3: True, 4: False}
+        assert HarvestedRecord.objects.get(identifier=3).datestamp == \
+            parse_datetime('2018-07-01T00:00:00Z')
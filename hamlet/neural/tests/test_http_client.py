@@ -0,0 +1,67 @@
+from unittest.mock import patch
+
+import requests
+
+from django.test import SimpleTestCase, TestCase
+
+from hamlet.neural.http_client import HttpClient
+from hamlet.neural.train_neural_net import DocFetcher
+
+from .oai_server import OAIServer
+
+PREFIX = 'oai:dspace.mit.edu:1721.1/'
+
+
+class HttpClientTests(SimpleTestCase):
+    def test_retries_transient_errors(self):
+        client = HttpClient(backoff_factor=0)
+        with OAIServer({(PREFIX + '1', 'mets'): '<mets/>'},
+                       failures=2) as server:
+            text = client.get_text(server.url, params={
+                'verb': 'GetRecord', 'identifier': PREFIX + '1',
+                'metadataPrefix': 'mets'})
+        assert '<mets/>' in text
+        assert len(server.requests) == 3
+
+    def test_gives_up_eventually(self):
+        client = HttpClient(retries=1, backoff_factor=0)
+        with OAIServer(failures=5) as server:
+            with self.assertRaises(requests.HTTPError):
+                client.get(server.url, params={'verb': 'GetRecord'})
+        assert len(server.requests) == 2
+
+    def test_concurrency_limit(self):
+        client = HttpClient(max_concurrency=2)
+        with OAIServer(delay=0.1) as server:
+            client.get_texts([{'url': server.url,
+                               'params': {'verb': 'GetRecord'}}] * 6)
+        assert server.max_in_flight == 2
+
+
+class DocFetcherTests(TestCase):
+    def test_get_records_fetches_formats_concurrently(self):
+        records = {(PREFIX + '1', 'mets'): '<mets/>',
+                   (PREFIX + '1', 'rdf'): '<rdf/>'}
+        with OAIServer(records, delay=0.2) as server:
+            mets, rdf = DocFetcher().get_records(
+                server.url, PREFIX, '1', ['mets', 'rdf'])
+        assert '<mets/>' in mets
+        assert '<rdf/>' in rdf
+        assert server.max_in_flight == 2
+
+    def test_get_single_network_file(self):
+        records = {(PREFIX + '1', 'mets'): '<mets/>',
+                   (PREFIX + '1', 'rdf'): '<rdf/>'}
+        item = {'handle': '1721.1-1', 'identifier': '1', 'sets': []}
+        with OAIServer(records) as server, \
+                patch('hamlet.neural.train_neural_net.DSPACE_OAI_URI',
+                      server.url), \
+                patch('hamlet.neural.train_neural_net.DSPACE_OAI_IDENTIFIER',
+                      PREFIX), \
+                patch.object(DocFetcher, 'write_metadata') as write:
+            DocFetcher().get_single_network_file(
+                item, {'write_metadata': True})
+
+        (dc, mets, sets), _ = write.call_args
+        assert '<rdf/>' in dc
+        assert '<mets/>' in mets
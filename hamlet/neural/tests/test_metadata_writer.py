@@ -0,0 +1,130 @@
+from io import StringIO
+import json
+import os
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from hamlet.neural.train_neural_net import BulkMetadataWriter, MetadataWriter
+from hamlet.theses.models import Department, Person, Thesis
+
+MASTERS_SET = 'hdl_1721.1_7631'
+
+DC = '''<oai_dc:dc xmlns:oai_dc="http://www.openarchives.org/OAI/2.0/oai_dc/"
+    xmlns:dc="http://purl.org/dc/elements/1.1/">
+  <dc:title>{title}</dc:title>
+  <dc:creator>{author}</dc:creator>
+  <dc:contributor>{advisor}</dc:contributor>
+  <dc:contributor>Dept. of Physics.</dc:contributor>
+  <dc:date>2012</dc:date>
+  <dc:date>2013-01-01T00:00:00Z</dc:date>
+  <dc:identifier>http://hdl.handle.net/1721.1/{identifier}</dc:identifier>
+</oai_dc:dc>'''
+
+METS = '''<mets:mets xmlns:mets="http://www.loc.gov/METS/"
+    xmlns:mods="http://www.loc.gov/mods/v3"
+    xmlns:xlink="http://www.w3.org/1999/xlink">
+  <mods:mods><mods:titleInfo><mods:title>{title}</mods:title></mods:titleInfo>
+  </mods:mods>
+  <mets:fileSec><mets:fileGrp>
+    <mets:file MIMETYPE="application/pdf">
+      <mets:FLocat xlink:href="http://dspace.mit.edu/{identifier}.pdf"/>
+    </mets:file>
+  </mets:fileGrp></mets:fileSec>
+</mets:mets>'''
+
+
+def records(identifier, title='A thesis', author='Hopper, Grace',
+            advisor='Lovelace, Ada'):
+    fields = {'identifier': identifier, 'title': title, 'author': author,
+              'advisor': advisor}
+    return DC.format(**fields), METS.format(**fields), [MASTERS_SET]
+
+
+class BulkMetadataWriterTests(TestCase):
+    def test_writes_theses_like_metadata_writer(self):
+        MetadataWriter().write(*records(1))
+        writer = BulkMetadataWriter()
+        assert writer.write(*records(2))
+        # Nothing is written until the chunk is flushed.
+        assert not Thesis.objects.filter(identifier=2).exists()
+        writer.flush()
+
+        one = Thesis.objects.get(identifier=1)
+        two = Thesis.objects.get(identifier=2)
+        for field in ('title', 'year', 'degree'):
+            assert getattr(two, field) == getattr(one, field)
+        assert two.url == 'https://dspace.mit.edu/2.pdf'
+        assert list(two.authors) == list(one.authors)
+        assert list(two.advisors) == list(one.advisors)
+        assert list(two.department.all()) == list(one.department.all())
+        # The people and department written by MetadataWriter are reused.
+        assert Person.objects.count() == 2
+        assert Department.objects.count() == 1
+
+    def test_chunks_take_constant_queries(self):
+        writer = BulkMetadataWriter(chunk_size=20)
+        with CaptureQueriesContext(connection) as queries:
+            for identifier in range(1, 21):
+                writer.write(*records(
+                    identifier, author='Author {}'.format(identifier)))
+        assert Thesis.objects.count() == 20
+        assert Person.objects.count() == 21
+        assert writer.written == 20
+        assert len(queries) < 20
+
+    def test_non_theses_are_skipped(self):
+        writer = BulkMetadataWriter()
+        dc, mets, _ = records(1)
+        assert not writer.write(dc, mets, [])
+        assert not writer.write('<not xml', mets, [MASTERS_SET])
+        assert writer.pending == []
+
+    def test_updates_only_when_asked(self):
+        writer = BulkMetadataWriter()
+        writer.write(*records(1))
+        writer.flush()
+
+        writer.write(*records(1, title='Ignored', author='Someone Else'))
+        writer.flush()
+        assert Thesis.objects.get(identifier=1).title == 'A thesis'
+
+        writer.write(*records(1, title='Corrected', author='Someone Else'),
+                     update=True)
+        writer.flush()
+        thesis = Thesis.objects.get(identifier=1)
+        assert thesis.title == 'Corrected'
+        assert [p.name for p in thesis.authors] == ['Someone Else']
+        assert [p.name for p in thesis.advisors] == ['Lovelace, Ada']
+        assert thesis.department.count() == 1
+
+
+class ExtractMetadataTests(TestCase):
+    def setUp(self):
+        with open(os.path.join(os.path.dirname(__file__), 'fixtures',
+                               'sample_records.json')) as f:
+            self.corpus = json.load(f)
+
+    def test_sample_records(self):
+        writer = MetadataWriter()
+        for record in self.corpus:
+            datadict = writer.thesis_metadata(record['dc'], record['mets'],
+                                              record['sets'])
+            assert datadict == record['expected'], record['identifier']
+
+    def test_degree_falls_back_to_mets_notes(self):
+        # These records' sets don't name a degree; the thesis statement in
+        # the mets notes does.
+        writer = MetadataWriter()
+        for record in self.corpus[1:3]:
+            datadict = writer.extract_metadata(record['dc'], record['mets'],
+                                               [])
+            assert datadict['degree'] == record['expected']['degree']
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark_metadata', repeat=1, stdout=out)
+        assert 'Extracted {} records'.format(len(self.corpus)) in \
+            out.getvalue()
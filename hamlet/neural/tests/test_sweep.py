@@ -0,0 +1,88 @@
+import csv
+import os
+import tempfile
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+from gensim.models.doc2vec import Doc2Vec
+
+from hamlet.neural import sweep
+from hamlet.neural.corpus import TokenCorpus
+
+GiB = 1024 ** 3
+
+
+class PoolSizeTests(SimpleTestCase):
+    @patch('hamlet.neural.sweep.os.cpu_count', return_value=16)
+    def test_limited_by_cores(self, _):
+        with patch('hamlet.neural.sweep.available_memory',
+                   return_value=64 * GiB):
+            assert sweep.pool_size(GiB, 2, 28) == 8
+
+    @patch('hamlet.neural.sweep.os.cpu_count', return_value=16)
+    def test_limited_by_memory(self, _):
+        with patch('hamlet.neural.sweep.available_memory',
+                   return_value=3 * GiB):
+            assert sweep.pool_size(GiB, 2, 28) == 3
+            # But always at least one.
+            assert sweep.pool_size(4 * GiB, 2, 28) == 1
+
+    @patch('hamlet.neural.sweep.os.cpu_count', return_value=16)
+    def test_limited_by_jobs(self, _):
+        with patch('hamlet.neural.sweep.available_memory', return_value=None):
+            assert sweep.pool_size(GiB, 1, 4) == 4
+
+
+class SavedModelBytesTests(SimpleTestCase):
+    def test_counts_npy_files(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'net.model')
+            for filename, size in [('net.model', 100),
+                                   ('net.model.docvecs.vectors_docs.npy',
+                                    1000),
+                                   ('net.model.wv.vectors.npy', 900),
+                                   ('other.model.wv.vectors.npy', 5000)]:
+                with open(os.path.join(tmp, filename), 'wb') as f:
+                    f.write(b'\0' * size)
+            assert sweep.saved_model_bytes(path) == 3000
+
+
+class RunSweepTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        # Enough repetition for every word to clear min_count.
+        words = ['alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta']
+        self.corpus_path = os.path.join(self.dir, 'main.corpus')
+        with open(self.corpus_path, 'w') as f:
+            for number in range(20):
+                doc = [words[(number + i) % len(words)] for i in range(30)]
+                f.write('1721.1-{}.txt {}\n'.format(number, ' '.join(doc)))
+
+    def test_configs_share_vocabulary(self):
+        results_path = os.path.join(self.dir, 'sweep.csv')
+        results = sweep.run_sweep(
+            TokenCorpus(self.corpus_path),
+            vocab_path=os.path.join(self.dir, 'vocab.model'),
+            configs=[(3, 8), (5, 12)],
+            output_path=os.path.join(self.dir, 'm_w{window}_s{size}.model'),
+            results_path=results_path,
+            threads_per_model=1)
+
+        assert sorted((r['window'], r['size']) for r in results) == \
+            [(3, 8), (5, 12)]
+        with open(results_path) as f:
+            rows = list(csv.DictReader(f))
+        assert len(rows) == 2
+        assert all(float(row['peak_rss_mb']) > 0 for row in rows)
+
+        for window, size in [(3, 8), (5, 12)]:
+            path = os.path.join(self.dir,
+                                'm_w{}_s{}.model'.format(window, size))
+            model = Doc2Vec.load(path)
+            assert model.window == window
+            assert model.vector_size == size
+            assert sorted(model.wv.vocab) == \
+                ['alpha', 'beta', 'delta', 'epsilon', 'gamma', 'zeta']
+            assert len(model.docvecs) == 20
@@ -1,23 +1,33 @@
 from glob import glob
+import io
 import json
 import logging
+import multiprocessing
 import os
 import random
 import re
+import shelve
 import shutil
-from string import punctuation
+import tempfile
 import time
 import xml.etree.ElementTree as ET
 
 from gensim.models.doc2vec import LabeledSentence, Doc2Vec
-from nltk import sent_tokenize, WordPunctTokenizer
-import requests
-from tika import parser as tikaparser
+import numpy as np
 
+from django.db import transaction
 from django.db.models import Count
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.db.utils import DataError
 
-from hamlet.theses.models import Thesis, Contribution, Person
+from hamlet.common.tokens import tokenize
+from hamlet.neural.corpus import TokenCache
+from hamlet.neural.extraction import TextExtractor
+from hamlet.neural.http_client import get_client
+from hamlet.neural.sweep import pool_size, run_sweep, saved_model_bytes
+from hamlet.neural.models import Harvest, HarvestedRecord
+from hamlet.theses.models import Thesis, Contribution, Department, Person
 
 # See https://medium.com/@klintcho/doc2vec-tutorial-using-gensim-ab3ac03d3a1
 
@@ -55,15 +65,70 @@ class LabeledLineSentence(object):
                                   tags=[os.path.basename(filename)])
 
     def _tokenize(self, doc):
-        all_tokens = []
-        sentences = sent_tokenize(doc)
-
-        tokenizer = WordPunctTokenizer()
-        for sentence in sentences:
-            words = tokenizer.tokenize(sentence.lower())
-            words = [word for word in words if word not in punctuation]
-            all_tokens.extend(words)
-        return all_tokens
+        # Uploaded documents are tokenized the same way; see
+        # hamlet.common.document.
+        return tokenize(doc)
+
+
+def _tag(prefix, name):
+    return '{{{}}}{}'.format(METS_NAMESPACE[prefix], name)
+
+
+XLINK_HREF = '{http://www.w3.org/1999/xlink}href'
+
+
+def _collect(field):
+    # A RecordFields handler which appends element text to a list.
+    def handler(fields, element):
+        if element.text:
+            getattr(fields, field).append(element.text)
+    return handler
+
+
+class RecordFields(object):
+    """The parts of a thesis's dc and mets records that MetadataWriter
+    needs, gathered in a single pass over each record.
+
+    Each element is visited once and dispatched on its tag (see HANDLERS),
+    rather than searching the whole tree again for each field."""
+    def __init__(self):
+        self.creators = []
+        self.contributors = []
+        self.dates = []
+        self.identifiers = []
+        self.notes = []
+        self.title = None
+        self.url = None
+
+    def _title(self, element):
+        # The first title is the thesis's own; later ones belong to related
+        # items, like the series.
+        if self.title is None:
+            self.title = element.text or ''
+
+    def _file(self, element):
+        if self.url is None and \
+                element.get('MIMETYPE') == 'application/pdf' and len(element):
+            self.url = element[0].get(XLINK_HREF)
+
+    HANDLERS = {
+        _tag('dc', 'creator'): _collect('creators'),
+        _tag('dc', 'contributor'): _collect('contributors'),
+        _tag('dc', 'date'): _collect('dates'),
+        _tag('dc', 'identifier'): _collect('identifiers'),
+        _tag('mods', 'note'): _collect('notes'),
+        _tag('mods', 'title'): _title,
+        _tag('mets', 'file'): _file,
+    }
+
+    def feed(self, record):
+        """Parse one record (an XML string), collecting its fields. Raises
+        ET.ParseError if it isn't well-formed."""
+        for element in ET.fromstring(record).iter():
+            handler = self.HANDLERS.get(element.tag)
+            if handler is not None:
+                handler(self, element)
+        return self
 
 
 class MetadataWriter(object):
@@ -72,14 +137,15 @@ class MetadataWriter(object):
                       "Master's degree",
                       "Ph.D. / Sc.D."]
 
-    def extract_contributors(self, metadata):
+    YEAR = re.compile(r'^[0-9]{4}$')
+    HANDLE = re.compile(r'http[s]?://hdl.handle.net/1721.1/([0-9]*)')
+
+    def extract_contributors(self, contributors):
         # Includes advisor and department.
-        contributors = metadata.findall('.//dc:contributor', METS_NAMESPACE)
         advisors = []
         departments = []
 
-        for contributor in contributors:
-            text = contributor.text
+        for text in contributors:
             if not text:
                 continue
             if any(['Massachusetts Institute' in text,
@@ -90,17 +156,15 @@ class MetadataWriter(object):
                 advisors.append(text)
         return advisors, departments
 
-    def extract_date(self, metadata):
+    def extract_date(self, dates):
         # There will be several (representing copyright, accessioning, etc.)
         # The copyright date will be a four-digit year. Find the earliest
         # year (there may be a substantial difference between copyright year
         # and archival processing years).
-        date_format = r'^[0-9]{4}$'
-        dates = metadata.findall('.//dc:date', METS_NAMESPACE)
         earliest = 20000
         for date in dates:
-            if re.match(date_format, date.text):
-                year = int(date.text)
+            if self.YEAR.match(date):
+                year = int(date)
                 if year < earliest:
                     earliest = year
         return earliest
@@ -122,98 +186,98 @@ class MetadataWriter(object):
 
         return None
 
-    def extract_degree(self, metadata, item_sets):
+    def extract_degree(self, notes, item_sets):
         if item_sets:
             degree = self.extract_degree_from_sets(item_sets)
             if degree:
                 return degree
 
-        try:
-            result = [e.text for e in
-                      self.mets.findall('.//mods:note', METS_NAMESPACE) if
-                      e.text is not None and
-                      (e.text.startswith('Thesis') or
-                       e.text.startswith('Massachusetts Institute of '
-                                         'Technology'))]
-        except AttributeError:
-            result = None
+        result = [note for note in notes if
+                  note.startswith('Thesis') or
+                  note.startswith('Massachusetts Institute of Technology')]
         deg_text = result[0] if result else None
+        degrees = Thesis.extract_degree(deg_text) if deg_text else None
 
-        return Thesis.extract_degree(deg_text) if deg_text else None
-
-    def extract_identifier(self, metadata):
-        identifiers = metadata.findall('.//dc:identifier', METS_NAMESPACE)
-        id_str = None
-        matcher = r'http[s]?://hdl.handle.net/1721.1/([0-9]*)'
+        return degrees[0] if degrees else None
 
+    def extract_identifier(self, identifiers):
         # There may be multiple identifiers; find the first that looks like a
         # handle.
         for identifier in identifiers:
-            try:
-                id_str = re.match(matcher, identifier.text).groups()[0]
-                return int(id_str)
-            except AttributeError:
-                continue
+            match = self.HANDLE.match(identifier)
+            if match:
+                return int(match.group(1))
 
     def extract_metadata(self, metadata_dc, metadata_mets, item_sets):
         try:
-            dc = ET.fromstring(metadata_dc)
-            mets = ET.fromstring(metadata_mets)
+            dc = RecordFields().feed(metadata_dc)
+            mets = RecordFields().feed(metadata_mets)
         except ET.ParseError:
             return None
 
-        authors = dc.findall('.//dc:creator', METS_NAMESPACE)
-        advisors, departments = self.extract_contributors(dc)
-        date = self.extract_date(dc)
-        degree = self.extract_degree(mets, item_sets)
-        id = self.extract_identifier(dc)
-        title = self.extract_title(mets)
-        url = self.extract_url(mets)
+        advisors, departments = self.extract_contributors(dc.contributors)
+        url = mets.url
+        if url:
+            url = url.replace('http://', 'https://')
 
-        return {'authors': [author.text for author in authors],
+        return {'authors': dc.creators,
                 'advisors': advisors,
-                'date': date,
-                'degree': degree,
+                'date': self.extract_date(dc.dates),
+                'degree': self.extract_degree(mets.notes, item_sets),
                 'departments': departments,
-                'id': id,
-                'title': title,
+                'id': self.extract_identifier(dc.identifiers),
+                'title': mets.title or '',
                 'url': url}
 
-    def extract_title(self, mets):
-        title = mets.find('.//mods:title', METS_NAMESPACE)
-        try:
-            return title.text
-        except:
-            return ''
-
-    def extract_url(self, mets):
-        record = mets.find('.//mets:file[@MIMETYPE="application/pdf"]/',
-                           METS_NAMESPACE)
-
-        # Do this instead of "if not record: return", because record will be
-        # falsy *even when it exists*.
-        try:
-            url = record.get('{http://www.w3.org/1999/xlink}href')
-        except:
-            return None
-
-        if url:
-            url = url.replace('http://', 'https://')
-
-        return url
-
-    def write(self, metadata_dc, metadata_mets, item_sets):
+    def update(self, thesis, datadict):
+        thesis.title = datadict['title']
+        thesis.url = datadict['url']
+        thesis.year = datadict['date']
+        thesis.degree = datadict['degree']
+        thesis.save()
+        # Replace people and departments rather than merging, in case the
+        # change was a correction.
+        thesis.contribution_set.all().delete()
+        thesis.department.clear()
+        thesis.add_people(datadict['authors'])
+        thesis.add_people(datadict['advisors'], author=False)
+        thesis.add_departments(datadict['departments'])
+        logger.debug('Updated thesis {}'.format(thesis.identifier))
+
+    def thesis_metadata(self, metadata_dc, metadata_mets, item_sets):
+        """extract_metadata(), or None if the records aren't a thesis (or
+        are missing anything we need)."""
         datadict = self.extract_metadata(metadata_dc, metadata_mets, item_sets)
         if not datadict:
-            return False
+            return None
         # Catch non-thesis objects.
         required = ['title', 'url', 'date', 'id', 'degree', 'authors',
                     'advisors', 'departments']
         if not all([datadict[key] for key in required]):
+            return None
+        return datadict
+
+    def write(self, metadata_dc, metadata_mets, item_sets, update=False):
+        """Create a Thesis from its metadata records, if it doesn't exist
+        yet. If it does, and update is True, update it to match the records
+        (for records which have changed since we last saw them)."""
+        datadict = self.thesis_metadata(metadata_dc, metadata_mets, item_sets)
+        if not datadict:
             return False
+        self.write_thesis(datadict, update)
+        return True
 
+    def write_thesis(self, datadict, update=False):
         try:
-            Thesis.objects.get(identifier=datadict['id'])
+            thesis = Thesis.objects.get(identifier=datadict['id'])
+            if update:
+                try:
+                    with transaction.atomic():
+                        self.update(thesis, datadict)
+                except DataError as e:
+                    print('~~~~~~Failed; identifier was {}'.format(
+                        datadict['id']))
+                    print(e)
         except Thesis.DoesNotExist:
             try:
                 thesis = Thesis.objects.create(
@@ -231,17 +295,208 @@ class MetadataWriter(object):
                 print('~~~~~~Failed; identifier was {}'.format(datadict['id']))
                 print(e)
 
+    def flush(self):
+        """Write anything still pending. MetadataWriter writes as it goes, so
+        there's nothing to do; see BulkMetadataWriter."""
+        pass
+
+
+class BulkMetadataWriter(MetadataWriter):
+    """A MetadataWriter which writes theses in chunks, rather than one at a
+    time.
+
+    Writing a thesis with MetadataWriter takes around a dozen queries (an
+    existence check, the insert, then a lookup or two per person and
+    department). This instead queues parsed records, and writes each chunk of
+    `chunk_size` in one transaction with a handful of bulk queries, using
+    in-memory maps of Person and Department names to pks. Call flush() once
+    the last record has been written."""
+    def __init__(self, chunk_size=500):
+        self.chunk_size = chunk_size
+        # (datadict, update) pairs waiting to be written.
+        self.pending = []
+        # Name -> pk, loaded on first use.
+        self._people = None
+        self._departments = None
+        # Records written, and seconds spent writing them.
+        self.written = 0
+        self.elapsed = 0.0
+
+    def write(self, metadata_dc, metadata_mets, item_sets, update=False):
+        datadict = self.thesis_metadata(metadata_dc, metadata_mets, item_sets)
+        if not datadict:
+            return False
+        self.pending.append((datadict, update))
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
         return True
 
+    def flush(self):
+        if not self.pending:
+            return
+        chunk, self.pending = self.pending, []
+        start = time.time()
+        try:
+            with transaction.atomic():
+                self.write_chunk(chunk)
+        except DataError:
+            # Something in the chunk doesn't fit (e.g. an overlong name);
+            # write the records one at a time, so only the bad one is lost.
+            # The name maps may include rows that were rolled back.
+            self._people = None
+            self._departments = None
+            for datadict, update in chunk:
+                self.write_thesis(datadict, update)
+        self.written += len(chunk)
+        self.elapsed += time.time() - start
+
+    @property
+    def rate(self):
+        """Records written per second of writing."""
+        return self.written / self.elapsed if self.elapsed else 0.0
+
+    def _name_map(self, model, names, current):
+        """Update the name -> pk map `current` (or load it, if it's None) to
+        include all of `names`, creating any that don't exist yet."""
+        if current is None:
+            # Names aren't unique; as with get_or_create, keep the first.
+            current = {}
+            for name, pk in model.objects.order_by('-pk').values_list(
+                    'name', 'pk'):
+                current[name] = pk
+        missing = set(names) - set(current)
+        if missing:
+            model.objects.bulk_create(
+                [model(name=name) for name in missing], batch_size=1000)
+            # Not every database returns pks from bulk_create.
+            created = model.objects.filter(name__in=missing).order_by('-pk')
+            for name, pk in created.values_list('name', 'pk'):
+                current[name] = pk
+        return current
+
+    def write_chunk(self, chunk):
+        identifiers = [datadict['id'] for datadict, _ in chunk]
+        existing = dict(Thesis.objects.filter(
+            identifier__in=identifiers).values_list('identifier', 'pk'))
+
+        # Existing theses are only touched if asked to update them, as with
+        # MetadataWriter. Later duplicates of an identifier win.
+        records = {}
+        for datadict, update in chunk:
+            if datadict['id'] not in existing or update:
+                records[datadict['id']] = datadict
+
+        Thesis.objects.bulk_create(
+            [Thesis(title=d['title'], url=d['url'], year=d['date'],
+                    identifier=d['id'], degree=d['degree'])
+             for identifier, d in records.items()
+             if identifier not in existing],
+            ignore_conflicts=True)
+
+        updated = Thesis.objects.filter(identifier__in=[
+            identifier for identifier in records if identifier in existing])
+        changed = []
+        for thesis in updated:
+            datadict = records[thesis.identifier]
+            thesis.title = datadict['title']
+            thesis.url = datadict['url']
+            thesis.year = datadict['date']
+            thesis.degree = datadict['degree']
+            changed.append(thesis)
+        Thesis.objects.bulk_update(changed,
+                                   ['title', 'url', 'year', 'degree'])
+        # Replace people and departments of updated theses, as in update().
+        changed_pks = [thesis.pk for thesis in changed]
+        Contribution.objects.filter(thesis_id__in=changed_pks).delete()
+        Thesis.department.through.objects.filter(
+            thesis_id__in=changed_pks).delete()
+
+        thesis_pks = dict(Thesis.objects.filter(
+            identifier__in=list(records)).values_list('identifier', 'pk'))
+
+        contributions = {}
+        departments = {}
+        for identifier, datadict in records.items():
+            names = []
+            for role, key in ((Contribution.AUTHOR, 'authors'),
+                              (Contribution.ADVISOR, 'advisors')):
+                for person in datadict[key]:
+                    for name in Person.clean_metadata(person):
+                        names.append((name, role))
+            contributions[identifier] = names
+            departments[identifier] = [
+                Department.clean_metadata(dept)
+                for dept in datadict['departments']]
+
+        self._people = self._name_map(
+            Person, [name for names in contributions.values()
+                     for name, _ in names], self._people)
+        self._departments = self._name_map(
+            Department, [name for names in departments.values()
+                         for name in names], self._departments)
+
+        # A person appears once per role per thesis, as in add_people().
+        new_contributions = set()
+        for identifier, names in contributions.items():
+            for name, role in names:
+                new_contributions.add(
+                    (thesis_pks[identifier], self._people[name], role))
+        Contribution.objects.bulk_create(
+            [Contribution(thesis_id=thesis_pk, person_id=person_pk, role=role)
+             for thesis_pk, person_pk, role in new_contributions],
+            batch_size=1000, ignore_conflicts=True)
+
+        links = set()
+        for identifier, names in departments.items():
+            for name in names:
+                links.add((thesis_pks[identifier], self._departments[name]))
+        Thesis.department.through.objects.bulk_create(
+            [Thesis.department.through(thesis_id=thesis_pk,
+                                       department_id=department_pk)
+             for thesis_pk, department_pk in links],
+            batch_size=1000, ignore_conflicts=True)
+
+
+class OAIPage(object):
+    """One page of an OAI-PMH list response (ListIdentifiers or ListRecords),
+    parsed incrementally.
+
+    Iterating yields each <header> or <record> element (per `tag`) as soon
+    as it has been parsed, then clears it, so memory use doesn't grow with
+    the size of the page. Once iteration finishes, `resumption_token` holds
+    the token for the next page, or None if this was the last one."""
+    def __init__(self, source, tag):
+        # source is a file-like object, e.g. a streamed response body.
+        self.source = source
+        self.tag = '{{{}}}{}'.format(METS_NAMESPACE['oai'], tag)
+        self.resumption_token = None
+
+    def __iter__(self):
+        token_tag = '{{{}}}resumptionToken'.format(METS_NAMESPACE['oai'])
+        for _, element in ET.iterparse(self.source, events=('end',)):
+            if element.tag == self.tag:
+                yield element
+                element.clear()
+            elif element.tag == token_tag:
+                self.resumption_token = element.text or None
+
 
 class DocFetcher(object):
     DOCS_CACHE = {}
     WRITER = MetadataWriter()
 
+    def __init__(self, writer=None):
+        # E.g. a BulkMetadataWriter, instead of writing theses one by one.
+        if writer is not None:
+            self.WRITER = writer
+
     def get_network_files(self, args, start_date=None, end_date=None):
         print('Network files!!!!!!')
-        items = self.get_record_list(DSPACE_OAI_URI, start_date, end_date)
-        parsed_items = self.parse_record_list(items)
+        if args.get('list_records', True):
+            return self.harvest_records(args, start_date, end_date)
+
+        parsed_items = self.get_record_list(DSPACE_OAI_URI, start_date,
+                                            end_date)
         total_items_processed = 0
 
         for item in parsed_items:
@@ -258,47 +513,196 @@ class DocFetcher(object):
             if 'textfile' not in self.DOCS_CACHE[item['handle']].keys():
                 self.get_single_network_file(item, args)
 
+        self.WRITER.flush()
+        return total_items_processed
+
     def get_record(self, dspace_oai_uri, dspace_oai_identifier, identifier,
                    metadata_format):
         '''Gets metadata record for a single item in OAI-PMH repository in
         specified metadata format.
         '''
-        params = {'verb': 'GetRecord',
-                  'identifier': dspace_oai_identifier + identifier,
-                  'metadataPrefix': metadata_format}
-        r = requests.get(dspace_oai_uri, params=params)
-        return r.text
+        return self.get_records(dspace_oai_uri, dspace_oai_identifier,
+                                identifier, [metadata_format])[0]
 
-    def get_record_list(self, dspace_oai_uri, start_date=None,
-                        end_date=None):
-        '''Returns a list of record headers for items in OAI-PMH repository.
-        Must pass in desired metadata format prefix. Can optionally pass
-        bounding dates to limit harvest.
+    def get_records(self, dspace_oai_uri, dspace_oai_identifier, identifier,
+                    metadata_formats):
+        '''Gets metadata records for a single item in several formats at
+        once. Returns the records in the same order as the formats.
         '''
-        params = {'verb': 'ListIdentifiers', 'metadataPrefix': 'mets'}
+        return get_client().get_texts([
+            {'url': dspace_oai_uri,
+             'params': {'verb': 'GetRecord',
+                        'identifier': dspace_oai_identifier + identifier,
+                        'metadataPrefix': metadata_format}}
+            for metadata_format in metadata_formats])
+
+    def list_elements(self, dspace_oai_uri, verb, tag, params):
+        '''Yields every <tag> element of an OAI-PMH list request, following
+        resumptionTokens through all the pages. Each page is streamed and
+        parsed as it arrives.
+        '''
+        params = dict(params, verb=verb)
+        while True:
+            response = get_client().get(dspace_oai_uri, params=params,
+                                        stream=True)
+            response.raw.decode_content = True
+            page = OAIPage(response.raw, tag)
+            for element in page:
+                yield element
+            response.close()
+
+            if not page.resumption_token:
+                return
+            # Later requests carry only the token, per the OAI-PMH spec.
+            params = {'verb': verb, 'resumptionToken': page.resumption_token}
 
+    def _list_params(self, metadata_format, start_date, end_date):
+        params = {'metadataPrefix': metadata_format}
         if start_date:
             params['from'] = start_date
         if end_date:
             params['until'] = end_date
+        return params
+
+    def get_record_list(self, dspace_oai_uri, start_date=None,
+                        end_date=None):
+        '''Yields record headers (as dicts; see parse_header) for all items
+        in OAI-PMH repository. Can optionally pass bounding dates to limit
+        harvest.
+        '''
+        params = self._list_params('mets', start_date, end_date)
+        for header in self.list_elements(dspace_oai_uri, 'ListIdentifiers',
+                                         'header', params):
+            yield self.parse_header(header)
+
+    def list_records(self, dspace_oai_uri, metadata_format, start_date=None,
+                     end_date=None):
+        '''Yields (header dict, record XML) for all items in OAI-PMH
+        repository, in the given metadata format. This gets metadata for
+        a whole page of items per request, rather than one item per request
+        like get_record. Deleted records come with None for the XML.
+        '''
+        params = self._list_params(metadata_format, start_date, end_date)
+        for record in self.list_elements(dspace_oai_uri, 'ListRecords',
+                                         'record', params):
+            header = self.parse_header(record.find('oai:header',
+                                                   METS_NAMESPACE))
+            if header['deleted']:
+                yield header, None
+            else:
+                yield header, ET.tostring(record, encoding='unicode')
 
-        r = requests.get(dspace_oai_uri, params=params)
-        return r.text
+    def harvest_records(self, args, start_date=None, end_date=None):
+        '''Harvests metadata for all theses with ListRecords: one pass
+        through the repository for rdf and one for mets. Returns the number
+        of theses written.
+
+        The rdf records are kept in a shelf on disk until their mets
+        counterparts arrive, so memory use stays flat however big the
+        repository is.
+
+        Theses we don't have yet are created. Existing theses are updated if
+        their records have changed since the last harvest that saw them
+        (according to HarvestedRecord).
+        '''
+        existing = set(Thesis.objects.values_list('identifier', flat=True))
+        seen = dict(HarvestedRecord.objects.values_list('identifier',
+                                                        'datestamp'))
+        states = {}
+        written = 0
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with shelve.open(os.path.join(tmp_dir, 'rdf')) as rdf_records:
+                for item, record in self.list_records(
+                        DSPACE_OAI_URI, 'rdf', start_date, end_date):
+                    if record and self._wanted(item, existing, seen):
+                        rdf_records[item['identifier']] = record
+
+                for item, metadata_mets in self.list_records(
+                        DSPACE_OAI_URI, 'mets', start_date, end_date):
+                    identifier = self._identifier(item)
+                    if identifier is None or not self._is_thesis(item):
+                        continue
+                    states[identifier] = item
+                    if metadata_mets is None or \
+                            not self._wanted(item, existing, seen):
+                        continue
+                    metadata_dc = rdf_records.get(item['identifier'])
+                    if metadata_dc is None:
+                        continue
+                    print('Processing {}'.format(item['handle']))
+                    if args['write_metadata'] and self.write_metadata(
+                            metadata_dc, metadata_mets, item['sets'],
+                            update=identifier in existing):
+                        written += 1
+
+        if args['write_metadata']:
+            self.WRITER.flush()
+            self.save_states(states, seen)
+        return written
+
+    def save_states(self, states, seen):
+        '''Record the header datestamps of the thesis records we saw.'''
+        new = []
+        changed = []
+        by_identifier = HarvestedRecord.objects.in_bulk(
+            [identifier for identifier in states if identifier in seen],
+            field_name='identifier')
+        for identifier, item in states.items():
+            if not item['datestamp']:
+                continue
+            datestamp = parse_datetime(item['datestamp'])
+            if identifier in by_identifier:
+                record = by_identifier[identifier]
+                record.datestamp = datestamp
+                record.deleted = item['deleted']
+                changed.append(record)
+            else:
+                new.append(HarvestedRecord(identifier=identifier,
+                                           datestamp=datestamp,
+                                           deleted=item['deleted']))
+        HarvestedRecord.objects.bulk_create(new, batch_size=1000)
+        HarvestedRecord.objects.bulk_update(
+            changed, ['datestamp', 'deleted'], batch_size=1000)
+
+    def _identifier(self, item):
+        try:
+            return int(item['identifier'])
+        except ValueError:
+            return None
+
+    def _is_thesis(self, item):
+        if item['handle'] not in self.DOCS_CACHE:
+            self.DOCS_CACHE[item['handle']] = {}
+        return self.is_thesis(item)
+
+    def _wanted(self, item, existing, seen):
+        # New theses, and existing ones whose records have changed since we
+        # last saw them. (Existing theses we've never recorded a datestamp
+        # for are left alone; the first harvest after upgrading records
+        # them.)
+        identifier = self._identifier(item)
+        if identifier is None or not self._is_thesis(item):
+            return False
+        if identifier not in existing:
+            return True
+        last_seen = seen.get(identifier)
+        if last_seen is None or not item['datestamp']:
+            return False
+        return parse_datetime(item['datestamp']) > last_seen
 
     def get_single_network_file(self, item, args):
         if Thesis.objects.filter(identifier=item['identifier']):
             return
 
-        metadata_mets = self.get_record(DSPACE_OAI_URI, DSPACE_OAI_IDENTIFIER,
-                                        item['identifier'], 'mets')
-
         # The available formats are oai_dc; qdc; rdf; ore; and mets. None of
         # them match the Dublin Core displayed at dspace.mit.edu, but rdf seems
         # to have the content we want. To get a list of all verbs, issue a
         # get request to the OAI endpoint with
         # params={'verb': 'ListMetadataFormats'}.
-        metadata_dc = self.get_record(DSPACE_OAI_URI, DSPACE_OAI_IDENTIFIER,
-                                      item['identifier'], 'rdf')
+        metadata_mets, metadata_dc = self.get_records(
+            DSPACE_OAI_URI, DSPACE_OAI_IDENTIFIER, item['identifier'],
+            ['mets', 'rdf'])
 
         if args['write_metadata']:
             outcome = self.write_metadata(metadata_dc,
@@ -322,19 +726,32 @@ class DocFetcher(object):
             self.DOCS_CACHE[item['handle']]['is_thesis'] = ans
             return ans
 
+    def parse_header(self, header):
+        handle = header.find('oai:identifier', METS_NAMESPACE).text\
+            .replace('oai:dspace.mit.edu:', '').replace('/', '-')
+        identifier = handle.replace('1721.1-', '')
+        setSpecs = header.findall('oai:setSpec', METS_NAMESPACE)
+        sets = [s.text for s in setSpecs]
+        datestamp = header.find('oai:datestamp', METS_NAMESPACE)
+        return {'handle': handle, 'identifier': identifier, 'sets': sets,
+                'datestamp': datestamp.text if datestamp is not None else None,
+                'deleted': header.get('status') == 'deleted'}
+
     def parse_record_list(self, record_xml):
-        xml = ET.fromstring(record_xml)
-        records = xml.findall('.//oai:header', METS_NAMESPACE)
-        for record in records:
-            handle = record.find('oai:identifier', METS_NAMESPACE).text\
-                .replace('oai:dspace.mit.edu:', '').replace('/', '-')
-            identifier = handle.replace('1721.1-', '')
-            setSpecs = record.findall('oai:setSpec', METS_NAMESPACE)
-            sets = [s.text for s in setSpecs]
-            yield {'handle': handle, 'identifier': identifier, 'sets': sets}
+        '''Yields header dicts from a ListIdentifiers response, given as a
+        string or a file-like object.
+        '''
+        if isinstance(record_xml, (str, bytes)):
+            if isinstance(record_xml, str):
+                record_xml = record_xml.encode('utf-8')
+            record_xml = io.BytesIO(record_xml)
+        for header in OAIPage(record_xml, 'header'):
+            yield self.parse_header(header)
 
-    def write_metadata(self, metadata_dc, metadata_mets, item_sets):
-        return self.WRITER.write(metadata_dc, metadata_mets, item_sets)
+    def write_metadata(self, metadata_dc, metadata_mets, item_sets,
+                       update=False):
+        return self.WRITER.write(metadata_dc, metadata_mets, item_sets,
+                                 update=update)
 
 
 class ModelTrainer(object):
@@ -347,7 +764,8 @@ class ModelTrainer(object):
     # Train test model
     # Train training model
     MAIN_FILES_DIR = os.path.join(CUR_DIR, FILES_DIR, 'main')
-    STARTING_FILES = os.listdir(MAIN_FILES_DIR)
+    TOKENS_DIR = os.path.join(CUR_DIR, FILES_DIR, 'tokens')
+    CORPORA_DIR = os.path.join(CUR_DIR, FILES_DIR, 'corpora')
 
     def __init__(self, files_subdirs=None):
         # If a list of subdirectory names is passed in, ModelTrainer will
@@ -371,53 +789,10 @@ class ModelTrainer(object):
     def get_filename(self, thesis):
         return '1721.1-{}.txt'.format(thesis.identifier)
 
-    def fetch_and_write_file(self, thesis, pdf_filepath):
-        print('Fetching network file for thesis {}'.format(thesis.identifier))
-        with open(pdf_filepath, 'wb') as f:
-            r = requests.get(thesis.url, stream=True)
-            r.raise_for_status()
-            for chunk in r.iter_content(1024):
-                f.write(chunk)
-            f.flush()
-
-    def extract_text(self, thesis):
-        # If we've already extracted this file, let's not do it again.
-        filename = self.get_filename(thesis)
-        if filename in self.STARTING_FILES:
-            print('File already gotten; continuing')
-            return
-
-        pdf_filepath = os.path.join(self.MAIN_FILES_DIR, 'temp.pdf')
-        filepath = os.path.join(self.MAIN_FILES_DIR, filename)
-        try:
-            self.fetch_and_write_file(thesis, pdf_filepath)
-        except:
-            print('~~~~~~WARNING: Download failed for {}'.format(thesis.identifier))
-            return
-
-        print('Extracting pdf text from {}'.format(thesis.identifier))
-        try:
-            parsed = tikaparser.from_file(pdf_filepath)
-        except:
-            thesis.unextractable = True
-            thesis.save()
-            return
-
-        try:
-            content = parsed['content']
-        except KeyError:
-            thesis.unextractable = True
-            thesis.save()
-            return
-
-        if not content:
-            thesis.unextractable = True
-            thesis.save()
-            return
-        with open(filepath, 'w') as f:
-            f.write(content)
-
-        os.remove(pdf_filepath)
+    def extract_text(self, queryset):
+        """Fetch and extract text for every thesis in the queryset that
+        doesn't have it yet; see hamlet.neural.extraction."""
+        return TextExtractor(self.MAIN_FILES_DIR).run(queryset)
 
     def split_data(self, queryset):
         """
@@ -440,69 +815,127 @@ class ModelTrainer(object):
                 continue
             filename = self.get_filename(thesis)
             filepath = os.path.join(self.MAIN_FILES_DIR, filename)
+            if not os.path.exists(filepath):
+                # Its download failed; it'll be retried next time.
+                continue
             destination = os.path.join(CUR_DIR, FILES_DIR, set_dir)
             shutil.copy2(filepath, destination)
 
     def get_iterator(self, subdir):
-        return LabeledLineSentence(subdir)
-
-    def inner_train_model(self, window, size, iterator, filename,
-                          max_vocab_size=None):
-        model = Doc2Vec(alpha=0.025,
-                        # Alpha starts at `alpha` and decreases to
-                        # `min_alpha`
-                        min_alpha=0.025,
-                        # Size of DBOW window (default=5).
-                        window=window,
-                        # Feature vector dimensionality (default=100).
-                        size=size,
-                        # Min word frequency for inclusion (default=5).
-                        min_count=10,
-                        max_vocab_size=max_vocab_size)
-
-        print("Building vocab for %s..." % filename)
-        model.build_vocab(iterator)
-
-        print("Training %s..." % filename)
-        model.train(iterator,
-                    total_examples=model.corpus_count,
-                    epochs=model.iter)
-
-        fn = '{}_w{}_s{}.model'.format(filename, window, size)
-        filepath = os.path.join(CUR_DIR, 'nets', fn)
-        model.save(filepath)
+        """The documents in subdir, tokenized once up front (see
+        hamlet.neural.corpus), so that every training pass over them just
+        reads tokens from disk."""
+        text_paths = sorted(LabeledLineSentence(subdir).doc_list)
+        corpus_path = os.path.join(self.CORPORA_DIR,
+                                   '{}.corpus'.format(subdir))
+        return TokenCache(self.TOKENS_DIR).write_corpus(text_paths,
+                                                        corpus_path)
+
+    # Hyperparameters to try: window is the size of the DBOW window
+    # (default=5) and size the feature vector dimensionality (default=100).
+    # Sizes are multiples of 4, which perform better.
+    WINDOWS = range(3, 10)
+    SIZES = [step * 52 for step in range(1, 5)]
+
+    def sweep(self, subdir, iterator, filename, max_vocab_size=None):
+        """Train a model for every window and size on one subdirectory's
+        corpus; see hamlet.neural.sweep."""
+        nets_dir = os.path.join(CUR_DIR, 'nets')
+        base = '{}_{}'.format(filename, subdir)
+        configs = [(window, size)
+                   for window in self.WINDOWS for size in self.SIZES]
+        return run_sweep(
+            iterator,
+            vocab_path=os.path.join(self.CORPORA_DIR,
+                                    '{}.vocab.model'.format(subdir)),
+            configs=configs,
+            output_path=os.path.join(
+                nets_dir, base + '_w{window}_s{size}.model'),
+            results_path=os.path.join(nets_dir, base + '_sweep.csv'),
+            max_vocab_size=max_vocab_size)
 
     def train_model(self, filename, queryset=Thesis.objects.all()):
         # Don't bother with theses when we know we can't get text from them.
         queryset = queryset.filter(unextractable=False)
         print('About to extract all text')
-        for thesis in queryset:
-            self.extract_text(thesis)
+        counts = self.extract_text(queryset)
+        print('Extracted {extracted}; {unextractable} unextractable, '
+              '{download_failed} downloads failed'.format(**counts))
+        # Theses which just turned out to be unextractable have no text.
+        queryset = queryset.filter(unextractable=False)
 
         print('All text extracted; time to get our ML on')
 
-        iterators = []
-        if self.FILES_SUBDIRS:
-            self.split_data(queryset)
-            for subdir in self.FILES_SUBDIRS:
-                iterators.append(self.get_iterator(subdir))
-        else:
-                iterators.append(self.get_iterator(None))
+        self.split_data(queryset)
+        for subdir in self.FILES_SUBDIRS:
+            self.sweep(subdir, self.get_iterator(subdir), filename)
+
+
+def document_vectors(model, labels, documents, training):
+    """An array of the vectors of the documents with the given labels, one
+    row per label.
+
+    Documents the model was trained on have a vector already. For others,
+    it's inferred from their words (documents maps labels to token lists),
+    with the parameters docvecs.similarity_unseen_docs uses."""
+    if training:
+        return np.array([model.docvecs[label] for label in labels])
+    return np.array([model.infer_vector(documents[label], alpha=0.1,
+                                        min_alpha=0.0001, steps=5)
+                     for label in labels])
+
+
+def tuple_scores(vectors, tuples):
+    """Score (A, B, C) tuples as 2 * sim(A, B) - sim(A, C) - sim(B, C), using
+    cosine similarity; see Evaluator. tuples is an (n, 3) array of row
+    indices into vectors. Returns an array of n scores."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    unit = vectors / norms
+    a, b, c = unit[tuples[:, 0]], unit[tuples[:, 1]], unit[tuples[:, 2]]
+    a_to_b = np.einsum('ij,ij->i', a, b)
+    a_to_c = np.einsum('ij,ij->i', a, c)
+    b_to_c = np.einsum('ij,ij->i', b, c)
+    return 2 * a_to_b - a_to_c - b_to_c
+
+
+# Set in each of the Evaluator's pool processes by _init_scorer, so the
+# documents are sent to each process once rather than with every model.
+_scoring = {}
+
+
+def _init_scorer(labels, documents, tuples):
+    _scoring.update(labels=labels, documents=documents, tuples=tuples)
+
+
+def _score_model(path):
+    model = Doc2Vec.load(path)
+    vectors = document_vectors(model, _scoring['labels'],
+                               _scoring['documents'], 'training' in path)
+    return tuple_scores(vectors, _scoring['tuples'])
+
 
-        for window in range(3, 10):
-            for step in range(1, 5):
-                size = step * 52  # Multiples of 4 have better performance.
-                start_time = time.time()
+def bootstrap_means(scores, resamples, seed=0):
+    """Bootstrap the mean of each row of scores (an array of per-tuple
+    scores, one row per model). Returns a (models, resamples) array.
 
-                print('Training with parameters window={}, '
-                      'size={}'.format(window, size))
-                for iterator in iterators:
-                    self.inner_train_model(window, size,
-                                           iterator,
-                                           '{}_train'.format(filename))
+    Every model is resampled with the same tuple indices, so differences
+    between rows are paired: they reflect the models, not which tuples
+    happened to be drawn."""
+    scores = np.atleast_2d(scores)
+    rng = np.random.RandomState(seed)
+    means = np.empty((scores.shape[0], resamples))
+    for i in range(resamples):
+        sample = rng.randint(0, scores.shape[1], scores.shape[1])
+        means[:, i] = scores[:, sample].mean(axis=1)
+    return means
 
-                print('Finished training, took {}'.format(
-                    time.time() - start_time))
+
+def interval(samples, confidence):
+    """The central `confidence` interval of an array of samples."""
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.percentile(samples, [tail, 100 - tail])
+    return float(low), float(high)
 
 
 class Evaluator(object):
@@ -514,9 +947,9 @@ class Evaluator(object):
     It:
     * takes a list of models and a queryset they were trained on
     * selects tuples (A, B, C) of suitable theses within the queryset
-    * sums sim(A, B) - sim(A, C) and sim(A, B) - sim(B, C) for all tuples for
-      the given model
-    * uses that sum as a score
+    * averages sim(A, B) - sim(A, C) + sim(A, B) - sim(B, C) over all tuples
+      for the given model
+    * uses that average as a score, with a bootstrap confidence interval
     * ranks the models according to that score (highest is best)
 
     To choose tuples:
@@ -561,12 +994,21 @@ class Evaluator(object):
     anything about the semantics of thesis text, and the metric would be
     uninformative.
     """
-    def __init__(self, model_list):
+    # How many tuples to sample, and how many times to resample them for
+    # confidence intervals.
+    TUPLES = 2000
+    RESAMPLES = 1000
+    CONFIDENCE = 0.95
+
+    def __init__(self, model_list, seed=0):
         self.model_list = model_list
+        # Sampling with a fixed seed means every run (and every model) is
+        # scored on the same tuples, so scores are comparable across runs.
+        self.seed = seed
         self.queryset = self.get_queryset()
         self.tuples = self.choose_tuples()
         self.scores = []
-        self.tokenizer = LabeledLineSentence('fake')  # used only for tokenizer
+        self._documents = None
 
     def get_queryset(self):
         """
@@ -581,133 +1023,144 @@ class Evaluator(object):
         matcher = '1721.1-(\d+).txt'
         training_dir = os.path.join(CUR_DIR, FILES_DIR, 'training')
         training_files = os.listdir(training_dir)
-        training_ids = [re.match(matcher, filename).groups()[0]
-                        for filename in training_files]
-        return Thesis.objects.filter(identifier__in=training_ids)
+        self.training_ids = sorted(
+            int(re.match(matcher, filename).groups()[0])
+            for filename in training_files)
+        return Thesis.objects.filter(identifier__in=self.training_ids)
 
     def choose_tuples(self):
-        """Choose up to 50 tuples we can use to evaluate our net."""
+        """Sample TUPLES (A, B, C) tuples of thesis labels, where A and B
+        share an advisor and C doesn't have that advisor.
+
+        All the advisor relationships in the training set are fetched in one
+        query, and the sampling happens in memory."""
         print('Choosing tuples')
+        pairs = Contribution.objects.filter(
+            role=Contribution.ADVISOR,
+            thesis__identifier__in=self.training_ids
+        ).values_list('person_id', 'thesis__identifier').order_by(
+            'person_id', 'thesis__identifier')
+
+        advised = {}
+        for person_id, identifier in pairs:
+            advised.setdefault(person_id, set()).add(identifier)
+        # Only advisors with at least two theses in the training set can
+        # supply an A and B, and there must be other theses to supply a C.
+        candidates = [(sorted(theses), theses) for theses in advised.values()
+                      if 2 <= len(theses) < len(self.training_ids)]
+        if not candidates:
+            return []
+
+        rng = random.Random(self.seed)
         tuples = []
-
-        targets = Contribution.objects.filter(role=Contribution.ADVISOR,
-                                              thesis__in=self.queryset)
-        advisors = Person.objects.annotate(
-            num_theses=Count('contribution__thesis')
-        ).filter(
-            contribution__in=targets, num_theses__gte=2
-        ).distinct()
-
-        count = 0
-
-        for advisor in advisors:
-            try:
-                a, b = advisor.thesis_set.intersection(self.queryset)[0:2]
-            except ValueError:
-                # It's possible that, even if an advisor has advised 2 or more
-                # theses, that the theses won't all be in our queryset. (For
-                # example, some advisors supervise theses in multiple
-                # departments.) If we encounter these, just move on to the next
-                # option.
-                continue
-
-            theses = self.queryset.exclude(contribution__person=advisor)
-            c = self.get_random_outsider_thesis(theses)
-            tuples.append((a, b, c))
-            count += 1
-
-            if count == 50:
-                break
+        while len(tuples) < self.TUPLES:
+            theses, advisees = rng.choice(candidates)
+            a, b = rng.sample(theses, 2)
+            c = rng.choice(self.training_ids)
+            while c in advisees:
+                c = rng.choice(self.training_ids)
+            tuples.append(tuple('1721.1-{}.txt'.format(identifier)
+                                for identifier in (a, b, c)))
 
         return tuples
 
-    def get_random_outsider_thesis(self, theses):
-        num = theses.count()
-        while True:
-            idx = random.randrange(0, num)
-            filename = os.path.join(CUR_DIR, FILES_DIR, 'main',
-                                    '1721.1-{}.txt'.format(idx))
-            if os.path.isfile(filename):
-                c = theses[idx]
-                break
-        return c
-
-    def get_filename_from_identifier(self, identifier):
-        return
+    @property
+    def labels(self):
+        """The labels of all the documents in our tuples, without repeats."""
+        labels = {}
+        for thesis_tuple in self.tuples:
+            for label in thesis_tuple:
+                labels.setdefault(label, None)
+        return list(labels)
+
+    @property
+    def documents(self):
+        """A dict of label: tokens for every document in our tuples. Each is
+        tokenized (or read from ModelTrainer's token cache) once per
+        evaluation, however many models we score."""
+        if self._documents is None:
+            cache = TokenCache(ModelTrainer.TOKENS_DIR)
+            paths = [os.path.join(CUR_DIR, FILES_DIR, 'main', label)
+                     for label in self.labels]
+            cache.update(paths)
+            self._documents = {}
+            for label, path in zip(self.labels, paths):
+                with open(cache.path(path), 'r') as f:
+                    self._documents[label] = f.read().split()
+        return self._documents
 
     def get_tokens(self, doctag):
-        filename = os.path.join(CUR_DIR, FILES_DIR, 'main', doctag)
-        with open(filename, 'r') as f:
-            doc = f.read()
-
-        return self.tokenizer._tokenize(doc)
-
-    def trained_similarities(self, model, a_label, b_label, c_label):
-        a_to_b = model.docvecs.similarity(a_label, b_label)
-        a_to_c = model.docvecs.similarity(a_label, c_label)
-        b_to_c = model.docvecs.similarity(b_label, c_label)
-
-        return a_to_b, a_to_c, b_to_c
+        return self.documents[doctag]
 
-    def untrained_similarities(self, model, a_tokens, b_tokens, c_tokens):
-        a_to_b = model.docvecs.similarity_unseen_docs(
-            model, a_tokens, b_tokens)
-        a_to_c = model.docvecs.similarity_unseen_docs(
-            model, a_tokens, c_tokens)
-        b_to_c = model.docvecs.similarity_unseen_docs(
-            model, b_tokens, c_tokens)
-
-        return a_to_b, a_to_c, b_to_c
+    def tuple_indices(self, labels):
+        """self.tuples as an (n, 3) array of indices into labels."""
+        index = {label: i for i, label in enumerate(labels)}
+        return np.array([[index[label] for label in thesis_tuple]
+                         for thesis_tuple in self.tuples],
+                        dtype=np.intp).reshape(-1, 3)
 
     def calculate_score(self, model, training):
+        """The per-tuple scores of a model, as an array."""
+        # If the documents are in the trained set, use their trained vectors.
+        # We don't want to infer vectors for both test and training, because
+        # the results of infer_vector are somewhat unpredictable. In
+        # particular, the test data may score *better* than the training
+        # data. The vector calculated during training is more accurate and we
+        # should use it where available.
         print('Scoring model')
-        score = 0
-
-        for tuple in self.tuples:
-            a_label = '1721.1-{}.txt'.format(tuple[0].identifier)
-            b_label = '1721.1-{}.txt'.format(tuple[1].identifier)
-            c_label = '1721.1-{}.txt'.format(tuple[2].identifier)
-
-            a_tokens = self.get_tokens(a_label)
-            b_tokens = self.get_tokens(b_label)
-            c_tokens = self.get_tokens(c_label)
-
-            # If the documents are in the trained set, use the doc2vec
-            # similarity() function. We don't want to use
-            # similarity_unseen_docs for both test and training, because it
-            # needs to use infer_vector, and the results of that are somewhat
-            # unpredictable. In particular, the test data may score *better*
-            # than the training data. The vector calculated during training is
-            # more accurate and we should use it where available.
-            if training:
-                a_to_b, a_to_c, b_to_c = self.trained_similarities(
-                    model, a_label, b_label, c_label)
-            else:
-                a_to_b, a_to_c, b_to_c = self.untrained_similarities(
-                    model, a_tokens, b_tokens, c_tokens)
-
-            subscore = 2 * a_to_b - a_to_c - b_to_c
-
-            score += subscore
-
-        return score
-
-    def score_models(self):
-        for filename in self.model_list:
-            fullpath = os.path.join(CUR_DIR, 'nets', filename)
-            model = Doc2Vec.load(fullpath)
-            training = 'training' in fullpath
-            score = self.calculate_score(model, training)
-
-            self.scores.append((filename, score))
-
-        self.scores.sort(key=lambda x: x[1], reverse=True)
+        labels = self.labels
+        vectors = document_vectors(model, labels, self.documents, training)
+        return tuple_scores(vectors, self.tuple_indices(labels))
+
+    def score_models(self, processes=None):
+        """Score every model in model_list, several at once in separate
+        processes. Each process loads one model at a time, infers each
+        document's vector once, and scores all the tuples together.
+
+        Each entry of self.scores is (filename, mean score, (low, high)
+        confidence interval of the mean, (low, high) confidence interval of
+        how far it is behind the best model), best first. A model whose
+        difference interval includes 0 can't be told apart from the best."""
+        paths = [os.path.join(CUR_DIR, 'nets', filename)
+                 for filename in self.model_list]
+        if not paths or not self.tuples:
+            return
+        labels = self.labels
+        model_bytes = max(saved_model_bytes(path) for path in paths)
+        processes = processes or pool_size(model_bytes, 1, len(paths))
+
+        with multiprocessing.Pool(
+                processes, initializer=_init_scorer,
+                initargs=(labels, self.documents,
+                          self.tuple_indices(labels))) as pool:
+            scores = np.array(pool.map(_score_model, paths))
+
+        means = scores.mean(axis=1)
+        resampled = bootstrap_means(scores, self.RESAMPLES, self.seed)
+        best = int(np.argmax(means))
+        self.scores = sorted(
+            [(filename, float(means[i]),
+              interval(resampled[i], self.CONFIDENCE),
+              interval(resampled[best] - resampled[i], self.CONFIDENCE))
+             for i, filename in enumerate(self.model_list)],
+            key=lambda x: x[1], reverse=True)
 
     def pretty_print(self):
-        print('       Model  |   Score')
+        print('Mean score over {} tuples, with {:.0%} confidence '
+              'intervals'.format(len(self.tuples), self.CONFIDENCE))
+        print('       Model  |   Score   |   Interval   |   Behind best by')
         print('------------------------------')
-        for scoretuple in self.scores:
-            print('{} |   {}'.format(scoretuple[0], scoretuple[1]))
+        for rank, (filename, mean, (low, high), behind) in \
+                enumerate(self.scores):
+            if rank == 0:
+                note = '  (best)'
+            elif behind[0] <= 0:
+                note = '  (not distinguishable from best)'
+            else:
+                note = ''
+            print('{} |   {:.4f}   |   [{:.4f}, {:.4f}]   |   '
+                  '[{:.4f}, {:.4f}]{}'.format(filename, mean, low, high,
+                                              behind[0], behind[1], note))
         print('------------------------------')
         print('🌈 🎉 🦄')
 
@@ -718,8 +1171,33 @@ class Evaluator(object):
 
 
 def write_metadata(args):
-    fetcher = DocFetcher()
-    fetcher.get_network_files(args)
+    """Harvest thesis metadata from DSpace into the database.
+
+    args may include start_date and end_date (YYYY-MM-DD) to limit the
+    harvest to records changed in that range. If args['incremental'] is
+    true, start_date defaults to the day of the last successful harvest.
+    Theses are written args['batch_size'] at a time.
+
+    Returns the Harvest and the BulkMetadataWriter, for reporting."""
+    start_date = args.get('start_date')
+    if args.get('incremental') and not start_date:
+        start_date = Harvest.high_water_mark()
+        if start_date:
+            start_date = start_date.isoformat()
+            print('Harvesting records changed since {}'.format(start_date))
+        else:
+            print('No previous harvest; harvesting everything')
+
+    harvest = Harvest.objects.create(from_date=start_date)
+    writer = BulkMetadataWriter(args.get('batch_size', 500))
+    fetcher = DocFetcher(writer)
+    written = fetcher.get_network_files(args, start_date=start_date,
+                                        end_date=args.get('end_date'))
+    harvest.finished = timezone.now()
+    harvest.succeeded = True
+    harvest.records_written = written or 0
+    harvest.save()
+    return harvest, writer
 
 
 def train_model(args):
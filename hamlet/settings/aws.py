@@ -5,7 +5,6 @@ import sys
 import requests
 
 from .base import *  # noqa
-from gensim.models.doc2vec import Doc2Vec
 
 logger = logging.getLogger(__name__)
 
@@ -74,7 +73,6 @@ COMPRESS_OFFLINE = True
 # MODELS_DIR is an env variable defined in eb as /models.
 MODELS_DIR = os.environ.get('MODELS_DIR')
 MODEL_FILE = os.path.join(MODELS_DIR, 'hamlet.model')
-NEURAL_NET = Doc2Vec.load(MODEL_FILE)
 
 
 # LOGGING CONFIGURATION
@@ -110,3 +108,7 @@ LOGGING = {
 
 # Will be emailed by the management command about API usage.
 ADMINS = [('Andromeda Yelton', 'andromeda.yelton@gmail.com')]
+
+# Elastic Beanstalk only runs the web process, and mod_wsgi uses threads
+# rather than gevent, so process uploads within the request there.
+UPLOAD_JOBS_INLINE = True
@@ -17,6 +17,12 @@ PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 BASE_DIR = os.path.dirname(PROJECT_DIR)
 
 
+def _env_flag(name):
+    """Whether an on/off environment variable is on. Only 1, true or yes
+    (in any case) count, so that e.g. FOO=0 or FOO=False turn FOO off."""
+    return os.environ.get(name, '').strip().lower() in ('1', 'true', 'yes')
+
+
 # -----------------------------------------------------------------------------
 # ------------------------> core django configurations <-----------------------
 # -----------------------------------------------------------------------------
@@ -36,6 +42,7 @@ DJANGO_APPS = [
 HAMLET_APPS = [
     'hamlet.theses',
     'hamlet.citations',
+    'hamlet.neural',
 ]
 
 THIRD_PARTY_APPS = [
@@ -52,6 +59,7 @@ INSTALLED_APPS = THIRD_PARTY_APPS + DJANGO_APPS + HAMLET_APPS
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'hamlet.common.timing.TimingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -125,6 +133,31 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# CACHE CONFIGURATION
+# -----------------------------------------------------------------------------
+
+# The 'similarity' cache holds rendered similarity pages and other results
+# derived from the neural net (see hamlet.common.cache). It's file-based so
+# that all workers on a box share it without needing an external service.
+# Keys include a fingerprint of the model, so entries for an old model simply
+# stop being used when a new one is deployed, and a version which
+# precompute_neighbors changes.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'similarity': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('DJANGO_CACHE_DIR',
+                                   os.path.join(BASE_DIR, 'cache')),
+        'TIMEOUT': 60 * 60 * 24,
+        'OPTIONS': {
+            'MAX_ENTRIES': 20000,
+        },
+    },
+}
+
+
 # INTERNATIONALIZATION CONFIGURATION
 # -----------------------------------------------------------------------------
 
@@ -248,3 +281,38 @@ INSTALLED_APPS += (
     'health_check.cache',
     'health_check.storage',
 )
+
+
+# NEURAL NET CONFIGURATION
+# -----------------------------------------------------------------------------
+
+# MODEL_FILE is the full path of the neural net model to be used; the
+# environment-specific settings files set it. The model is loaded on first use
+# (see hamlet.common.neural_net.get_model), not while settings are imported, so
+# management commands like migrate and collectstatic don't pay for it.
+MODEL_FILE = None
+
+# How many inferred vectors of uploaded documents to keep in memory, per
+# process (see hamlet.common.inferred_vectors.infer_vector).
+INFERRED_VECTOR_CACHE_SIZE = int(
+    os.environ.get('INFERRED_VECTOR_CACHE_SIZE', 256))
+
+# Uploaded documents are only read up to this many words in the model's
+# vocabulary. gensim's infer_vector ignores anything past the first 10,000
+# of those anyway (see hamlet.common.document.BaseDocument).
+DOCUMENT_MAX_TOKENS = int(os.environ.get('DOCUMENT_MAX_TOKENS', 10000))
+
+# If True, uploaded documents are processed within the upload request rather
+# than queued for `manage.py run_upload_jobs` (see hamlet.theses.jobs).
+UPLOAD_JOBS_INLINE = _env_flag('UPLOAD_JOBS_INLINE')
+
+# Number of processes to run neural net calls in, per web worker, so that
+# they don't block gevent workers; 0 runs them in the web worker itself (see
+# hamlet.common.executor). MODEL_EXECUTOR_TIMEOUT is in seconds.
+MODEL_EXECUTOR_PROCESSES = int(os.environ.get('MODEL_EXECUTOR_PROCESSES', 0))
+MODEL_EXECUTOR_TIMEOUT = 30
+
+# If True, time each request's model calls, document parsing and database
+# queries, and report them in log lines, Server-Timing headers and at
+# /admin/timing/ (see hamlet.common.timing).
+REQUEST_TIMING = _env_flag('REQUEST_TIMING')
@@ -1,5 +1,4 @@
 # This file is designed for use with docker.
-from gensim.models.doc2vec import Doc2Vec
 import os
 
 from .base import *  # noqa
@@ -26,7 +25,6 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 # env var DJANGO_MODEL_PATH to the full path to the neural net model.
 MODEL_FILE = os.environ.get('DJANGO_MODEL_PATH',
                             os.path.join(PROJECT_DIR, 'testmodels', 'testmodel.model'))
-NEURAL_NET = Doc2Vec.load(MODEL_FILE)
 
 COMPRESS_ENABLED = True
 COMPRESS_OFFLINE = True
@@ -30,6 +30,14 @@ if APP_NAME:
     url = '{}.herokuapp.com'.format(APP_NAME)
     ALLOWED_HOSTS.append(url)
 
+# NEURAL NET CONFIGURATION
+# -----------------------------------------------------------------------------
+
+# The Procfile runs gevent workers, which stall on CPU-bound model calls
+# unless those run in separate processes.
+MODEL_EXECUTOR_PROCESSES = int(os.environ.get('MODEL_EXECUTOR_PROCESSES', 2))
+
+
 # STATIC FILE CONFIGURATION
 # -----------------------------------------------------------------------------
 
@@ -1,5 +1,4 @@
 # This file is designed for use with `heroku local`.
-from gensim.models.doc2vec import Doc2Vec
 import os
 
 from .heroku import *  # noqa
@@ -23,9 +22,10 @@ if modelpath:
 else:
     MODEL_FILE = os.path.join(PROJECT_DIR, 'testmodels', 'testmodel.model')
 
-NEURAL_NET = Doc2Vec.load(MODEL_FILE)
-
 # The string "PASSED" will pass any captcha.
 # Don't use this in production!
 # http://django-simple-captcha.readthedocs.io/en/latest/advanced.html#captcha-test-mode
 CAPTCHA_TEST_MODE = True
+
+# Run uploads within the request, so there's no need to start a worker.
+UPLOAD_JOBS_INLINE = True
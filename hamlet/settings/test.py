@@ -1,4 +1,3 @@
-from gensim.models.doc2vec import Doc2Vec
 import os
 
 from .base import *
@@ -8,5 +7,16 @@ from .base import *
 #   * contain everything we need to run the tests
 MODEL_FILE = os.path.join(PROJECT_DIR, 'testmodels', 'testmodel.model')
 
-NEURAL_NET = Doc2Vec.load(MODEL_FILE)
 CAPTCHA_TEST_MODE = True
+
+# Don't let cached pages leak between tests.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'similarity': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    },
+}
+
+UPLOAD_JOBS_INLINE = True
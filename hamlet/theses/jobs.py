@@ -0,0 +1,126 @@
+"""A small database-backed queue for upload similarity searches.
+
+Upload views call submit(), which saves an UploadJob and returns it at once.
+`python manage.py run_upload_jobs` claims pending jobs with run_next() and
+runs them, in its own process, so that inference doesn't block the web
+workers. Set settings.UPLOAD_JOBS_INLINE to run jobs inside the request
+instead (handy for local development and tests, where nobody wants to run a
+separate worker).
+
+If a worker dies or is restarted partway through a job, the job is left
+running with nobody running it. Such jobs are put back in the queue once
+they have been running for longer than RUNNING_TIMEOUT, or failed if that
+has already happened MAX_ATTEMPTS times (in case the document itself is what
+kills the worker)."""
+from datetime import timedelta
+import io
+import json
+import logging
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from hamlet.common.document import factory
+from hamlet.common.inferred_vectors import get_similar_documents
+from hamlet.common.neural_net import get_model
+from hamlet.theses.models import UploadJob
+
+logger = logging.getLogger(__name__)
+
+# Far longer than a job should ever take; the model executor gives up on a
+# single call after settings.MODEL_EXECUTOR_TIMEOUT.
+RUNNING_TIMEOUT = timedelta(minutes=10)
+MAX_ATTEMPTS = 2
+
+
+def submit(kind, upload):
+    """Queue an uploaded file for similarity search; returns the UploadJob.
+    `upload` is a django.core.files.uploadedfile.UploadedFile."""
+    upload.seek(0)
+    job = UploadJob.objects.create(kind=kind, document=upload.read())
+    if settings.UPLOAD_JOBS_INLINE:
+        run(job)
+    return job
+
+
+def run(job):
+    """Find the theses most similar to a job's document and save them on the
+    job."""
+    try:
+        doc = factory(io.BytesIO(bytes(job.document)),
+                      get_model().wv.vocab)
+        suggestions = get_similar_documents(doc)
+    except ValidationError as e:
+        job.status = UploadJob.FAILED
+        job.error = ' '.join(e.messages)
+    except Exception:
+        logger.exception('Upload job {} failed'.format(job.pk))
+        job.status = UploadJob.FAILED
+        job.error = 'Something went wrong while reading your document.'
+    else:
+        job.status = UploadJob.DONE
+        job.result = json.dumps([[thesis.pk, score]
+                                 for thesis, score in suggestions.items()])
+    job.document = b''
+    job.finished = timezone.now()
+    job.save()
+
+
+def release_abandoned(now=None):
+    """Requeue jobs which have been running for longer than
+    RUNNING_TIMEOUT, presumably because their worker died, or fail them if
+    they have already been tried MAX_ATTEMPTS times. Returns the number of
+    jobs (requeued, failed)."""
+    now = now or timezone.now()
+    abandoned = UploadJob.objects.filter(status=UploadJob.RUNNING,
+                                         started__lt=now - RUNNING_TIMEOUT)
+    failed = abandoned.filter(attempts__gte=MAX_ATTEMPTS).update(
+        status=UploadJob.FAILED,
+        error='Something went wrong while reading your document.',
+        document=b'',
+        finished=now)
+    requeued = abandoned.update(status=UploadJob.PENDING)
+    if failed or requeued:
+        logger.warning('Requeued {} and failed {} abandoned upload '
+                       'jobs'.format(requeued, failed))
+    return requeued, failed
+
+
+def claim_next():
+    """Mark the oldest pending job as running and return it, or return None
+    if there are no pending jobs. Safe to call from several workers at once:
+    a job locked by one worker is skipped by the others."""
+    release_abandoned()
+    with transaction.atomic():
+        job = (UploadJob.objects
+               .select_for_update(skip_locked=True)
+               .filter(status=UploadJob.PENDING)
+               .order_by('created')
+               .first())
+        if job is not None:
+            job.status = UploadJob.RUNNING
+            job.started = timezone.now()
+            job.attempts += 1
+            job.save(update_fields=['status', 'started', 'attempts'])
+    return job
+
+
+def run_next():
+    """Run the oldest pending job, if any. Returns the job, or None."""
+    job = claim_next()
+    if job is not None:
+        run(job)
+    return job
+
+
+def delete_finished(older_than):
+    """Delete jobs which finished before the given datetime, and jobs
+    created before it which never finished (abandoned, or never picked up
+    because no worker was running)."""
+    release_abandoned()
+    return UploadJob.objects.filter(
+        Q(finished__lt=older_than) |
+        Q(finished__isnull=True, created__lt=older_than)).delete()
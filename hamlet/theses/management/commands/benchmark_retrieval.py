@@ -0,0 +1,278 @@
+from datetime import datetime
+import json
+import math
+import os
+import random
+import time
+
+import numpy as np
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from hamlet.common import executor, vector_index
+from hamlet.common.neural_net import fingerprint, get_index, get_model
+from hamlet.theses.models import Contribution, Thesis
+
+# Quality metrics which shouldn't go down between runs; see --baseline.
+QUALITY_METRICS = ('recall', 'ndcg', 'advisor_precision',
+                   'department_precision')
+
+
+def recall(found, expected):
+    """The fraction of the expected labels which were found."""
+    if not expected:
+        return None
+    return len(set(found) & set(expected)) / len(expected)
+
+
+def ndcg(found, expected, similarity):
+    """Normalized discounted cumulative gain of the found labels, using each
+    label's exact similarity to the query as its relevance. 1.0 means the
+    found labels are the expected ones, in the expected order."""
+    def dcg(labels):
+        return sum(similarity(label) / math.log2(rank + 2)
+                   for rank, label in enumerate(labels))
+    ideal = dcg(expected)
+    return dcg(found) / ideal if ideal else 0.0
+
+
+def co_membership(query, found, groups):
+    """The fraction of found labels which share a group (an advisor, or a
+    department) with the query, or None if the query has no groups.
+    `groups` maps labels to sets of group ids."""
+    mine = groups.get(query)
+    if not mine or not found:
+        return None
+    return sum(1 for label in found if groups.get(label, set()) & mine) / \
+        len(found)
+
+
+def mean(values):
+    values = [value for value in values if value is not None]
+    return round(float(np.mean(values)), 4) if values else None
+
+
+def latency(timings):
+    timings = np.array(timings) * 1000
+    return {'mean_ms': round(float(timings.mean()), 3),
+            'p50_ms': round(float(np.percentile(timings, 50)), 3),
+            'p90_ms': round(float(np.percentile(timings, 90)), 3),
+            'p95_ms': round(float(np.percentile(timings, 95)), 3),
+            'p99_ms': round(float(np.percentile(timings, 99)), 3),
+            'max_ms': round(float(timings.max()), 3)}
+
+
+class Command(BaseCommand):
+    help = ('Measures the quality and latency of similarity results as '
+            'served, against exact search, and writes a JSON report')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', default=None,
+                            help='Model file (default: settings.MODEL_FILE)')
+        parser.add_argument('--queries', type=int, default=500,
+                            help='Number of theses to use as queries')
+        parser.add_argument('--k', type=int, nargs='+', default=[10, 50],
+                            help='Cutoffs for recall@k and nDCG@k (at most '
+                                 '{})'.format(Thesis.MAX_SIMILAR))
+        parser.add_argument('--threshold', type=float, nargs='+',
+                            default=[0.65, 0.75],
+                            help='Similarity thresholds to report result '
+                                 'counts for (get_most_similar uses 0.75, '
+                                 'get_similar_documents 0.65)')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default=None,
+                            help='Report file (default: benchmarks/'
+                                 'retrieval-<timestamp>.json)')
+        parser.add_argument('--baseline', default=None,
+                            help='An earlier report to compare against')
+        parser.add_argument('--tolerance', type=float, default=0.005,
+                            help='How far a quality metric may drop below '
+                                 'the baseline before it counts as a '
+                                 'regression')
+
+    def _groups(self):
+        """Maps of thesis label to advisor ids and to department ids, for
+        every thesis (in two queries)."""
+        advisors = {}
+        for identifier, person_id in Contribution.objects.filter(
+                role=Contribution.ADVISOR).values_list(
+                    'thesis__identifier', 'person_id'):
+            advisors.setdefault('1721.1-{}.txt'.format(identifier),
+                                set()).add(person_id)
+        departments = {}
+        for identifier, department_id in \
+                Thesis.department.through.objects.values_list(
+                    'thesis__identifier', 'department_id'):
+            departments.setdefault('1721.1-{}.txt'.format(identifier),
+                                   set()).add(department_id)
+        return advisors, departments
+
+    def _systems(self, queries, topn):
+        """Run the queries through each way we serve similar theses.
+        Returns {system: ({query: [(label, score)]}, [seconds per query])}.
+        """
+        systems = {}
+
+        results, timings = {}, []
+        for label in queries:
+            start = time.perf_counter()
+            results[label] = executor.search_label(label, topn=topn)
+            timings.append(time.perf_counter() - start)
+        systems['index'] = (results, timings)
+
+        # What similar_to pages use: precomputed neighbors if there are any,
+        # and the index otherwise.
+        theses = Thesis.objects.in_bulk(
+            [Thesis.identifier_from_label(label) for label in queries],
+            field_name='identifier')
+        results, timings = {}, []
+        for label in queries:
+            thesis = theses.get(Thesis.identifier_from_label(label))
+            if thesis is None:
+                continue
+            start = time.perf_counter()
+            neighbors = thesis.get_neighbors()
+            timings.append(time.perf_counter() - start)
+            results[label] = [(t.label, neighbors.score(t))
+                              for t in neighbors][:topn]
+        if results:
+            systems['neighbors'] = (results, timings)
+
+        return systems
+
+    def _evaluate(self, results, truth, exact, groups, options):
+        advisors, departments = groups
+        report = {'queries': len(results), 'k': {}}
+        for k in options['k']:
+            scores = {'recall': [], 'ndcg': [], 'advisor_precision': [],
+                      'department_precision': []}
+            for query, found in results.items():
+                found = [label for label, _ in found[:k]]
+                expected = [label for label, _ in truth[query][:k]]
+                query_vector = exact.vector(query)
+
+                def similarity(label):
+                    return float(np.dot(exact.vector(label), query_vector))
+
+                scores['recall'].append(recall(found, expected))
+                scores['ndcg'].append(ndcg(found, expected, similarity))
+                scores['advisor_precision'].append(
+                    co_membership(query, found, advisors))
+                scores['department_precision'].append(
+                    co_membership(query, found, departments))
+            report['k'][str(k)] = {name: mean(values)
+                                   for name, values in scores.items()}
+
+        report['thresholds'] = {}
+        for threshold in options['threshold']:
+            counts = [sum(1 for _, score in found if score >= threshold)
+                      for found in results.values()]
+            report['thresholds'][str(threshold)] = {
+                'mean_results': mean(counts),
+                'empty_fraction': mean([count == 0 for count in counts])}
+        return report
+
+    def _compare(self, report, baseline, tolerance):
+        regressions = []
+        for system, metrics in report['systems'].items():
+            old = baseline.get('systems', {}).get(system)
+            if not old:
+                continue
+            for k, values in metrics['k'].items():
+                for name in QUALITY_METRICS:
+                    before = old.get('k', {}).get(k, {}).get(name)
+                    after = values[name]
+                    if before is None or after is None:
+                        continue
+                    line = '{} {}@{}: {:.4f} -> {:.4f}'.format(
+                        system, name, k, before, after)
+                    if after < before - tolerance:
+                        regressions.append(line)
+                        self.stdout.write(self.style.ERROR(line))
+                    else:
+                        self.stdout.write(line)
+            before = old.get('latency', {}).get('p95_ms')
+            if before:
+                self.stdout.write('{} p95 latency: {:.3f} ms -> {:.3f} ms'
+                                  .format(system, before,
+                                          metrics['latency']['p95_ms']))
+        return regressions
+
+    def handle(self, *args, **options):
+        model_file = options['model'] or settings.MODEL_FILE
+        if not model_file:
+            raise CommandError('No model; pass --model or set MODEL_FILE.')
+        if max(options['k']) > Thesis.MAX_SIMILAR:
+            raise CommandError('k can be at most {}'.format(
+                Thesis.MAX_SIMILAR))
+        topn = max(options['k'])
+
+        # Serve from the given model, just as the site would.
+        with override_settings(MODEL_FILE=model_file):
+            model = get_model()
+            index = get_index()
+            vectors, labels = vector_index.model_vectors(model)
+            # Exact search gives the same results as gensim's most_similar.
+            exact = vector_index.ExactIndex(vectors, labels)
+
+            rng = random.Random(options['seed'])
+            queries = sorted(rng.sample(labels,
+                                        min(options['queries'], len(labels))))
+            truth = {label: exact.search_label(label, topn=topn)
+                     for label in queries}
+            groups = self._groups()
+
+            report = {
+                'model': model_file,
+                'fingerprint': fingerprint(),
+                'created': datetime.now().isoformat(timespec='seconds'),
+                'options': {'queries': len(queries), 'seed': options['seed'],
+                            'k': options['k'],
+                            'threshold': options['threshold']},
+                'index': {'kind': index.kind,
+                          'nprobe': getattr(index, 'nprobe', None),
+                          'size': len(index)},
+                'exact': self._evaluate(truth, truth, exact, groups, options),
+                'systems': {},
+            }
+            for system, (results, timings) in \
+                    self._systems(queries, topn).items():
+                report['systems'][system] = self._evaluate(
+                    results, truth, exact, groups, options)
+                report['systems'][system]['latency'] = latency(timings)
+
+        output = options['output'] or os.path.join(
+            settings.BASE_DIR, 'benchmarks', 'retrieval-{}.json'.format(
+                datetime.now().strftime('%Y%m%d-%H%M%S')))
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+        for system, metrics in report['systems'].items():
+            for k in sorted(metrics['k'], key=int):
+                values = metrics['k'][k]
+                self.stdout.write(
+                    '{:<10} @{:<3} recall {:.4f}  nDCG {:.4f}  '
+                    'advisor {}  department {}'.format(
+                        system, k, values['recall'], values['ndcg'],
+                        values['advisor_precision'],
+                        values['department_precision']))
+            self.stdout.write('{:<10} latency p50 {p50_ms:.3f} ms  '
+                              'p95 {p95_ms:.3f} ms  p99 {p99_ms:.3f} ms'
+                              .format(system, **metrics['latency']))
+        self.stdout.write('Report written to {}'.format(output))
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            regressions = self._compare(report, baseline,
+                                        options['tolerance'])
+            if regressions:
+                raise CommandError('{} quality metrics regressed'.format(
+                    len(regressions)))
+            self.stdout.write(self.style.SUCCESS(
+                'No quality regressions against {}'.format(
+                    options['baseline'])))
@@ -0,0 +1,94 @@
+import random
+import time
+
+import numpy as np
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from hamlet.common import vector_index
+from hamlet.common.neural_net import load_model
+
+
+class Command(BaseCommand):
+    help = ('Measures recall and query latency of IVF vector indexes against '
+            'exact search, to help choose nlist/nprobe')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', default=None,
+                            help='Model file (default: settings.MODEL_FILE)')
+        parser.add_argument('--queries', type=int, default=1000,
+                            help='Number of documents to use as queries')
+        parser.add_argument('--topn', type=int, default=10)
+        parser.add_argument('--nlist', type=int, nargs='+', default=None,
+                            help='Cluster counts to try (default: 0.5x, 1x '
+                                 'and 2x the square root of the corpus size)')
+        parser.add_argument('--nprobe', type=int, nargs='+',
+                            default=[1, 2, 4, 8, 16, 32])
+        parser.add_argument('--min-recall', type=float, default=0.95,
+                            help='Recommend the fastest settings with at '
+                                 'least this recall@topn')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def _time_queries(self, index, queries, topn):
+        results = []
+        timings = []
+        for label in queries:
+            start = time.perf_counter()
+            results.append(index.search_label(label, topn=topn))
+            timings.append(time.perf_counter() - start)
+        return results, np.array(timings) * 1000
+
+    def _recall(self, results, truth, topn):
+        hits = [len(set(label for label, _ in found) &
+                    set(label for label, _ in expected))
+                for found, expected in zip(results, truth)]
+        return sum(hits) / (topn * len(truth))
+
+    def _row(self, name, recall, timings):
+        self.stdout.write('{:<24} {:>8.3f} {:>10.3f} {:>10.3f}'.format(
+            name, recall, timings.mean(), np.percentile(timings, 95)))
+
+    def handle(self, *args, **options):
+        model = load_model(options['model'] or settings.MODEL_FILE)
+        vectors, labels = vector_index.model_vectors(model)
+        topn = options['topn']
+
+        random.seed(options['seed'])
+        queries = random.sample(labels, min(options['queries'], len(labels)))
+
+        exact = vector_index.ExactIndex(vectors, labels)
+        truth, exact_timings = self._time_queries(exact, queries, topn)
+
+        self.stdout.write('{:<24} {:>8} {:>10} {:>10}'.format(
+            'index', 'recall', 'mean ms', 'p95 ms'))
+        self._row('exact', 1.0, exact_timings)
+
+        root = np.sqrt(len(labels))
+        nlists = options['nlist'] or [int(root / 2), int(root), int(root * 2)]
+        best = None
+        for nlist in nlists:
+            index = vector_index.IVFIndex.build(vectors, labels, nlist=nlist,
+                                                seed=options['seed'])
+            for nprobe in options['nprobe']:
+                if nprobe > index.nlist:
+                    continue
+                index.nprobe = nprobe
+                results, timings = self._time_queries(index, queries, topn)
+                recall = self._recall(results, truth, topn)
+                self._row('ivf nlist={} nprobe={}'.format(nlist, nprobe),
+                          recall, timings)
+                if (recall >= options['min_recall'] and
+                        (best is None or timings.mean() < best[0])):
+                    best = (timings.mean(), nlist, nprobe)
+
+        if best:
+            self.stdout.write(self.style.SUCCESS(
+                'Fastest with recall@{} >= {}: nlist={} nprobe={} '
+                '({:.3f} ms vs {:.3f} ms exact)'.format(
+                    topn, options['min_recall'], best[1], best[2], best[0],
+                    exact_timings.mean())))
+        else:
+            self.stdout.write(self.style.WARNING(
+                'No settings reached recall@{} >= {}'.format(
+                    topn, options['min_recall'])))
@@ -0,0 +1,393 @@
+from datetime import datetime
+import json
+import os
+import queue
+import random
+import threading
+import time
+
+import numpy as np
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.test.utils import setup_databases, teardown_databases
+from django.urls import reverse
+
+from hamlet.common import executor
+from hamlet.common.neural_net import fingerprint
+from hamlet.theses.models import Contribution, Person, Thesis
+
+from .benchmark_retrieval import latency
+
+FIXTURES = ['theses.json', 'departments.json', 'authors.json',
+            'contributions.json']
+
+UPLOAD = os.path.join(settings.PROJECT_DIR, 'theses', 'fixtures',
+                      '1721.1-33360.txt')
+
+# Relative request rates; see --mix.
+DEFAULT_MIX = {
+    'similar_to': 40,
+    'similar_to_author': 15,
+    'autocomplete_thesis': 20,
+    'autocomplete_author': 20,
+    'upload_recommend': 3,
+    'lit_review_buddy': 2,
+}
+
+# Per-thread counters for the request being replayed; see Probe.
+_current = threading.local()
+
+
+class Probe(object):
+    """Counts the database queries and model calls made while a request is
+    being handled, in the thread handling it."""
+    def __init__(self):
+        self.queries = 0
+        self.model_calls = 0
+        self.model_seconds = 0.0
+
+    def __enter__(self):
+        _current.probe = self
+        self._wrapper = connection.execute_wrapper(self.count_query)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._wrapper.__exit__(*exc_info)
+        _current.probe = None
+
+    def count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+
+def timed_run(run):
+    """Wrap executor.run so that model calls are charged to the current
+    Probe. Everything the views ask of the model goes through it."""
+    def timed(func, *args):
+        start = time.perf_counter()
+        try:
+            return run(func, *args)
+        finally:
+            probe = getattr(_current, 'probe', None)
+            if probe is not None:
+                probe.model_calls += 1
+                probe.model_seconds += time.perf_counter() - start
+    return timed
+
+
+def parse_mix(pairs):
+    """Turn ['name=weight', ...] into {name: weight}."""
+    mix = {}
+    for pair in pairs:
+        name, _, weight = pair.partition('=')
+        if name not in DEFAULT_MIX:
+            raise CommandError('Unknown endpoint {}; choose from {}'.format(
+                name, ', '.join(sorted(DEFAULT_MIX))))
+        try:
+            mix[name] = float(weight or 1)
+        except ValueError:
+            raise CommandError('Bad weight in {}'.format(pair))
+    return {name: weight for name, weight in mix.items() if weight > 0}
+
+
+def summarize(samples, wall_seconds):
+    """Per-endpoint figures for a list of (status, seconds, Probe)."""
+    timings = [seconds for _, seconds, _ in samples]
+    model_ms = np.array([probe.model_seconds for _, _, probe in samples]) \
+        * 1000
+    queries = [probe.queries for _, _, probe in samples]
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for status, _, _ in samples if status >= 400),
+        'throughput_rps': round(len(samples) / wall_seconds, 3),
+        'latency': latency(timings),
+        'queries': {'mean': round(float(np.mean(queries)), 2),
+                    'max': max(queries)},
+        'model_calls': round(float(np.mean(
+            [probe.model_calls for _, _, probe in samples])), 2),
+        'model_ms': {'mean': round(float(model_ms.mean()), 3),
+                     'p95': round(float(np.percentile(model_ms, 95)), 3)},
+    }
+
+
+class Command(BaseCommand):
+    help = ('Replays a mix of requests against the web views, with the test '
+            'model and fixtures, and writes a JSON report of latency, '
+            'throughput, DB queries and model time per endpoint')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', default=None,
+                            help='Model file (default: the test model)')
+        parser.add_argument('--requests', type=int, default=500,
+                            help='Number of requests to replay')
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='Number of requests in flight at once')
+        parser.add_argument('--mix', nargs='+', default=None,
+                            metavar='ENDPOINT=WEIGHT',
+                            help='Relative rates of requests to each '
+                                 'endpoint (default: {})'.format(' '.join(
+                                     '{}={}'.format(name, weight)
+                                     for name, weight in DEFAULT_MIX.items())))
+        parser.add_argument('--warmup', type=int, default=2,
+                            help='Unmeasured requests per endpoint before '
+                                 'the run, to load the model')
+        parser.add_argument('--upload', nargs='+', default=[UPLOAD],
+                            help='Documents to upload')
+        parser.add_argument('--cached', action='store_true',
+                            help='Serve repeated pages from the similarity '
+                                 'cache, as the site does (default: measure '
+                                 'every request uncached)')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--existing-db', action='store_true',
+                            help="Use the configured database as it is, "
+                                 "rather than a new test database loaded "
+                                 "with the fixtures")
+        parser.add_argument('--keepdb', action='store_true',
+                            help='Keep the test database between runs')
+        parser.add_argument('--output', default=None,
+                            help='Report file (default: benchmarks/'
+                                 'views-<timestamp>.json)')
+        parser.add_argument('--baseline', default=None,
+                            help='An earlier report to compare against')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='How much slower (as a fraction) an '
+                                 "endpoint's p95 latency may get than the "
+                                 'baseline before it counts as a regression')
+
+    def _targets(self, mix, uploads):
+        """Requests to choose from for each endpoint in the mix, as
+        functions taking a Client and returning its response."""
+        def get(url, data=None):
+            return lambda client: client.get(url, data)
+
+        def post(url, path):
+            def send(client):
+                with open(path, 'rb') as f:
+                    return client.post(url, {'file': f,
+                                             'captcha_0': 'sometext',
+                                             'captcha_1': 'PASSED'})
+            return send
+
+        theses = list(Thesis.objects.filter(unextractable=False))
+        authors = list(Person.objects.filter(
+            contribution__role=Contribution.AUTHOR).distinct())
+        targets = {
+            'similar_to': [get(thesis.get_absolute_url())
+                           for thesis in theses],
+            'similar_to_author': [
+                get(reverse('theses:similar_to_by_author',
+                            kwargs={'pk': author.pk}))
+                for author in authors],
+            'autocomplete_thesis': [
+                get(reverse('theses:autocomplete_thesis'),
+                    {'q': thesis.title.split()[0]})
+                for thesis in theses if thesis.title],
+            'autocomplete_author': [
+                get(reverse('theses:autocomplete_author'),
+                    {'q': author.name[:3]})
+                for author in authors if author.name],
+            'upload_recommend': [
+                post(reverse('theses:upload_recommend'), path)
+                for path in uploads],
+            'lit_review_buddy': [
+                post(reverse('citations:lit_review_buddy'), path)
+                for path in uploads],
+        }
+        for name in mix:
+            if not targets[name]:
+                raise CommandError('Nothing in the database to request from '
+                                   '{}'.format(name))
+        return {name: targets[name] for name in mix}
+
+    def _replay(self, schedule, samples):
+        """Send requests from the schedule until it's empty."""
+        client = Client()
+        while True:
+            try:
+                name, send = schedule.get_nowait()
+            except queue.Empty:
+                return
+            with Probe() as probe:
+                start = time.perf_counter()
+                try:
+                    status = send(client).status_code
+                except Exception:
+                    # The test client re-raises exceptions from views; count
+                    # them as server errors.
+                    status = 500
+                seconds = time.perf_counter() - start
+            samples.append((name, status, seconds, probe))
+
+    def _run(self, targets, mix, options):
+        rng = random.Random(options['seed'])
+        names = sorted(mix)
+
+        for name in names:
+            for send in targets[name][:options['warmup']]:
+                send(Client())
+
+        schedule = queue.Queue()
+        for name in rng.choices(names, weights=[mix[name] for name in names],
+                                k=options['requests']):
+            schedule.put((name, rng.choice(targets[name])))
+
+        samples = []
+        start = time.perf_counter()
+        if options['concurrency'] == 1:
+            # In this thread, so that it sees this thread's transaction (as
+            # in a TestCase).
+            self._replay(schedule, samples)
+        else:
+            def worker():
+                try:
+                    self._replay(schedule, samples)
+                finally:
+                    # So the test database can be dropped afterwards.
+                    connections.close_all()
+            threads = [threading.Thread(target=worker)
+                       for _ in range(options['concurrency'])]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        return samples, time.perf_counter() - start
+
+    def _report(self, samples, wall_seconds, model_file, mix, options):
+        by_name = {}
+        for name, status, seconds, probe in samples:
+            by_name.setdefault(name, []).append((status, seconds, probe))
+
+        return {
+            'model': model_file,
+            'fingerprint': fingerprint(),
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'options': {'requests': options['requests'],
+                        'concurrency': options['concurrency'],
+                        'mix': mix,
+                        'cached': options['cached'],
+                        'seed': options['seed'],
+                        'executor_processes':
+                            settings.MODEL_EXECUTOR_PROCESSES},
+            'total': {
+                'requests': len(samples),
+                'errors': sum(1 for _, status, _, _ in samples
+                              if status >= 400),
+                'wall_seconds': round(wall_seconds, 3),
+                'throughput_rps': round(len(samples) / wall_seconds, 3),
+            },
+            'endpoints': {name: summarize(endpoint_samples, wall_seconds)
+                          for name, endpoint_samples in by_name.items()},
+        }
+
+    def _compare(self, report, baseline, tolerance):
+        regressions = []
+        for name, metrics in report['endpoints'].items():
+            old = baseline.get('endpoints', {}).get(name)
+            if not old:
+                continue
+            before = old['latency']['p95_ms']
+            after = metrics['latency']['p95_ms']
+            line = '{} p95 latency: {:.3f} ms -> {:.3f} ms'.format(
+                name, before, after)
+            if after > before * (1 + tolerance):
+                regressions.append(line)
+                self.stdout.write(self.style.ERROR(line))
+            else:
+                self.stdout.write(line)
+
+            # Query counts don't depend on the machine, so any increase is a
+            # change in the code.
+            before = old['queries']['mean']
+            after = metrics['queries']['mean']
+            line = '{} queries: {:.2f} -> {:.2f}'.format(name, before, after)
+            if after > before + 0.5:
+                regressions.append(line)
+                self.stdout.write(self.style.ERROR(line))
+            elif after != before:
+                self.stdout.write(line)
+        return regressions
+
+    def handle(self, *args, **options):
+        model_file = options['model'] or os.path.join(
+            settings.PROJECT_DIR, 'testmodels', 'testmodel.model')
+        mix = parse_mix(options['mix']) if options['mix'] else DEFAULT_MIX
+        if not mix:
+            raise CommandError('The mix has no endpoints in it.')
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency must be at least 1')
+
+        caches = dict(settings.CACHES)
+        caches['similarity'] = {'BACKEND': (
+            'django.core.cache.backends.locmem.LocMemCache'
+            if options['cached']
+            else 'django.core.cache.backends.dummy.DummyCache')}
+
+        old_config = None
+        if not options['existing_db']:
+            old_config = setup_databases(verbosity=0, interactive=False,
+                                         keepdb=options['keepdb'])
+        try:
+            with override_settings(
+                    MODEL_FILE=model_file,
+                    CAPTCHA_TEST_MODE=True,
+                    UPLOAD_JOBS_INLINE=True,
+                    CACHES=caches,
+                    ALLOWED_HOSTS=settings.ALLOWED_HOSTS + ['testserver']):
+                if old_config is not None:
+                    call_command('loaddata', *FIXTURES, verbosity=0)
+                targets = self._targets(mix, options['upload'])
+
+                run = executor.run
+                executor.run = timed_run(run)
+                try:
+                    samples, wall_seconds = self._run(targets, mix, options)
+                finally:
+                    executor.run = run
+                report = self._report(samples, wall_seconds, model_file,
+                                      mix, options)
+        finally:
+            if old_config is not None:
+                teardown_databases(old_config, verbosity=0,
+                                   keepdb=options['keepdb'])
+
+        output = options['output'] or os.path.join(
+            settings.BASE_DIR, 'benchmarks', 'views-{}.json'.format(
+                datetime.now().strftime('%Y%m%d-%H%M%S')))
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+        for name in sorted(report['endpoints']):
+            metrics = report['endpoints'][name]
+            self.stdout.write(
+                '{:<20} {:>5} req {:>8.2f} req/s  p50 {p50_ms:>8.2f} ms  '
+                'p95 {p95_ms:>8.2f} ms  p99 {p99_ms:>8.2f} ms  '
+                '{:>6.1f} queries  {:>8.2f} ms model'.format(
+                    name, metrics['requests'], metrics['throughput_rps'],
+                    metrics['queries']['mean'], metrics['model_ms']['mean'],
+                    **metrics['latency']))
+        total = report['total']
+        self.stdout.write('{requests} requests in {wall_seconds:.1f}s '
+                          '({throughput_rps:.1f} req/s), {errors} errors'
+                          .format(**total))
+        self.stdout.write('Report written to {}'.format(output))
+        if total['errors']:
+            self.stdout.write(self.style.WARNING(
+                '{} requests failed'.format(total['errors'])))
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            regressions = self._compare(report, baseline,
+                                        options['tolerance'])
+            if regressions:
+                raise CommandError('{} endpoint metrics regressed'.format(
+                    len(regressions)))
+            self.stdout.write(self.style.SUCCESS(
+                'No regressions against {}'.format(options['baseline'])))
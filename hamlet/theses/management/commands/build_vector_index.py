@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from hamlet.common import vector_index
+from hamlet.common.neural_net import load_model
+
+
+class Command(BaseCommand):
+    help = ('Builds the nearest-neighbor index for a neural net and saves it '
+            'next to the model file')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', default=None,
+                            help='Model file (default: settings.MODEL_FILE)')
+        parser.add_argument('--kind', default='ivf',
+                            choices=sorted(vector_index.INDEX_CLASSES))
+        parser.add_argument('--nlist', type=int, default=None,
+                            help='Number of IVF clusters (default: square '
+                                 'root of the number of documents)')
+        parser.add_argument('--nprobe', type=int, default=8,
+                            help='Number of IVF clusters to search per query')
+
+    def handle(self, *args, **options):
+        model_file = options['model'] or settings.MODEL_FILE
+        model = load_model(model_file)
+
+        if options['kind'] == 'ivf':
+            index = vector_index.from_model(model, kind='ivf',
+                                            nlist=options['nlist'],
+                                            nprobe=options['nprobe'])
+        else:
+            index = vector_index.from_model(model, kind='exact')
+
+        path = vector_index.index_path(model_file)
+        index.save(path)
+        self.stdout.write(self.style.SUCCESS(
+            'Saved {} index of {} documents to {}'.format(
+                index.kind, len(index), path)))
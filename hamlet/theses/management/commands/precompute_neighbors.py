@@ -0,0 +1,95 @@
+import time
+
+import numpy as np
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from hamlet.common.cache import bump_version
+from hamlet.common.neural_net import get_model
+from hamlet.theses.models import Thesis, ThesisNeighbor
+
+
+class Command(BaseCommand):
+    help = ('Precomputes the most similar theses to every thesis in the '
+            'neural net and stores them in the ThesisNeighbor table')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--topn', type=int, default=50,
+                            help='Neighbors to store per thesis')
+        parser.add_argument('--batch-size', type=int, default=512,
+                            help='Theses per matrix multiplication; larger '
+                                 'is faster but uses more memory')
+
+    def _get_pks(self, docvecs, count):
+        # Maps each row of the docvecs matrix to a Thesis pk (or None, if
+        # the document isn't in the database).
+        pks_by_identifier = dict(
+            Thesis.objects.values_list('identifier', 'pk'))
+        pks = []
+        for index in range(count):
+            label = docvecs.index_to_doctag(index)
+            identifier = Thesis.identifier_from_label(label)
+            pks.append(pks_by_identifier.get(identifier))
+        return pks
+
+    def _neighbors_for_batch(self, vectors, start, end, topn, missing):
+        sims = np.dot(vectors[start:end], vectors.T)
+        # Never recommend a thesis as similar to itself, or documents we
+        # can't link to.
+        sims[np.arange(end - start), np.arange(start, end)] = -np.inf
+        sims[:, missing] = -np.inf
+
+        # argpartition finds the topn in linear time; then we only need to
+        # sort those.
+        best = np.argpartition(-sims, topn - 1, axis=1)[:, :topn]
+        best_sims = np.take_along_axis(sims, best, axis=1)
+        order = np.argsort(-best_sims, axis=1)
+        return (np.take_along_axis(best, order, axis=1),
+                np.take_along_axis(best_sims, order, axis=1))
+
+    def handle(self, *args, **options):
+        start_time = time.time()
+
+        model = get_model()
+        docvecs = model.docvecs
+        # Normalized, so that dot products are cosine similarities.
+        # (load_model leaves these to the code that needs them.)
+        docvecs.init_sims()
+        vectors = docvecs.doctag_syn0norm
+        count = len(vectors)
+
+        pks = self._get_pks(docvecs, count)
+        missing = np.array([pk is None for pk in pks])
+        topn = min(options['topn'], count - 1)
+        batch_size = options['batch_size']
+
+        neighbors = []
+        for start in range(0, count, batch_size):
+            end = min(start + batch_size, count)
+            best, best_sims = self._neighbors_for_batch(
+                vectors, start, end, topn, missing)
+            for row, thesis_pk in enumerate(pks[start:end]):
+                if thesis_pk is None:
+                    continue
+                for index, score in zip(best[row], best_sims[row]):
+                    if not np.isfinite(score):
+                        continue
+                    neighbors.append(ThesisNeighbor(
+                        thesis_id=thesis_pk,
+                        neighbor_id=pks[index],
+                        score=float(score)))
+
+            self.stdout.write(self.style.WARNING(
+                '%d of %d theses processed' % (end, count)))
+
+        with transaction.atomic():
+            ThesisNeighbor.objects.all().delete()
+            ThesisNeighbor.objects.bulk_create(neighbors, batch_size=5000)
+        # Cached similarity pages show the old neighbors.
+        bump_version()
+
+        self.stdout.write(self.style.SUCCESS(
+            '%d neighbors stored' % len(neighbors)))
+        self.stdout.write(self.style.SUCCESS(
+            '%d seconds elapsed' % (time.time() - start_time)))
@@ -0,0 +1,41 @@
+from datetime import timedelta
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from hamlet.common.neural_net import warm_up
+from hamlet.theses import jobs
+
+
+class Command(BaseCommand):
+    help = ('Runs queued similarity searches for uploaded documents (see '
+            'hamlet.theses.jobs)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Run all pending jobs, then exit')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait when the queue is empty')
+        parser.add_argument('--keep-hours', type=int, default=24,
+                            help='Delete finished jobs after this many hours')
+
+    def handle(self, *args, **options):
+        # Load the model before taking any jobs, so the first one isn't slow.
+        warm_up()
+        keep = timedelta(hours=options['keep_hours'])
+        last_cleanup = None
+
+        while True:
+            job = jobs.run_next()
+            if job is not None:
+                self.stdout.write('Job {} {}'.format(job.pk, job.status))
+                continue
+            if options['once']:
+                return
+
+            now = timezone.now()
+            if last_cleanup is None or now - last_cleanup > timedelta(hours=1):
+                jobs.delete_finished(now - keep)
+                last_cleanup = now
+            time.sleep(options['poll_interval'])
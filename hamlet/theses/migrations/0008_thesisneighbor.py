@@ -0,0 +1,30 @@
+# Generated by Django 2.2.19 on 2026-10-18 14:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('theses', '0007_remove_thesis__vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThesisNeighbor',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('neighbor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='theses.Thesis')),
+                ('thesis', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbors', to='theses.Thesis')),
+            ],
+            options={
+                'ordering': ['thesis', '-score'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='thesisneighbor',
+            index=models.Index(fields=['thesis', '-score'], name='theses_neighbor_score_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.19 on 2026-10-18 21:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('theses', '0009_uploadjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadjob',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='uploadjob',
+            name='started',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,11 +1,16 @@
 from functools import reduce
+import json
 import re
+import uuid
 
-from django.conf import settings
 from django.urls import reverse
 from django.db import models
+from django.db.models import Count, Prefetch, prefetch_related_objects
 from django.utils.functional import cached_property
 
+from hamlet.common import executor
+from hamlet.common.timing import timed
+
 
 class Person(models.Model):
     # NOTE: distinct people with the same name may be stored as the same Person
@@ -102,6 +107,54 @@ class Department(models.Model):
         ordering = ['name']
 
 
+def _people_prefetches():
+    # Fetches authors and advisors (with their Person records) and
+    # departments for a batch of theses in three queries, however many theses
+    # there are. See Thesis.authors and Thesis.advisors.
+    def contributions(role):
+        return Contribution.objects.filter(role=role).select_related(
+            'person').order_by('person__name')
+
+    return (Prefetch('contribution_set',
+                     queryset=contributions(Contribution.AUTHOR),
+                     to_attr='author_contributions'),
+            Prefetch('contribution_set',
+                     queryset=contributions(Contribution.ADVISOR),
+                     to_attr='advisor_contributions'),
+            'department')
+
+
+def prefetch_people(theses):
+    """Fetch the authors, advisors and departments of a list of theses (for
+    instance, similarity results) in a constant number of queries. Returns
+    the theses as a list."""
+    theses = list(theses)
+    prefetch_related_objects(theses, *_people_prefetches())
+    return theses
+
+
+def prefetch_citations(theses):
+    """Fetch the citations of a list of theses in one query, and set
+    `citation_count` on each. Returns the theses as a list."""
+    theses = list(theses)
+    prefetch_related_objects(theses, 'citation_set')
+    for thesis in theses:
+        thesis.citation_count = len(thesis.citation_set.all())
+    return theses
+
+
+class ThesisQuerySet(models.QuerySet):
+    def with_people(self):
+        """Prefetch authors, advisors and departments, so that displaying
+        them doesn't cost queries per thesis."""
+        return self.prefetch_related(*_people_prefetches())
+
+    def with_citations(self):
+        """Prefetch citations and annotate each thesis with citation_count."""
+        return self.prefetch_related('citation_set').annotate(
+            citation_count=Count('citation'))
+
+
 class Thesis(models.Model):
     REPLS = (('E.E', 'Elec.E'), ('Elect.E', 'Elec.E'), ('OceanE', 'Ocean.E'),
              ('M.ArchAS', 'M.Arch.A.S'), ('PhD', 'Ph.D'), ('ScD', 'Sc.D'))
@@ -135,6 +188,8 @@ class Thesis(models.Model):
             'the pdf failed; such theses are not part of the neural net, '
             'and cannot be used in data visualization.')
 
+    objects = ThesisQuerySet.as_manager()
+
     def __str__(self):
         return self.title
 
@@ -142,14 +197,28 @@ class Thesis(models.Model):
     def label(self):
         return '1721.1-{}.txt'.format(self.identifier)
 
+    @staticmethod
+    def identifier_from_label(label):
+        """Inverse of Thesis.label: turns neural net document tags (which are
+        filenames like 1721.1-39504.txt) back into identifiers."""
+        return int(label.split('-')[1].split('.')[0])
+
+    # If authors/advisors have been prefetched (with_people() or
+    # prefetch_people()), these are lists of Persons; otherwise they're
+    # Person querysets. Either way, iterate over them rather than calling
+    # queryset methods.
     @cached_property
     def authors(self):
+        if hasattr(self, 'author_contributions'):
+            return [c.person for c in self.author_contributions]
         contribs = Contribution.objects.filter(
             thesis=self, role=Contribution.AUTHOR)
         return Person.objects.filter(contribution__in=contribs)
 
     @cached_property
     def advisors(self):
+        if hasattr(self, 'advisor_contributions'):
+            return [c.person for c in self.advisor_contributions]
         contribs = Contribution.objects.filter(
             thesis=self, role=Contribution.ADVISOR)
         return Person.objects.filter(contribution__in=contribs)
@@ -189,13 +258,15 @@ class Thesis(models.Model):
             dept = Department.get_or_create_from_metadata(deptstring)
             self.department.add(dept)
 
+    DEGREE_PATTERN = re.compile(r'[A-Z][a-z]{,4}\.? ?[A-Z][a-z]{,3}\.?'
+                                r'[A-Z]?\.?[A-Z]?\.?[A-Z]?\.?')
+
     @classmethod
     def extract_degree(self, degree_statement):
         """Takes METS format metadata and finds degrees."""
         result = []
         try:
-            degree = re.findall(r'[A-Z][a-z]{,4}\.? ?[A-Z][a-z]{,3}\.?[A-Z]?\.?'
-                                r'[A-Z]?\.?[A-Z]?\.?', degree_statement)
+            degree = self.DEGREE_PATTERN.findall(degree_statement)
             for item in degree:
                 i = item.replace(' ', '')
                 i = i.rstrip('.')
@@ -212,6 +283,26 @@ class Thesis(models.Model):
 
     # See https://radimrehurek.com/gensim/models/doc2vec.html for affordances
     # offered by doc2vec.
+    MAX_SIMILAR = 50
+
+    def get_neighbors(self):
+        """Find the MAX_SIMILAR most similar theses, regardless of threshold,
+        as SimilarTheses. get_most_similar() is usually what you want; this is
+        useful if you want to keep the results and apply different cutoffs
+        later."""
+        # Use the precomputed neighbors if `manage.py precompute_neighbors`
+        # has been run; this is one indexed query and no model math.
+        neighbors = self.neighbors.select_related(
+            'neighbor')[:self.MAX_SIMILAR]
+        if neighbors:
+            return SimilarTheses(
+                [n.neighbor for n in neighbors],
+                {n.neighbor.pk: n.score for n in neighbors})
+
+        friends = executor.search_label(self.label, topn=self.MAX_SIMILAR)
+        return SimilarTheses.from_labels(friends)
+
+    @timed('most_similar')
     def get_most_similar(self, threshold=0.75, topn=50):
         """Find theses above a given similarity threshold. If there are more
         than topn, only the topn most similar will be returned (to a maximum
@@ -219,20 +310,56 @@ class Thesis(models.Model):
 
         Threshold defaults to 0.75, because in practice that seems to usually
         result in theses that humans find similar, but also a manageable number
-        of results."""
+        of results.
 
-        topn = min(topn, 50)
-        friends = settings.NEURAL_NET.docvecs.most_similar(
-            [self.label], topn=topn)
-
-        friend_labels = [x[0] for x in friends if x[1] > threshold]
-        friend_ids = [x.split('-')[1].split('.')[0] for x in friend_labels]
-        return Thesis.objects.filter(identifier__in=friend_ids)
+        Returns SimilarTheses, i.e. a list of theses, most similar first, which
+        also knows their similarity scores."""
+        return self.get_neighbors().cutoff(threshold, topn)
 
+    @classmethod
+    @timed('most_similar')
+    def get_most_similar_many(cls, theses, threshold=0.75, topn=50):
+        """get_most_similar() for several theses at once.
+
+        Returns a dict mapping the pk of each thesis to its SimilarTheses.
+        Precomputed neighbors are fetched in one query; any theses without
+        them are searched in one batch; and all the similar theses are then
+        fetched in one query. Theses which aren't in the neural net map to an
+        empty result."""
+        theses = list(theses)
+        similar = {thesis.pk: SimilarTheses() for thesis in theses}
+
+        neighbors = ThesisNeighbor.objects.filter(
+            thesis__in=theses).select_related('neighbor')
+        for neighbor in neighbors:
+            found = similar[neighbor.thesis_id]
+            found.append(neighbor.neighbor)
+            found.scores[neighbor.neighbor.pk] = neighbor.score
+        precomputed = set(n.thesis_id for n in neighbors)
+
+        pending = [thesis for thesis in theses
+                   if thesis.pk not in precomputed]
+        if pending:
+            results = executor.search_labels(
+                [thesis.label for thesis in pending], topn=cls.MAX_SIMILAR)
+            found = [(thesis.pk, friends)
+                     for thesis, friends in zip(pending, results)
+                     if friends is not None]
+
+            all_labels = [label for _, friends in found
+                          for label, _ in friends]
+            by_identifier = SimilarTheses.resolve_labels(all_labels)
+            for pk, friends in found:
+                similar[pk] = SimilarTheses.from_labels(
+                    friends, by_identifier)
+
+        return {pk: found.cutoff(threshold, topn)
+                for pk, found in similar.items()}
+
+    @timed('similarity')
     def get_similarity(self, thesis):
         """Get the similarity between this and another thesis."""
-        return settings.NEURAL_NET.docvecs.similarity(
-            self.label, thesis.label)
+        return executor.similarity(self.label, thesis.label)
 
     class Meta:
         verbose_name_plural = 'theses'
@@ -250,3 +377,162 @@ class Contribution(models.Model):
     thesis = models.ForeignKey(Thesis, on_delete=models.CASCADE)
     person = models.ForeignKey(Person, on_delete=models.CASCADE)
     role = models.CharField(max_length=7, choices=ROLE_CHOICES)
+
+
+class SimilarTheses(list):
+    """A list of theses, most similar first, which remembers how similar each
+    one was.
+
+    Use `score(thesis)` or iterate over `items()` for (thesis, score) pairs.
+    `cutoff()` applies a different threshold or topn without recomputing
+    anything, so one result can serve several cutoffs (or be cached and
+    cut later)."""
+    def __init__(self, theses=(), scores=None):
+        super(SimilarTheses, self).__init__(theses)
+        # Maps thesis pk to similarity score.
+        self.scores = scores if scores is not None else {}
+
+    @staticmethod
+    def resolve_labels(labels):
+        """Fetch the theses for a list of neural net labels in one query;
+        returns a dict keyed by identifier."""
+        identifiers = [Thesis.identifier_from_label(label)
+                       for label in labels]
+        return Thesis.objects.in_bulk(identifiers, field_name='identifier')
+
+    @classmethod
+    def from_labels(cls, labels_and_scores, by_identifier=None):
+        """Build from (neural net label, score) pairs, as returned by vector
+        index searches. Labels with no matching thesis are dropped. Pass
+        by_identifier (from resolve_labels) if the theses have already been
+        fetched."""
+        if by_identifier is None:
+            by_identifier = cls.resolve_labels(
+                [label for label, _ in labels_and_scores])
+        results = cls()
+        for label, score in labels_and_scores:
+            thesis = by_identifier.get(Thesis.identifier_from_label(label))
+            if thesis is not None:
+                results.append(thesis)
+                results.scores[thesis.pk] = score
+        return results
+
+    @classmethod
+    def from_pks(cls, pks_and_scores):
+        """Build from (thesis pk, score) pairs, e.g. the output of items()
+        saved as JSON. Theses which no longer exist are dropped."""
+        by_pk = Thesis.objects.in_bulk([pk for pk, _ in pks_and_scores])
+        results = cls()
+        for pk, score in pks_and_scores:
+            if pk in by_pk:
+                results.append(by_pk[pk])
+                results.scores[pk] = score
+        return results
+
+    def score(self, thesis):
+        return self.scores[thesis.pk]
+
+    def items(self):
+        return [(thesis, self.scores[thesis.pk]) for thesis in self]
+
+    def cutoff(self, threshold=None, topn=None, inclusive=False):
+        """Return the theses with similarity above threshold (or equal to
+        it, if inclusive), limited to the topn most similar."""
+        def passes(score):
+            if threshold is None:
+                return True
+            return score >= threshold if inclusive else score > threshold
+        theses = [thesis for thesis in self if passes(self.scores[thesis.pk])]
+        theses = theses[:topn]
+        return SimilarTheses(
+            theses, {thesis.pk: self.scores[thesis.pk] for thesis in theses})
+
+    def with_people(self):
+        prefetch_people(self)
+        return self
+
+    def with_citations(self):
+        prefetch_citations(self)
+        return self
+
+
+class ThesisNeighbor(models.Model):
+    """One of the most similar theses to a given thesis, according to the
+    neural net, with its similarity score.
+
+    These are precomputed for every thesis in the net by
+    `python manage.py precompute_neighbors`, so that similarity pages don't
+    have to search the whole net on every request. Rerun that command
+    whenever a new neural net is deployed."""
+    thesis = models.ForeignKey(Thesis, on_delete=models.CASCADE,
+                               related_name='neighbors')
+    neighbor = models.ForeignKey(Thesis, on_delete=models.CASCADE,
+                                 related_name='+')
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['thesis', '-score']
+        indexes = [models.Index(fields=['thesis', '-score'],
+                                name='theses_neighbor_score_idx')]
+
+
+class UploadJob(models.Model):
+    """An uploaded document waiting for (or done with) similarity search.
+
+    Inferring a vector for a document is slow, CPU-bound work, and in a
+    gevent worker it would stall every other request the worker is handling.
+    Upload views therefore just save a job and redirect to a page which polls
+    it; `python manage.py run_upload_jobs` does the work in a separate
+    process. See hamlet.theses.jobs."""
+    RECOMMEND = 'recommend'
+    LIT_REVIEW = 'lit_review'
+
+    KIND_CHOICES = (
+        (RECOMMEND, RECOMMEND),
+        (LIT_REVIEW, LIT_REVIEW),
+    )
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    STATUS_CHOICES = (
+        (PENDING, PENDING),
+        (RUNNING, RUNNING),
+        (DONE, DONE),
+        (FAILED, FAILED),
+    )
+
+    # Not sequential, so people can't browse each other's uploads.
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4,
+                          editable=False)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    status = models.CharField(max_length=7, choices=STATUS_CHOICES,
+                              default=PENDING)
+    # The uploaded file; emptied once the job has run.
+    document = models.BinaryField(blank=True)
+    # JSON list of [thesis pk, similarity score] pairs, most similar first.
+    result = models.TextField(blank=True)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    # When a worker last claimed the job, and how many times one has; see
+    # hamlet.theses.jobs.release_abandoned.
+    started = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created']
+        indexes = [models.Index(fields=['status', 'created'],
+                                name='theses_uploadjob_queue_idx')]
+
+    def get_absolute_url(self):
+        return reverse('theses:upload_job', kwargs={'pk': self.pk})
+
+    @property
+    def is_finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+    def get_suggestions(self):
+        return SimilarTheses.from_pks(json.loads(self.result))
@@ -0,0 +1,54 @@
+from io import StringIO
+import json
+import os
+import tempfile
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+
+from ..management.commands.benchmark_retrieval import (co_membership, ndcg,
+                                                       recall)
+
+
+class MetricsTests(SimpleTestCase):
+    def test_recall(self):
+        assert recall(['a', 'b', 'x'], ['a', 'b', 'c']) == 2 / 3
+
+    def test_ndcg_rewards_order(self):
+        sims = {'a': 0.9, 'b': 0.8, 'c': 0.7, 'x': 0.1}
+        assert ndcg(['a', 'b', 'c'], ['a', 'b', 'c'], sims.get) == 1.0
+        swapped = ndcg(['c', 'b', 'a'], ['a', 'b', 'c'], sims.get)
+        missed = ndcg(['a', 'b', 'x'], ['a', 'b', 'c'], sims.get)
+        assert missed < swapped < 1.0
+
+    def test_co_membership(self):
+        groups = {'q': {1}, 'a': {1, 2}, 'b': {3}}
+        assert co_membership('q', ['a', 'b'], groups) == 0.5
+        assert co_membership('b', [], groups) is None
+        assert co_membership('c', ['a'], groups) is None
+
+
+class BenchmarkRetrievalTests(TestCase):
+    fixtures = ['theses.json', 'departments.json', 'authors.json',
+                'contributions.json']
+
+    def test_writes_report(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'report.json')
+            call_command('benchmark_retrieval', queries=5, k=[5],
+                         output=output, stdout=StringIO())
+            with open(output) as f:
+                report = json.load(f)
+
+            # Comparing a report with itself finds no regressions.
+            call_command('benchmark_retrieval', queries=5, k=[5],
+                         output=os.path.join(tmp, 'again.json'),
+                         baseline=output, stdout=StringIO())
+
+        assert report['exact']['k']['5']['recall'] == 1.0
+        assert report['exact']['k']['5']['ndcg'] == 1.0
+        index = report['systems']['index']
+        assert index['queries'] == 5
+        assert set(index['latency']) >= {'p50_ms', 'p95_ms', 'p99_ms'}
+        if report['index']['kind'] == 'exact':
+            assert index['k']['5']['recall'] == 1.0
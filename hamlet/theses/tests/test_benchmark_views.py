@@ -0,0 +1,46 @@
+from io import StringIO
+import json
+import os
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase, TestCase
+
+from ..management.commands.benchmark_views import DEFAULT_MIX, parse_mix
+
+
+class ParseMixTests(SimpleTestCase):
+    def test_parse_mix(self):
+        assert parse_mix(['similar_to=3', 'autocomplete_author',
+                          'lit_review_buddy=0']) == {
+            'similar_to': 3.0, 'autocomplete_author': 1.0}
+
+    def test_unknown_endpoint(self):
+        with self.assertRaises(CommandError):
+            parse_mix(['admin=1'])
+
+
+class BenchmarkViewsTests(TestCase):
+    fixtures = ['theses.json', 'departments.json', 'authors.json',
+                'contributions.json']
+
+    def test_writes_report(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'report.json')
+            # One request at a time, in this thread, so that the requests see
+            # the fixtures loaded in this test's transaction.
+            options = {'existing_db': True, 'concurrency': 1,
+                       'requests': 30, 'warmup': 0}
+            call_command('benchmark_views', output=output, stdout=StringIO(),
+                         **options)
+            with open(output) as f:
+                report = json.load(f)
+
+        assert report['total']['requests'] == 30
+        assert report['total']['errors'] == 0
+        assert set(report['endpoints']) <= set(DEFAULT_MIX)
+        similar_to = report['endpoints']['similar_to']
+        assert set(similar_to['latency']) >= {'p50_ms', 'p95_ms', 'p99_ms'}
+        assert similar_to['queries']['mean'] > 0
+        assert similar_to['model_calls'] >= 1
@@ -4,20 +4,56 @@ from django.core.files.uploadedfile import UploadedFile
 from django.conf import settings
 from django.test import SimpleTestCase
 
-from hamlet.common.document import DocxDocument, factory
+from hamlet.common.document import DocxDocument, TextDocument, factory
+from hamlet.common.neural_net import get_model
 
 
 class DocumentTestCase(SimpleTestCase):
     fixtures = os.path.join(settings.BASE_DIR, 'hamlet/theses/fixtures')
 
+    def setUp(self):
+        self.vocab = get_model().wv.vocab
+
     def test_factory_returns_document_object(self):
         with open(os.path.join(self.fixtures, 'thesis.txt'), 'rb') as fp:
-            doc = factory(UploadedFile(fp))
-            assert doc.words[0] == 'Since'
-            assert doc.words[-1] == 'fluids.'
+            doc = factory(UploadedFile(fp), self.vocab)
+            # Words are tokenized the way the training corpus was.
+            assert doc.words[0] == 'since'
+            assert doc.words[-1] == 'fluids'
 
     def test_docx_document_returns_words(self):
         with open(os.path.join(self.fixtures, 'thesis.docx'), 'rb') as fp:
-            doc = DocxDocument(UploadedFile(fp))
-            assert doc.words[0] == 'Time'
-            assert doc.words[-1] == 'oneself.'
+            doc = DocxDocument(UploadedFile(fp), self.vocab)
+            assert doc.words[0] == 'time'
+            assert doc.words[-1] == 'oneself'
+
+    def test_text_document_stops_at_max_tokens(self):
+        with open(os.path.join(self.fixtures, 'thesis.txt'), 'rb') as fp:
+            doc = TextDocument(UploadedFile(fp), self.vocab, max_tokens=5)
+            assert len([word for word in doc.words
+                        if word in self.vocab]) == 5
+            assert doc.words[-1] in self.vocab
+            assert doc.words[0] == 'since'
+
+    def test_max_tokens_counts_only_vocabulary_words(self):
+        with open(os.path.join(self.fixtures, 'thesis.txt'), 'rb') as fp:
+            everything = TextDocument(UploadedFile(fp), set()).words
+            fp.seek(0)
+            vocab = set(everything[1::2])
+            doc = TextDocument(UploadedFile(fp), vocab, max_tokens=5)
+            # Other words are kept, but don't count.
+            assert doc.words == everything[:len(doc.words)]
+            assert len([word for word in doc.words if word in vocab]) == 5
+            assert doc.words[-1] in vocab
+
+    def test_reading_stops_without_vocabulary_words(self):
+        with open(os.path.join(self.fixtures, 'thesis.txt'), 'rb') as fp:
+            doc = TextDocument(UploadedFile(fp), set(), max_tokens=2)
+            assert len(doc.words) == 2 * TextDocument.READ_LIMIT_FACTOR
+
+    def test_factory_rewinds_file(self):
+        with open(os.path.join(self.fixtures, 'thesis.txt'), 'rb') as fp:
+            expected = TextDocument(UploadedFile(fp), self.vocab).words
+            fp.seek(0)
+            assert factory(UploadedFile(fp),
+                           self.vocab).words == expected
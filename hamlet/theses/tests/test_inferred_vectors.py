@@ -0,0 +1,39 @@
+from unittest.mock import patch
+
+import numpy as np
+
+from django.test import SimpleTestCase, override_settings
+
+from hamlet.common import inferred_vectors
+from hamlet.common.inferred_vectors import infer_vector
+from hamlet.common.neural_net import get_model
+
+
+class InferVectorTests(SimpleTestCase):
+    words = 'clock division as a power saving strategy'.split()
+
+    def setUp(self):
+        inferred_vectors._vectors.clear()
+
+    def test_deterministic(self):
+        first = infer_vector(self.words)
+        inferred_vectors._vectors.clear()
+        second = infer_vector(self.words)
+        assert np.array_equal(first, second)
+
+    def test_repeat_skips_inference(self):
+        first = infer_vector(self.words)
+        with patch.object(get_model(), 'infer_vector',
+                          side_effect=AssertionError):
+            second = infer_vector(self.words)
+        assert second is first
+
+    @override_settings(INFERRED_VECTOR_CACHE_SIZE=2)
+    def test_least_recently_used_evicted(self):
+        infer_vector(['one'])
+        infer_vector(['two'])
+        infer_vector(['one'])
+        infer_vector(['three'])
+        digests = [key[1] for key in inferred_vectors._vectors]
+        assert digests == [inferred_vectors._digest(['one']),
+                           inferred_vectors._digest(['three'])]
@@ -0,0 +1,92 @@
+from datetime import timedelta
+import os
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from hamlet.theses import jobs
+from hamlet.theses.models import UploadJob
+
+
+@override_settings(COMPRESS_ENABLED=False, UPLOAD_JOBS_INLINE=False)
+class UploadJobTests(TestCase):
+    fixtures = ['theses.json', 'departments.json', 'authors.json',
+                'contributions.json']
+    fix_path = os.path.join(settings.BASE_DIR, 'hamlet/theses/fixtures')
+
+    def setUp(self):
+        self.client = Client()
+
+    def _upload(self):
+        url = reverse('theses:upload_recommend')
+        with open(os.path.join(self.fix_path, '1721.1-33360.txt'), 'rb') as fp:
+            return self.client.post(url,
+                {"file": fp, "captcha_0": "sometext", "captcha_1": "PASSED"})
+
+    def test_upload_is_queued(self):
+        response = self._upload()
+        job = UploadJob.objects.get()
+        assert job.status == UploadJob.PENDING
+        self.assertRedirects(response, job.get_absolute_url())
+
+        response = self.client.get(job.get_absolute_url())
+        assert 'http-equiv="refresh"' in response.content.decode('utf-8')
+
+    def test_worker_runs_job(self):
+        self._upload()
+        call_command('run_upload_jobs', once=True, stdout=open(os.devnull, 'w'))
+
+        job = UploadJob.objects.get()
+        assert job.status == UploadJob.DONE
+        assert not job.document
+
+        response = self.client.get(job.get_absolute_url())
+        assert "Clock division as a power saving strategy" in \
+            response.content.decode('utf-8')
+
+    def test_invalid_document_fails_job(self):
+        upload = SimpleUploadedFile('image.txt', b'\x89PNG\r\n\x1a\n' * 10)
+        job = jobs.submit(UploadJob.RECOMMEND, upload)
+        jobs.run_next()
+        job.refresh_from_db()
+        assert job.status == UploadJob.FAILED
+        assert job.error
+
+    def test_claimed_job_not_claimed_again(self):
+        upload = SimpleUploadedFile('doc.txt', b'hello world')
+        jobs.submit(UploadJob.RECOMMEND, upload)
+        assert jobs.claim_next() is not None
+        assert jobs.claim_next() is None
+
+    def test_abandoned_job_is_requeued_then_failed(self):
+        upload = SimpleUploadedFile('doc.txt', b'hello world')
+        job = jobs.submit(UploadJob.RECOMMEND, upload)
+        assert jobs.claim_next() == job
+        later = timezone.now() + jobs.RUNNING_TIMEOUT + timedelta(minutes=1)
+
+        # Its worker died; the job goes back in the queue...
+        assert jobs.release_abandoned(later) == (1, 0)
+        job.refresh_from_db()
+        assert job.status == UploadJob.PENDING
+
+        # ...but if it keeps happening, it fails instead.
+        for _ in range(jobs.MAX_ATTEMPTS - 1):
+            assert jobs.claim_next() == job
+            jobs.release_abandoned(later)
+        job.refresh_from_db()
+        assert job.status == UploadJob.FAILED
+        assert job.is_finished
+        assert job.attempts == jobs.MAX_ATTEMPTS
+
+    def test_delete_finished_deletes_unfinished_old_jobs(self):
+        upload = SimpleUploadedFile('doc.txt', b'hello world')
+        jobs.submit(UploadJob.RECOMMEND, upload)
+        jobs.claim_next()
+        jobs.delete_finished(timezone.now() - timedelta(hours=1))
+        assert UploadJob.objects.count() == 1
+        jobs.delete_finished(timezone.now() + timedelta(hours=1))
+        assert UploadJob.objects.count() == 0
@@ -1,7 +1,13 @@
+from concurrent.futures import TimeoutError
+import time
+from unittest.mock import patch
+
 from django.urls import reverse
-from django.test import TestCase
+from django.test import TestCase, override_settings
+
+from hamlet.common import executor
 
-from ..models import Person, Department, Thesis
+from ..models import Person, Department, Thesis, ThesisNeighbor
 
 
 class PersonTestCase(TestCase):
@@ -181,3 +187,77 @@ class ThesisTestCase(TestCase):
         expected = reverse('theses:similar_to',
                            kwargs={'identifier': t.identifier})
         assert t.get_absolute_url() == expected
+
+    def test_get_most_similar_uses_precomputed_neighbors(self):
+        thesis = Thesis.objects.get(pk=76265)
+        ThesisNeighbor.objects.create(
+            thesis=thesis, neighbor_id=60330, score=0.9)
+        ThesisNeighbor.objects.create(
+            thesis=thesis, neighbor_id=43703, score=0.95)
+        ThesisNeighbor.objects.create(
+            thesis=thesis, neighbor_id=32600, score=0.5)
+
+        # The neural net shouldn't be consulted at all.
+        with patch('hamlet.common.executor.run', side_effect=AssertionError):
+            similar = thesis.get_most_similar()
+
+        # Ordered by score, and thresholded.
+        assert [t.pk for t in similar] == [43703, 60330]
+        assert similar.score(similar[0]) == 0.95
+
+        # Other cutoffs can be applied to the same result.
+        assert [t.pk for t in similar.cutoff(topn=1)] == [43703]
+        assert [t.pk for t in thesis.get_neighbors().cutoff(0.4)] == \
+            [43703, 60330, 32600]
+
+    def test_cutoff_at_threshold(self):
+        thesis = Thesis.objects.get(pk=76265)
+        ThesisNeighbor.objects.create(
+            thesis=thesis, neighbor_id=43703, score=0.75)
+        # get_most_similar only keeps scores above its threshold...
+        assert list(thesis.get_most_similar()) == []
+        # ...while get_similar_documents keeps scores equal to its own.
+        neighbors = thesis.get_neighbors()
+        assert [t.pk for t in neighbors.cutoff(0.75, inclusive=True)] == \
+            [43703]
+
+    def test_get_most_similar_many_uses_one_query(self):
+        first = Thesis.objects.get(pk=76265)
+        second = Thesis.objects.get(pk=60330)
+        ThesisNeighbor.objects.create(
+            thesis=first, neighbor_id=60330, score=0.9)
+        ThesisNeighbor.objects.create(
+            thesis=second, neighbor_id=76265, score=0.9)
+        ThesisNeighbor.objects.create(
+            thesis=second, neighbor_id=43703, score=0.8)
+
+        with self.assertNumQueries(1):
+            similar = Thesis.get_most_similar_many([first, second])
+
+        assert [t.pk for t in similar[first.pk]] == [60330]
+        assert [t.pk for t in similar[second.pk]] == [76265, 43703]
+
+    def test_model_calls_in_process_pool_match_inline(self):
+        thesis = Thesis.objects.get(pk=76265)
+        other = Thesis.objects.get(pk=60330)
+        inline = thesis.get_neighbors()
+        similarity = thesis.get_similarity(other)
+
+        with override_settings(MODEL_EXECUTOR_PROCESSES=1):
+            pooled = thesis.get_neighbors()
+            assert thesis.get_similarity(other) == similarity
+
+        assert pooled.items() == inline.items()
+
+    def test_timed_out_call_restarts_pool(self):
+        with override_settings(MODEL_EXECUTOR_PROCESSES=1,
+                               MODEL_EXECUTOR_TIMEOUT=0.2):
+            executor.start_pool()
+            stuck = executor._pool
+            with self.assertRaises(TimeoutError):
+                executor.run(time.sleep, 30)
+            # The stuck process was killed rather than left holding the
+            # only slot, and the next call gets a fresh pool.
+            assert executor._pool is None
+            assert executor.run(abs, -1) == 1
+            assert executor._pool is not stuck
@@ -0,0 +1,129 @@
+import json
+import os
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from hamlet.common import timing
+
+from ..models import Thesis
+
+
+class HistogramTests(SimpleTestCase):
+    def test_percentiles(self):
+        histogram = timing.Histogram()
+        for ms in [0.5] * 90 + [30] * 9 + [20000]:
+            histogram.add(ms)
+        stats = histogram.as_dict()
+        assert stats['count'] == 100
+        assert stats['p50'] == 1
+        assert stats['p95'] == 50
+        assert stats['p99'] == 50
+        assert histogram.percentile(100) == 20000
+        assert stats['buckets'] == {'<=1': 90, '<=50': 9, '>10000': 1}
+
+    def test_timed_calls_through_outside_requests(self):
+        @timing.timed('phase')
+        def double(x):
+            return 2 * x
+        assert double(2) == 4
+
+    def test_nested_phases_record_self_time(self):
+        timings = timing.RequestTimings()
+
+        @timing.timed('inner')
+        def inner():
+            time.sleep(0.05)
+
+        @timing.timed('outer')
+        def outer():
+            time.sleep(0.005)
+            inner()
+            again()
+
+        @timing.timed('outer')
+        def again():
+            time.sleep(0.005)
+
+        timing._current.timings = timings
+        try:
+            start = time.perf_counter()
+            outer()
+            elapsed = time.perf_counter() - start
+        finally:
+            timing._current.timings = None
+
+        assert set(timings.phases) == {'outer', 'outer.inner'}
+        assert timings.calls == {'outer': 1, 'outer.inner': 1}
+        assert timings.phases['outer.inner'] >= 0.05
+        # outer's own sleeps, including again()'s, but not inner()'s.
+        assert 0.01 <= timings.phases['outer'] < 0.05
+        assert sum(timings.phases.values()) <= elapsed
+
+
+class TimingMiddlewareTests(TestCase):
+    fixtures = ['theses.json', 'departments.json', 'authors.json',
+                'contributions.json']
+
+    def setUp(self):
+        timing.reset()
+        thesis = Thesis.objects.get(pk=76265)
+        self.url = reverse('theses:similar_to',
+                           kwargs={'identifier': thesis.identifier})
+
+    def test_off_by_default(self):
+        response = self.client.get(self.url)
+        assert 'Server-Timing' not in response
+        assert timing.histograms() == {}
+
+    @override_settings(REQUEST_TIMING=True)
+    def test_times_similar_to(self):
+        with self.assertLogs('hamlet.timing', 'INFO') as logs:
+            response = self.client.get(self.url)
+        header = response['Server-Timing']
+        assert 'most_similar;dur=' in header
+        assert 'most_similar.search;dur=' in header
+        assert 'db;dur=' in header
+
+        line = json.loads(logs.records[0].getMessage())
+        assert line['view'] == 'theses:similar_to'
+        assert line['status'] == 200
+        assert line['queries'] > 0
+        assert line['calls']['most_similar'] == 1
+        assert line['ms']['total'] >= sum(line['ms'].values()) - \
+            line['ms']['total']
+
+        histograms = timing.histograms()['theses:similar_to']
+        assert histograms['total']['count'] == 1
+        assert histograms['queries']['count'] == 1
+
+    @override_settings(REQUEST_TIMING=True)
+    def test_times_upload(self):
+        url = reverse('theses:upload_recommend')
+        path = os.path.join(settings.PROJECT_DIR, 'theses', 'fixtures',
+                            '1721.1-33360.txt')
+        with open(path, 'rb') as fp:
+            response = self.client.post(
+                url,
+                {"file": fp, "captcha_0": "sometext", "captcha_1": "PASSED"})
+        header = response['Server-Timing']
+        assert 'open;dur=' in header
+        assert 'similar_documents;dur=' in header
+        assert 'similar_documents.parse;dur=' in header
+
+    @override_settings(REQUEST_TIMING=True)
+    def test_stats_are_staff_only(self):
+        self.client.get(self.url)
+        stats_url = reverse('timing_stats')
+        response = self.client.get(stats_url)
+        assert response.status_code == 302
+
+        User.objects.create_user('staff', password='password',
+                                 is_staff=True)
+        self.client.login(username='staff', password='password')
+        stats = self.client.get(stats_url).json()
+        assert stats['enabled']
+        assert stats['views']['theses:similar_to']['total']['count'] == 1
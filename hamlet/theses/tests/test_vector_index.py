@@ -0,0 +1,49 @@
+import os
+import tempfile
+
+import numpy as np
+
+from django.test import SimpleTestCase
+
+from hamlet.common import vector_index
+
+
+class VectorIndexTestCase(SimpleTestCase):
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.vectors = random.normal(size=(200, 16)).astype(np.float32)
+        self.labels = ['1721.1-{}.txt'.format(i) for i in range(200)]
+
+    def _brute_force(self, label, topn):
+        normed = self.vectors / np.linalg.norm(
+            self.vectors, axis=1, keepdims=True)
+        sims = normed.dot(normed[self.labels.index(label)])
+        order = [i for i in np.argsort(-sims) if self.labels[i] != label]
+        return [self.labels[i] for i in order[:topn]]
+
+    def test_exact_index_matches_brute_force(self):
+        index = vector_index.ExactIndex(self.vectors, self.labels)
+        found = [label for label, _ in index.search_label(self.labels[7], 10)]
+        assert found == self._brute_force(self.labels[7], 10)
+
+    def test_ivf_index_probing_every_cluster_is_exact(self):
+        index = vector_index.IVFIndex.build(self.vectors, self.labels,
+                                            nlist=8)
+        index.nprobe = index.nlist
+        found = [label for label, _ in index.search_label(self.labels[7], 10)]
+        assert found == self._brute_force(self.labels[7], 10)
+
+    def test_save_and_load(self):
+        index = vector_index.IVFIndex.build(self.vectors, self.labels,
+                                            nlist=8, nprobe=3)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = vector_index.index_path(
+                os.path.join(tmpdir, 'test.model'))
+            index.save(path)
+            loaded = vector_index.load(path)
+
+            assert isinstance(loaded, vector_index.IVFIndex)
+            assert isinstance(loaded.vectors, np.memmap)
+            assert loaded.nprobe == 3
+            assert (loaded.search_label(self.labels[0]) ==
+                    index.search_label(self.labels[0]))
@@ -2,11 +2,17 @@ import os
 import re
 
 from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.template.loader import render_to_string
 from django.urls import reverse
 from django.test import Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from hamlet.common.cache import bump_version
 
 from ..forms import AuthorAutocompleteForm, TitleAutocompleteForm
-from ..models import Thesis, Person, Contribution
+from ..models import Thesis, Person, Contribution, prefetch_people
 from .. import views
 
 
@@ -76,6 +82,75 @@ class SimilarToViewTests(BaseTestCase):
         assert view_thesis.pk == thesis.pk
 
 
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'similarity': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'similarity-tests',
+    },
+})
+class CachedGetMixinTests(BaseTestCase):
+    def setUp(self):
+        caches['similarity'].clear()
+
+    def test_repeat_request_served_from_cache(self):
+        thesis = Thesis.objects.get(pk=76265)
+        url = reverse('theses:similar_to',
+            kwargs={'identifier': thesis.identifier})
+        first = self.client.get(url)
+
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+
+        assert second.status_code == 200
+        assert second.content == first.content
+
+    def test_bump_version_invalidates(self):
+        thesis = Thesis.objects.get(pk=76265)
+        url = reverse('theses:similar_to',
+            kwargs={'identifier': thesis.identifier})
+        self.client.get(url)
+
+        bump_version()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        assert len(queries)
+
+    def test_autocomplete_not_cached(self):
+        url = reverse('theses:autocomplete_author')
+        self.client.get(url, {'q': 'Zed'})
+        person = Person.objects.create(name='Zed Zedson')
+        Contribution.objects.create(person=person,
+                                    thesis=Thesis.objects.first(),
+                                    role=Contribution.AUTHOR)
+
+        response = self.client.get(url, {'q': 'Zed'})
+        assert 'Zed Zedson' in response.content.decode('utf-8')
+
+    def test_not_found_not_cached(self):
+        url = reverse('theses:similar_to', kwargs={'identifier': 999999999})
+        assert self.client.get(url).status_code == 404
+        assert self.client.get(url).status_code == 404
+
+
+class SuggestionRenderingTests(BaseTestCase):
+    def _count_rendering_queries(self, theses):
+        with CaptureQueriesContext(connection) as queries:
+            render_to_string('theses/_similar_to_one_thesis.html',
+                             {'suggestions': prefetch_people(theses)})
+        return len(queries)
+
+    def test_query_count_independent_of_suggestions(self):
+        theses = list(Thesis.objects.all())
+        assert len(theses) > 1
+
+        one = self._count_rendering_queries(theses[:1])
+        # Fresh instances, so nothing is cached from the first render.
+        many = self._count_rendering_queries(list(Thesis.objects.all()))
+
+        assert one == many
+
+
 class SimilarToByAuthorViewTests(BaseTestCase):
     def test_correct_theses_in_context(self):
         url = reverse('theses:similar_to_by_author', kwargs={'pk': 63970})
@@ -244,7 +319,8 @@ class UploadRecommendationViewTests(BaseTestCase):
         url = reverse('theses:upload_recommend')
         with open(os.path.join(self.fix_path, '1721.1-33360.txt'), 'rb') as fp:
             response = self.client.post(url,
-                {"file": fp, "captcha_0": "sometext", "captcha_1": "PASSED"})
+                {"file": fp, "captcha_0": "sometext", "captcha_1": "PASSED"},
+                follow=True)
         assert "Clock division as a power saving strategy" in \
             response.content.decode('utf-8')
 
@@ -252,6 +328,7 @@ class UploadRecommendationViewTests(BaseTestCase):
         url = reverse('theses:upload_recommend')
         with open(os.path.join(self.fix_path, '1721.1-33360.docx'), 'rb') as fp:
             response = self.client.post(url,
-                {"file": fp, "captcha_0": "sometext", "captcha_1": "PASSED"})
+                {"file": fp, "captcha_0": "sometext", "captcha_1": "PASSED"},
+                follow=True)
         assert "Clock division as a power saving strategy" in \
             response.content.decode('utf-8')
@@ -17,4 +17,6 @@ urlpatterns = [
         views.AutocompleteThesisView.as_view(), name='autocomplete_thesis'),
     path('upload/recommend/',
         views.UploadRecommendationView.as_view(), name='upload_recommend'),
+    path('upload/<uuid:pk>/',
+        views.UploadJobView.as_view(), name='upload_job'),
 ]
@@ -1,22 +1,61 @@
 from dal import autocomplete
 
 from django.contrib import messages
-from django.http import Http404, HttpResponseRedirect
-from django.shortcuts import render
+from django.http import Http404, HttpResponse, HttpResponseRedirect
 from django.urls import reverse
 from django.views.generic import TemplateView
 from django.views.generic.detail import DetailView
 from django.views.generic.edit import FormView
 
-from hamlet.common.document import factory
+from hamlet.common.cache import cache_key, similarity_cache
 from hamlet.common.forms import UploadFileForm
-from hamlet.common.inferred_vectors import get_similar_documents
 
+from . import jobs
 from .forms import TitleAutocompleteForm, AuthorAutocompleteForm
-from .models import Thesis, Person, Contribution
+from .models import (Thesis, Person, Contribution, UploadJob,
+                     prefetch_people)
+
+
+class CachedGetMixin(object):
+    """Serves GET requests from the similarity cache when possible.
+
+    The key is the view's class name, get_cache_parts(), the model
+    fingerprint and the cache version (see hamlet.common.cache), so a new
+    model, or new precomputed neighbors, invalidates everything. A cache hit
+    doesn't touch the neural net or the database. Only use this for pages
+    derived from the model: other data (e.g. autocomplete results) can
+    change without invalidating the cache."""
+    cache_timeout = 60 * 60 * 24
+
+    def get_cache_parts(self):
+        return [self.kwargs[key] for key in sorted(self.kwargs)]
+
+    def get(self, request, *args, **kwargs):
+        cache = similarity_cache()
+        key = cache_key(type(self).__name__, *self.get_cache_parts())
+        cached = cache.get(key)
+        if cached is not None:
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+
+        response = super(CachedGetMixin, self).get(request, *args, **kwargs)
+        if response.status_code != 200:
+            return response
+
+        def store(response):
+            cache.set(key, (response.content, response['Content-Type']),
+                      self.cache_timeout)
+
+        # Template responses aren't rendered until later in the response
+        # cycle.
+        if getattr(response, 'is_rendered', True):
+            store(response)
+        else:
+            response.add_post_render_callback(store)
+        return response
 
 
-class SimilarToView(DetailView):
+class SimilarToView(CachedGetMixin, DetailView):
     """Given a Thesis, shows the most similar Theses."""
     template_name = 'theses/similar_to.html'
 
@@ -27,7 +66,8 @@ class SimilarToView(DetailView):
         if thesis.unextractable:
             context['unextractable'] = True
         else:
-            context['suggestions'] = thesis.get_most_similar(topn=10)
+            context['suggestions'] = thesis.get_most_similar(
+                topn=10).with_people()
 
         return context
 
@@ -40,7 +80,7 @@ class SimilarToView(DetailView):
             raise Http404('No matching thesis was found')
 
 
-class SimilarToByAuthorView(DetailView):
+class SimilarToByAuthorView(CachedGetMixin, DetailView):
     """Given an author, shows the most similar theses to all of their works."""
     template_name = 'theses/similar_to_by_authors.html'
     model = Person
@@ -49,7 +89,14 @@ class SimilarToByAuthorView(DetailView):
         context = super(SimilarToByAuthorView, self).get_context_data(**kwargs)
         context['theses'] = []
 
-        theses = self.get_theses()
+        theses = list(self.get_theses())
+        # Look up suggestions for all of the author's theses at once, rather
+        # than one thesis at a time.
+        suggestions = Thesis.get_most_similar_many(
+            [thesis for thesis in theses if not thesis.unextractable],
+            topn=10)
+        prefetch_people(
+            [s for similar in suggestions.values() for s in similar])
         for thesis in theses:
             if thesis.unextractable:
                 context['theses'].append({
@@ -59,7 +106,7 @@ class SimilarToByAuthorView(DetailView):
             else:
                 context['theses'].append({
                     'object': thesis,
-                    'suggestions': thesis.get_most_similar(topn=10)
+                    'suggestions': suggestions[thesis.pk]
                 })
 
         return context
@@ -134,7 +181,36 @@ class UploadRecommendationView(FormView):
     form_class = UploadFileForm
 
     def form_valid(self, form):
-        context = {}
-        doc = factory(self.request.FILES['file'])
-        context['suggestions'] = get_similar_documents(doc)
-        return render(self.request, 'theses/similar_to.html', context)
+        job = jobs.submit(UploadJob.RECOMMEND, self.request.FILES['file'])
+        return HttpResponseRedirect(job.get_absolute_url())
+
+
+class UploadJobView(DetailView):
+    """Shows the results of an uploaded document's similarity search, or a
+    page which refreshes itself until they're ready."""
+    model = UploadJob
+    context_object_name = 'job'
+    # Seconds between refreshes while the job is running.
+    refresh = 2
+
+    def get_template_names(self):
+        if self.object.status != UploadJob.DONE:
+            return ['theses/upload_job.html']
+        if self.object.kind == UploadJob.LIT_REVIEW:
+            return ['citations/lit_review_outcomes.html']
+        return ['theses/similar_to.html']
+
+    def get_context_data(self, **kwargs):
+        context = super(UploadJobView, self).get_context_data(**kwargs)
+        job = self.object
+        if job.status != UploadJob.DONE:
+            context['refresh'] = self.refresh
+        elif job.kind == UploadJob.LIT_REVIEW:
+            suggestions = job.get_suggestions().with_citations()
+            context['suggestions'] = suggestions
+            context['total_suggestions'] = sum([
+                doc.citation_count for doc in suggestions
+            ])
+        else:
+            context['suggestions'] = job.get_suggestions().with_people()
+        return context
@@ -17,7 +17,10 @@ from django.urls import include, path
 from django.contrib import admin
 from django.views.generic import TemplateView
 
+from hamlet.common.views import timing_stats
+
 urlpatterns = [
+    path('admin/timing/', timing_stats, name='timing_stats'),
     path('admin/', admin.site.urls),
     path('', TemplateView.as_view(template_name='home.html'), name='home'),
     path('about/',
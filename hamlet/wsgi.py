@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "hamlet.settings.base")
 
 application = get_wsgi_application()
+
+# Web processes will need the neural net, so load it at boot instead of making
+# the first request wait for it. (Imported after get_wsgi_application() so that
+# settings are configured.)
+from hamlet.common.neural_net import warm_up  # noqa
+
+warm_up()